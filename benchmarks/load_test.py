@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xmlrpc.client
+
+# Permite rodar a partir da pasta benchmarks/ importando os módulos do projeto
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from ratelimit import DEFAULT_LIMITS
+from wire import WireProxy
+
+
+class Stats:
+    # Latências por RPC (segundos) e erros, compartilhadas entre todas as threads de usuários
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, elapsed, ok=True):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(method, []).append(elapsed)
+            else:
+                self.errors[method] = self.errors.get(method, 0) + 1
+
+    def timed(self, proxy, method, *params):
+        started = time.perf_counter()
+        try:
+            result = getattr(proxy, method)(*params)
+        except Exception:
+            self.record(method, 0, ok=False)
+            raise
+        self.record(method, time.perf_counter() - started)
+        return result
+
+    def summary(self, duration):
+        report = {}
+        with self.lock:
+            methods = set(self.latencies) | set(self.errors)
+            for method in sorted(methods):
+                samples = sorted(self.latencies.get(method, []))
+                report[method] = {
+                    'calls': len(samples),
+                    'errors': self.errors.get(method, 0),
+                    'calls_per_second': round(len(samples) / duration, 1),
+                    'p50_ms': percentile(samples, 50),
+                    'p95_ms': percentile(samples, 95),
+                    'p99_ms': percentile(samples, 99),
+                }
+        return report
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return round(samples[index] * 1000, 2)
+
+
+def rss_kb(pid):
+    # Memória residente do processo, lida de /proc (Linux)
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def wait_for(url, timeout=15):
+    # Aguarda o processo começar a responder
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return xmlrpc.client.ServerProxy(url, allow_none=True).get_transports()
+        except xmlrpc.client.Fault:
+            return {}  # Binder: responde, mas não tem get_transports
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} não respondeu em {timeout}s")
+
+
+def connect(args, transports):
+    if args.transport == 'json':
+        return WireProxy('localhost', transports['json'])
+    return xmlrpc.client.ServerProxy(f'http://localhost:{args.port}', allow_none=True)
+
+
+def join_user(args, join_stats, transports, username, room_name, rng, stop):
+    # Conecta e entra na sala, repetindo com backoff exponencial (com jitter) se o servidor recusar ou
+    # a conexão falhar; cada tentativa que falha conta como erro. None se o teste acabar antes
+    delay = 0.1
+    while not stop.is_set():
+        try:
+            proxy = connect(args, transports)
+            poller = connect(args, transports) if args.transport == 'xmlrpc' else proxy  # JSON: pipelining na mesma conexão
+        except OSError:
+            join_stats.record('connect', 0, ok=False)
+        else:
+            try:
+                joined = join_stats.timed(proxy, 'join_room', username, room_name)
+                return proxy, poller, joined['cursor']
+            except Exception:
+                if args.transport == 'json':
+                    proxy.close()  # A conexão pode ter caído: a próxima tentativa abre outra
+        stop.wait(delay * rng.uniform(0.5, 1.5))
+        delay = min(delay * 2, 5)
+    return None
+
+
+def run_user(args, stats, join_stats, transports, username, room_name, members, ready, stop):
+    # Um usuário sintético: entra na sala e espera todos entrarem (ready); depois envia mensagens em
+    # intervalos exponenciais (taxa --send-rate) e, em outra thread, acompanha a sala como o update_chat
+    # do cliente (long-polling a partir do cursor)
+    rng = random.Random(username)
+    connection = join_user(args, join_stats, transports, username, room_name, rng, stop)
+    if connection is None:
+        return
+    proxy, poller, cursor = connection
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        return  # Outros usuários não conseguiram entrar: o teste foi abortado
+
+    def poll():
+        nonlocal cursor
+        while not stop.is_set():
+            try:
+                result = stats.timed(poller, 'wait_for_messages', username, room_name, cursor, args.poll_timeout)
+                cursor = result['cursor']
+            except Exception:
+                time.sleep(1)
+
+    threading.Thread(target=poll, daemon=True).start()
+    while not stop.wait(rng.expovariate(args.send_rate) if args.send_rate > 0 else 3600):
+        try:
+            if rng.random() < args.private_ratio:
+                recipient = rng.choice(members)
+                stats.timed(proxy, 'bulk_send_message', username, room_name, 'mensagem privada', recipient)
+            else:
+                stats.timed(proxy, 'send_message', username, room_name, 'mensagem de carga', '')
+        except Exception:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do chat: inicia binder e servidor e simula usuários.")
+    parser.add_argument('--users', type=int, default=500, help="Usuários sintéticos (padrão: 500)")
+    parser.add_argument('--rooms', type=int, default=20, help="Salas; os usuários são distribuídos entre elas (padrão: 20)")
+    parser.add_argument('--duration', type=float, default=30, help="Segundos de carga após todos entrarem (padrão: 30)")
+    parser.add_argument('--join-timeout', type=float, default=120,
+                        help="Segundos para todos os usuários entrarem nas salas; depois disso o teste é abortado (padrão: 120)")
+    parser.add_argument('--send-rate', type=float, default=0.2, help="Mensagens por segundo por usuário (padrão: 0.2)")
+    parser.add_argument('--private-ratio', type=float, default=0.1, help="Fração de mensagens privadas (padrão: 0.1)")
+    parser.add_argument('--poll-timeout', type=float, default=25, help="Timeout do long-polling, como no cliente (padrão: 25)")
+    parser.add_argument('--transport', choices=['xmlrpc', 'json'], default='xmlrpc', help="Protocolo dos usuários (padrão: xmlrpc)")
+    parser.add_argument('--port', type=int, default=8900, help="Porta do servidor de chat (padrão: 8900)")
+    parser.add_argument('--binder-port', type=int, default=5900, help="Porta do binder (padrão: 5900)")
+    parser.add_argument('--server-args', default='--fsync never', help="Opções extras do server.py (padrão: '--fsync never')")
+    parser.add_argument('--keep-limits', action='store_true',
+                        help="Mantém os limites de chamadas e o descarte de carga do servidor (padrão: desativados, "
+                             "todos os usuários saem do mesmo endereço e a criação das salas é sequencial)")
+    parser.add_argument('--output', help="Arquivo do relatório JSON (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    limit_args = [] if args.keep_limits else ['--shed-at', '0']
+    if not args.keep_limits:
+        for method in DEFAULT_LIMITS:
+            limit_args += ['--rate-limit', f'{method}=0']
+    stats = Stats()
+    setup_stats = Stats()  # Registro e criação de salas, antes da janela de carga
+    join_stats = Stats()  # Conexões e join_room dos usuários (com as novas tentativas), também fora da janela
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory() as data_dir:
+        binder = subprocess.Popen([sys.executable, os.path.join(ROOT, 'binder.py'), '--port', str(args.binder_port)],
+                                  cwd=data_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--port', str(args.port),
+                                   '--binder', f'http://localhost:{args.binder_port}', '--data-dir', data_dir,
+                                   *limit_args, *shlex.split(args.server_args)],
+                                  cwd=data_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f'http://localhost:{args.binder_port}')
+            transports = wait_for(f'http://localhost:{args.port}')
+            if args.transport == 'json' and 'json' not in transports:
+                raise RuntimeError("O servidor não oferece o protocolo JSON.")
+
+            rss = []  # (segundos desde o início, KB)
+            started = time.time()
+
+            def sample_rss():
+                while not stop.is_set():
+                    rss.append((round(time.time() - started, 1), rss_kb(server.pid)))
+                    stop.wait(1)
+
+            threading.Thread(target=sample_rss, daemon=True).start()
+
+            # Preparação: registra os usuários e cria as salas (também medido)
+            setup = connect(args, transports)
+            usernames = [f'user{i}' for i in range(args.users)]
+            room_names = [f'room{i}' for i in range(args.rooms)]
+            setup_started = time.time()
+            for username in usernames:
+                setup_stats.timed(setup, 'login_user', username, 'senha')
+            for room_name in room_names:
+                setup_stats.timed(setup, 'create_room', room_name)
+            setup_duration = time.time() - setup_started
+            members = {room_name: usernames[i::args.rooms] for i, room_name in enumerate(room_names)}
+
+            # A janela de carga só começa quando todos os usuários passam pela barreira, já dentro das salas
+            ready = threading.Barrier(args.users + 1)
+            threads = []
+            join_started = time.time()
+            for i, username in enumerate(usernames):
+                room_name = room_names[i % args.rooms]
+                thread = threading.Thread(target=run_user, daemon=True,
+                                          args=(args, stats, join_stats, transports, username, room_name,
+                                                members[room_name], ready, stop))
+                thread.start()
+                threads.append(thread)
+            try:
+                ready.wait(timeout=args.join_timeout)
+            except threading.BrokenBarrierError:
+                raise RuntimeError(f"Nem todos os usuários entraram nas salas em {args.join_timeout}s: "
+                                   f"{join_stats.summary(args.join_timeout)}")
+            join_duration = time.time() - join_started
+            load_started = time.time()
+            time.sleep(args.duration)
+            stop.set()
+            duration = time.time() - load_started
+            report = {
+                'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                'duration_s': round(duration, 1),
+                'setup': setup_stats.summary(setup_duration),
+                'join_s': round(join_duration, 1),
+                'join': join_stats.summary(join_duration),
+                'rpc': stats.summary(duration),
+                'server_rss_kb': rss,
+            }
+        finally:
+            stop.set()
+            server.terminate()
+            binder.terminate()
+            server.wait()
+            binder.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Permite rodar a partir da pasta benchmarks/ importando os módulos do projeto
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+
+
+def measure(count, text_size, private_every):
+    # Envia count mensagens para uma sala e mede a memória retida por mensagem e a vazão de envios
+    server.print = lambda *args, **kwargs: None  # Sem log no console durante a medição
+    with tempfile.TemporaryDirectory() as data_dir:
+        chat = server.ChatServer(data_dir=data_dir, fsync='never', history_limit=count)
+        for name in ('alice', 'bob'):
+            chat.login_user(name, 'senha')
+        chat.create_room('bench')
+        chat.join_room('alice', 'bench')
+        chat.join_room('bob', 'bench')
+
+        # Conteúdo gerado antes da medição: só o que o servidor aloca entra na conta
+        texts = [f"{i:08d}".ljust(text_size, 'x') for i in range(count)]
+        recipients = ['bob' if private_every and i % private_every == 0 else None for i in range(count)]
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for text, recipient in zip(texts, recipients):
+            chat.send_message('alice', 'bench', text, recipient)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        chat._close()
+
+    # A vazão é medida de novo sem o tracemalloc, que deixa cada alocação bem mais lenta
+    with tempfile.TemporaryDirectory() as data_dir:
+        chat = server.ChatServer(data_dir=data_dir, fsync='never', history_limit=count)
+        chat.login_user('alice', 'senha')
+        chat.create_room('bench')
+        started = time.perf_counter()
+        for text, recipient in zip(texts, recipients):
+            chat.send_message('alice', 'bench', text, recipient)
+        elapsed = time.perf_counter() - started
+        chat._close()
+
+    return {
+        'messages': count,
+        'text_size': text_size,
+        'bytes_per_message': round(retained / count, 1),  # Sem o texto, já alocado antes da medição
+        'sends_per_second': round(count / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memória por mensagem e envios por segundo do ChatServer.")
+    parser.add_argument('--count', type=int, default=100000, help="Mensagens enviadas (padrão: 100000)")
+    parser.add_argument('--text-size', type=int, default=32, help="Tamanho do texto de cada mensagem (padrão: 32)")
+    parser.add_argument('--private-every', type=int, default=10,
+                        help="Uma a cada N mensagens é privada; 0 = todas públicas (padrão: 10)")
+    args = parser.parse_args()
+    result = measure(args.count, args.text_size, args.private_every)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Permite rodar a partir da pasta benchmarks/ importando os módulos do projeto
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from ratelimit import USER_PARAM, disabled_limits
+from rpctrace import read_trace
+from server import ChatServer
+
+# Chamadas entre servidores dependem de outras instâncias e não fazem parte da carga dos clientes;
+# as de streaming dependem de uma conexão JSON aberta (o assinante)
+SKIPPED_METHODS = {'peer_call', 'subscribe', 'unsubscribe'}
+# Posição do timeout nos métodos que estacionam a requisição; no replay ele é dividido pela velocidade
+WAIT_PARAM = {'wait_for_messages': 3}
+# Posição do nome da sala, para recriar o estado que já existia quando a captura começou
+ROOM_PARAM = {
+    'join_room': 1, 'send_message': 1, 'bulk_send_message': 1, 'receive_messages': 1, 'receive_messages_since': 1,
+    'wait_for_messages': 1, 'get_history': 1, 'search_messages': 1, 'is_user_in_room': 1, 'leave_room': 0,
+}
+
+
+class Stats:
+    # Latência por método no replay, comparada com a registrada na captura
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.cpu = collections.Counter()  # Tempo de CPU da thread: o long-polling estacionado não conta
+        self.errors = collections.Counter()
+        self.captured = collections.defaultdict(list)
+        self.captured_errors = collections.Counter()
+        self.arg_bytes = collections.Counter()
+        self.response_bytes = collections.Counter()
+        self.skipped = collections.Counter()
+        self.lock = threading.Lock()
+
+    def record(self, method, elapsed, cpu, ok):
+        with self.lock:
+            self.latencies[method].append(elapsed)
+            self.cpu[method] += cpu
+            if not ok:
+                self.errors[method] += 1
+
+    def record_captured(self, method, arg_sizes, response_size, duration, ok):
+        # Chamada pela thread que lê o trace, antes de enviar a chamada ao pool
+        self.captured[method].append(duration)
+        if not ok:
+            self.captured_errors[method] += 1
+        self.arg_bytes[method] += sum(size for size in arg_sizes if size > 0)
+        self.response_bytes[method] += max(0, response_size)
+
+    def summary(self):
+        # Métodos do mais caro para o mais barato em CPU; share é a fração da CPU gasta nas chamadas
+        total = sum(self.cpu.values()) or 1
+        report = {}
+        for method, samples in sorted(self.latencies.items(), key=lambda item: -self.cpu[item[0]]):
+            samples.sort()
+            captured = sorted(self.captured[method])
+            report[method] = {
+                'calls': len(samples),
+                'errors': self.errors[method],
+                'cpu_s': round(self.cpu[method], 3),
+                'share': round(self.cpu[method] / total, 3),
+                'cpu_mean_ms': round(self.cpu[method] / len(samples) * 1000, 3),
+                'total_s': round(sum(samples), 3),
+                'p50_ms': percentile(samples, 50),
+                'p95_ms': percentile(samples, 95),
+                'p99_ms': percentile(samples, 99),
+                'captured_p50_ms': percentile(captured, 50),
+                'captured_p99_ms': percentile(captured, 99),
+                'captured_errors': self.captured_errors[method],
+                'arg_bytes_mean': round(self.arg_bytes[method] / len(captured)) if captured else None,
+                'response_bytes_mean': round(self.response_bytes[method] / len(captured)) if captured else None,
+            }
+        return report
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return round(samples[index] * 1000, 3)
+
+
+class Profiler:
+    # cProfile das threads do replay. Até o Python 3.11 o hook é por thread, então cada thread do pool
+    # tem o seu Profile (ativo só durante as chamadas) e eles são somados no fim; a partir do 3.12 um
+    # único Profile já acompanha todas as threads.
+
+    def __init__(self):
+        self.global_profile = cProfile.Profile() if sys.version_info >= (3, 12) else None
+        self.profiles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.global_profile is not None:
+            self.global_profile.enable()
+
+    def stop(self):
+        if self.global_profile is not None:
+            self.global_profile.disable()
+
+    def call(self, func, *args):
+        if self.global_profile is not None:
+            return func(*args)
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def save(self, path, top=25):
+        #Grava as estatísticas (pstats) em path e devolve o resumo das funções com maior tempo acumulado.
+        profiles = [self.global_profile] if self.global_profile is not None else self.profiles
+        if not profiles:
+            return ''
+        output = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=output)
+        stats.dump_stats(path)
+        stats.sort_stats('cumulative').print_stats(top)
+        return output.getvalue()
+
+
+class StackSampler:
+    # Profiler por amostragem: a cada intervalo lê a pilha das threads do replay (sys._current_frames)
+    # e conta as pilhas a partir do ChatServer._dispatch. Grava no formato "folded" (uma pilha por
+    # linha, funções separadas por ";", e a contagem), aceito pelo flamegraph.pl e pelo speedscope.
+    # Ao contrário do cProfile, não deixa as chamadas mais lentas e mostra o tempo parado em locks.
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{filename}:{code.co_name}")
+                    if code.co_name == '_dispatch' and filename == 'server.py':
+                        break
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # Thread parada fora de uma chamada (pool ocioso, escrita do log...)
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def seed_calls(path, methods=None):
+    # Estado anterior à captura: usuários, salas e membros que aparecem em chamadas bem-sucedidas
+    # antes de serem criados no trace (a captura costuma começar com o servidor em uso).
+    _, records = read_trace(path)
+    users = {}  # usuário -> senha (do primeiro login no trace) ou None se ele já existia
+    new_users, rooms, new_rooms, members = set(), set(), set(), set()
+    joins = []
+    for offset, method, params, arg_sizes, response_size, duration, ok in records:
+        if not ok or params is None or (methods and method not in methods):
+            continue
+        user_index, room_index = USER_PARAM.get(method), ROOM_PARAM.get(method)
+        if method == 'create_room' and params:
+            room_index = 0
+        user = params[user_index] if user_index is not None and len(params) > user_index else None
+        room = params[room_index] if room_index is not None and len(params) > room_index else None
+        if isinstance(user, str):
+            if method in ('login_user', 'register_user'):
+                if user not in users and user not in new_users:
+                    if method == 'register_user':
+                        new_users.add(user)
+                    else:
+                        users[user] = params[1]
+            elif user not in users and user not in new_users:
+                users[user] = None
+        if isinstance(room, str):
+            if room not in rooms and room not in new_rooms:
+                (new_rooms if method == 'create_room' else rooms).add(room)
+            if isinstance(user, str) and (user, room) not in members and method != 'create_room':
+                members.add((user, room))
+                if method != 'join_room':
+                    joins.append((user, room))  # Já estava na sala quando a captura começou
+    calls = [('register_user', (user, password or 'x')) for user, password in users.items()]
+    calls += [('create_room', (room,)) for room in sorted(rooms)]
+    calls += [('join_room', (user, room)) for user, room in joins]
+    return calls
+
+
+def replay(args, chat_server, stats):
+    # Envia as chamadas do trace ao pool no horário de chegada dividido pela velocidade (0 = sem espera).
+    # O semáforo limita as chamadas enfileiradas: o trace é lido aos poucos, mesmo com milhões de registros.
+    header, records = read_trace(args.trace)
+    slots = threading.BoundedSemaphore(args.workers * 4)
+    profiler = Profiler() if args.profile else None
+    sampler = StackSampler(args.sample_interval) if args.sample else None
+    behind = 0.0
+
+    def run(method, params):
+        started, cpu = time.perf_counter(), time.thread_time()
+        try:
+            if profiler is not None:
+                profiler.call(chat_server._dispatch, method, params)
+            else:
+                chat_server._dispatch(method, params)
+            ok = True
+        except Exception:
+            ok = False
+        stats.record(method, time.perf_counter() - started, time.thread_time() - cpu, ok)
+        slots.release()
+
+    if profiler is not None:
+        profiler.start()
+    if sampler is not None:
+        sampler.start()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='replay') as executor:
+        for count, (offset, method, params, arg_sizes, response_size, duration, ok) in enumerate(records):
+            if args.limit and count >= args.limit:
+                break
+            if method in SKIPPED_METHODS or params is None or (args.methods and method not in args.methods):
+                stats.skipped[method] += 1
+                continue
+            stats.record_captured(method, arg_sizes, response_size, duration, ok)
+            wait_index = WAIT_PARAM.get(method)
+            if wait_index is not None and len(params) > wait_index:
+                params[wait_index] = params[wait_index] / args.speed if args.speed else 0
+            if args.speed:
+                delay = started + offset / args.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    behind = max(behind, -delay)  # O replay não acompanhou a velocidade pedida
+            slots.acquire()
+            executor.submit(run, method, params)
+    duration = time.monotonic() - started
+    if sampler is not None:
+        sampler.stop()
+    if profiler is not None:
+        profiler.stop()
+
+    report = {
+        'trace': args.trace,
+        'captured_full_text': header.get('full', False),
+        'config': {key: value for key, value in vars(args).items() if key not in ('trace', 'output')},
+        'duration_s': round(duration, 2),
+        'calls_per_second': round(sum(map(len, stats.latencies.values())) / duration, 1) if duration else None,
+        'behind_schedule_max_s': round(behind, 3) if args.speed else None,
+        'skipped': dict(stats.skipped),
+        'methods': stats.summary(),
+        'locks': chat_server.get_stats()['locks'],
+    }
+    if profiler is not None:
+        report['profile'] = args.profile
+        print(profiler.save(args.profile), file=sys.stderr)
+    if sampler is not None:
+        sampler.save(args.sample)
+        report['samples'] = {'file': args.sample, 'count': sampler.samples}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduz em um ChatServer local as chamadas capturadas com server.py --trace.")
+    parser.add_argument('trace', help="Arquivo gravado pelo server.py --trace")
+    parser.add_argument('--speed', type=float, default=1,
+                        help="Velocidade em relação à captura (padrão: 1; 10 = dez vezes mais rápido; 0 = o mais rápido possível)")
+    parser.add_argument('--workers', type=int, default=64,
+                        help="Threads que executam as chamadas, como as threads de requisição do servidor (padrão: 64)")
+    parser.add_argument('--methods', type=lambda value: sorted(value.split(',')), default=None,
+                        help="Reproduz só estes métodos, separados por vírgula (padrão: todos)")
+    parser.add_argument('--limit', type=int, default=0, help="Para depois deste número de registros do trace (padrão: todos)")
+    parser.add_argument('--data-dir', default=None,
+                        help="Diretório de dados do servidor local, ex.: uma cópia do de produção (padrão: temporário, vazio)")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="Não cria antes do replay os usuários, salas e membros que já existiam quando a captura começou")
+    parser.add_argument('--keep-limits', action='store_true',
+                        help="Mantém os limites de chamadas e o descarte de carga (padrão: desativados, o replay vem de poucos clientes)")
+    parser.add_argument('--fsync', default='never', help="Política de fsync do journal de usuários (padrão: never)")
+    parser.add_argument('--profile', metavar='ARQUIVO', help="Grava um perfil cProfile das chamadas (abrir com pstats ou snakeviz)")
+    parser.add_argument('--sample', metavar='ARQUIVO',
+                        help="Grava as pilhas amostradas das chamadas no formato folded (flamegraph.pl, speedscope)")
+    parser.add_argument('--sample-interval', type=float, default=0.005, help="Segundos entre as amostras (padrão: 0.005)")
+    parser.add_argument('--output', help="Arquivo do relatório JSON (padrão: saída padrão)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        limits = None if args.keep_limits else disabled_limits()
+        chat_server = ChatServer(data_dir=data_dir, fsync=args.fsync, rate_limits=limits,
+                                 shed_at=64 if args.keep_limits else 0)
+        chat_server.log.start(os.path.join(tmp, 'logs'), console=False)  # Mesmo custo de log do servidor, sem saída
+        try:
+            if not args.no_seed:
+                for method, params in seed_calls(args.trace, args.methods):
+                    try:
+                        chat_server._dispatch(method, params)
+                    except Exception:
+                        pass  # Já existia no --data-dir
+            stats = Stats()
+            report = replay(args, chat_server, stats)
+        finally:
+            chat_server._close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import xmlrpc.client
+from collections import deque
+
+# Permite rodar a partir da pasta benchmarks/ importando os módulos do projeto
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+from ratelimit import disabled_limits
+from wire import WireProxy, WireServer
+
+
+class CountingRelay(socketserver.ThreadingTCPServer):
+    # Repassa as conexões para o servidor real contando os bytes nos dois sentidos (cabeçalhos HTTP inclusos)
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.bytes = 0
+        self.lock = threading.Lock()
+        super().__init__(('localhost', 0), RelayHandler)
+
+    def count(self, size):
+        with self.lock:
+            self.bytes += size
+
+
+class RelayHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        upstream = socket.create_connection(self.server.upstream)
+        pump = threading.Thread(target=self.pump, args=(upstream, self.request), daemon=True)
+        pump.start()
+        self.pump(self.request, upstream)
+        pump.join()
+        upstream.close()
+
+    def pump(self, source, target):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                self.server.count(len(data))
+                target.sendall(data)
+        except OSError:
+            pass
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def start(server_obj):
+    threading.Thread(target=server_obj.serve_forever, daemon=True).start()
+    return server_obj.server_address[1]
+
+
+def bytes_per_call(relay, make_proxy, method, params, calls=20):
+    # Média de bytes trafegados (requisição + resposta) por chamada, medida no relay
+    proxy = make_proxy(relay.server_address[1])
+    getattr(proxy, method)(*params)  # Aquece: a conexão persistente do JSON não entra na média
+    before = relay.bytes
+    for _ in range(calls):
+        getattr(proxy, method)(*params)
+    time.sleep(0.1)  # Deixa o relay terminar de contar a última resposta
+    return round((relay.bytes - before) / calls)
+
+
+def calls_per_second(proxy, method, params, duration):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        getattr(proxy, method)(*params)
+        count += 1
+    return round(count / (time.perf_counter() - started))
+
+
+def pipelined_calls_per_second(proxy, method, params, duration, window):
+    # Mantém até window requisições em voo na mesma conexão
+    in_flight = deque()
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        while len(in_flight) < window:
+            in_flight.append(proxy.call_async(method, *params))
+        in_flight.popleft().result()
+        count += 1
+    for future in in_flight:
+        future.result()
+    return round(count / (time.perf_counter() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara XML-RPC e o protocolo JSON (wire.py): bytes e chamadas por segundo.")
+    parser.add_argument('--messages', type=int, default=50, help="Mensagens na sala lidas por receive_messages_since (padrão: 50)")
+    parser.add_argument('--duration', type=float, default=3, help="Segundos de medição por cenário (padrão: 3)")
+    parser.add_argument('--window', type=int, default=16, help="Requisições em voo no pipelining (padrão: 16)")
+    args = parser.parse_args()
+
+    server.print = lambda *args, **kwargs: None  # Sem log no console durante a medição
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Sem limites de chamadas nem descarte de carga: a medição repete a mesma chamada o mais rápido possível
+        chat = server.ChatServer(data_dir=data_dir, fsync='never', rate_limits=disabled_limits(), shed_at=0)
+        chat.login_user('alice', 'senha')
+        chat.create_room('bench')
+        chat.join_room('alice', 'bench')
+        for i in range(args.messages):
+            chat.send_message('alice', 'bench', f"mensagem de teste número {i}", None)
+
+        rpc_args = server.parse_args(['--port', '0'])
+        rpc_server = server.create_rpc_server(rpc_args, chat)
+        rpc_server.logRequests = False
+        xmlrpc_port = start(rpc_server)
+        wire_port = start(WireServer(('localhost', 0), chat._dispatch))
+
+        def make_xmlrpc(port):
+            return xmlrpc.client.ServerProxy(f'http://localhost:{port}', allow_none=True)
+
+        def make_wire(port):
+            return WireProxy('localhost', port)
+
+        scenarios = {
+            'receive_messages_since': ('alice', 'bench', 0),
+            'is_user_in_room': ('alice', 'bench'),
+        }
+        xmlrpc_relay = CountingRelay(('localhost', xmlrpc_port))
+        wire_relay = CountingRelay(('localhost', wire_port))
+        start(xmlrpc_relay)
+        start(wire_relay)
+
+        for method, params in scenarios.items():
+            print(f"{method}:")
+            print(f"  xmlrpc bytes/call: {bytes_per_call(xmlrpc_relay, make_xmlrpc, method, params)}")
+            print(f"  json   bytes/call: {bytes_per_call(wire_relay, make_wire, method, params)}")
+            print(f"  xmlrpc calls/s: {calls_per_second(make_xmlrpc(xmlrpc_port), method, params, args.duration)}")
+            wire = make_wire(wire_port)
+            print(f"  json   calls/s: {calls_per_second(wire, method, params, args.duration)}")
+            print(f"  json   calls/s (pipelining, {args.window} em voo): "
+                  f"{pipelined_calls_per_second(wire, method, params, args.duration, args.window)}")
+        chat._close()
+
+
+if __name__ == '__main__':
+    main()
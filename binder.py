@@ -1,43 +1,137 @@
+import argparse
+import socketserver
+import threading
+import time
 import xmlrpc.server
 import xmlrpc.client
 
+from expiry import ExpiryScheduler
+
 
 class Binder:
-    def __init__(self):
+    def __init__(self, lease_ttl=15):
         # Dicionário para armazenar os procedimentos registrados, onde a chave é o nome do procedimento
-        # e o valor é uma tupla contendo o endereço e a porta onde o procedimento está hospedado
+        # e o valor é outro dicionário com as instâncias ("endereço:porta") que atendem esse procedimento
         self.procedures = {}
+        self.versions = {}  # Versão do mapa de shards de cada procedimento: muda quando entra ou sai uma instância
+        self.lease_ttl = lease_ttl  # Segundos que um registro vale sem um novo heartbeat
+        self.lock = threading.Lock()
+        # Remove as instâncias cujo lease venceu sem heartbeat (servidor caiu ou perdeu a rede)
+        self.leases = ExpiryScheduler(self._expire_instance, name='binder-leases')
 
-    def register_procedure(self, procedure_name, address, port):
+    def register_procedure(self, procedure_name, address, port, lease=True):
         # Registra um método RPC no binder com seu nome, endereço e porta.
-        self.procedures[procedure_name] = (address, port)
+        # Com lease=True o registro expira se não for renovado por heartbeat; com False é permanente.
+        instance_id = f"{address}:{port}"
+        with self.lock:
+            instances = self.procedures.setdefault(procedure_name, {})
+            if instance_id not in instances:
+                self.versions[procedure_name] = self.versions.get(procedure_name, 0) + 1
+            instances[instance_id] = {
+                'address': address,
+                'port': port,
+                'load': 0,  # Carga informada pelo próprio servidor nos heartbeats
+                'expires': time.time() + self.lease_ttl if lease else None,
+            }
+        if lease:
+            self.leases.schedule((procedure_name, instance_id), time.time() + self.lease_ttl)
         print(f"Procedure {procedure_name} registered at {address}:{port}")
+        return True
+
+    def heartbeat(self, procedure_name, address, port, load, healthy=True):
+        # Renova o lease de uma instância e atualiza sua carga. Retorna False se a instância não
+        # estiver registrada (ex.: binder reiniciado), sinalizando que o servidor deve se registrar de novo.
+        instance_id = f"{address}:{port}"
+        with self.lock:
+            instance = self.procedures.get(procedure_name, {}).get(instance_id)
+            if instance is None:
+                return False
+            if not healthy:
+                # O próprio servidor se declarou indisponível: sai da lista imediatamente
+                self._remove_instance(procedure_name, instance_id)
+                return True
+            instance['load'] = load
+            if instance['expires'] is not None:
+                instance['expires'] = time.time() + self.lease_ttl
+        return True
+
+    def unregister_procedure(self, procedure_name, address, port):
+        # Remove uma instância (ex.: servidor encerrado pelo administrador).
+        with self.lock:
+            self._remove_instance(procedure_name, f"{address}:{port}")
+        return True
+
+    def _remove_instance(self, procedure_name, instance_id):
+        # Deve ser chamado com self.lock adquirido
+        instances = self.procedures.get(procedure_name, {})
+        if instances.pop(instance_id, None) is not None:
+            self.versions[procedure_name] = self.versions.get(procedure_name, 0) + 1
+            print(f"Procedure {procedure_name} at {instance_id} removed")
+        if not instances:
+            self.procedures.pop(procedure_name, None)
+
+    def _expire_instance(self, key):
+        # Chamado quando vence o lease agendado: remove a instância se não houve heartbeat desde então
+        procedure_name, instance_id = key
+        with self.lock:
+            instance = self.procedures.get(procedure_name, {}).get(instance_id)
+            if instance is None or instance['expires'] is None:
+                return
+            if instance['expires'] > time.time():
+                self.leases.schedule(key, instance['expires'])  # Renovado: confere de novo no novo prazo
+                return
+            self._remove_instance(procedure_name, instance_id)
+
+    def lookup_endpoints(self, procedure_name):
+        # Lista todas as instâncias ativas de um procedimento, da menos para a mais carregada.
+        with self.lock:
+            instances = list(self.procedures.get(procedure_name, {}).values())
+        endpoints = [
+            {'address': instance['address'], 'port': instance['port'], 'load': instance['load']}
+            for instance in instances
+        ]
+        return sorted(endpoints, key=lambda endpoint: endpoint['load'])
+
+    def get_shard_map(self, procedure_name):
+        # Mapa de shards publicado aos clientes e servidores: as instâncias ("endereço:porta") que
+        # formam o anel de hash consistente, com uma versão para detectar mudanças.
+        with self.lock:
+            return {
+                'version': self.versions.get(procedure_name, 0),
+                'shards': sorted(self.procedures.get(procedure_name, {})),
+            }
 
     def lookup_procedure(self, procedure_name):
         # Consulta um procedimento registrado no binder.
-        if procedure_name in self.procedures:
-            return self.procedures[procedure_name]  # Retorna o endereço e a porta do procedimento
+        endpoints = self.lookup_endpoints(procedure_name)
+        if endpoints:
+            return endpoints[0]['address'], endpoints[0]['port']  # Retorna o endereço e a porta da instância menos carregada
         else:
             return None  # Retorna None se o procedimento não for encontrado
 
 
-def run_binder():
-    # Cria uma instância do Binder
-    binder = Binder()
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+    # Atende heartbeats e consultas de vários servidores e clientes ao mesmo tempo
+    daemon_threads = True
+
 
-    # Endereço e porta do servidor de chat
-    server_address = 'localhost'
-    server_port = 8000
+def run_binder(argv=None):
+    parser = argparse.ArgumentParser(description="Binder: registro dos serviços do chat distribuído.")
+    parser.add_argument('--port', type=int, default=5000, help="Porta do binder (padrão: 5000)")
+    parser.add_argument('--lease-ttl', type=int, default=15,
+                        help="Segundos sem heartbeat até uma instância ser removida (padrão: 15)")
+    args = parser.parse_args(argv)
 
-    # Registro do servidor de chat no binder com o nome 'chat_server'
-    binder.register_procedure('chat_server', server_address, server_port)
+    # Cria uma instância do Binder. Os servidores de chat se registram sozinhos ao iniciar
+    # (register_procedure) e renovam o registro com heartbeats.
+    binder = Binder(lease_ttl=args.lease_ttl)
 
     # Configura o servidor XML-RPC para escutar na porta 5000
-    server = xmlrpc.server.SimpleXMLRPCServer(('localhost', 5000))
+    server = ThreadedXMLRPCServer(('localhost', args.port), allow_none=True, logRequests=False)
     # Registra a instância do binder como um serviço RPC que pode ser acessado remotamente
     server.register_instance(binder)
 
-    print("Binder is running on port 5000...")
+    print(f"Binder is running on port {args.port}...")
     # Inicia o servidor para escutar e responder as requisições
     server.serve_forever()
 
@@ -2,8 +2,23 @@ import time
 import tkinter as tk
 from tkinter import messagebox, simpledialog
 import json
+from collections import deque
+import queue
+import random
+import urllib.parse
 import xmlrpc.client
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from client_cache import MessageCache
+from hashring import HashRing
+from replication import replica_procedure
+from wire import WireProxy
+
+POLL_TIMEOUT = 25  # Tempo máximo (segundos) que cada long-polling fica aguardando mensagens novas
+MAX_LINES = 500  # Linhas mantidas na tela; as mais antigas são recarregadas do servidor ao rolar para cima
+HISTORY_PAGE = 50  # Mensagens buscadas por vez com get_history
+MAX_DELTA = 5000  # Acima disso o cache da sala é descartado e a sala é carregada como na primeira vez
 
 class ChatClientGUI:
     def __init__(self, master, binder_url):
@@ -11,10 +26,20 @@ class ChatClientGUI:
         self.master.title("Chat Distribuído")
         self.binder = xmlrpc.client.ServerProxy(binder_url)  # Conexão com o binder para buscar o servidor de chat
         self.chat_server = None  # Inicializa a variável do servidor de chat como None
+        self.server_url = None  # URL do servidor de chat, usada para abrir conexões extras (long-polling)
         self.username = None  # Inicializa o nome de usuário como None
+        self.password = None  # Guardada para fazer login nos outros shards quando necessário
         self.current_room = None  # Inicializa a sala atual como None
         self.json_file = "user_data.json"  # Arquivo para armazenar dados do usuário
+        self.cache = None  # Cache local de mensagens do usuário (aberto no login)
         self.keep_updating = False  # Flag para controle de atualização contínua de mensagens
+        self.last_seq = 0  # Cursor: número de sequência da última mensagem recebida da sala atual
+        self.poll_generation = 0  # Identifica a thread de atualização ativa (muda a cada entrada em sala)
+        # Sharding: cada sala pertence a um servidor, escolhido por hash consistente do nome
+        self.shard_ring = None  # HashRing com os servidores do mapa publicado pelo binder
+        self.shard_proxies = {}  # "endereço:porta" -> ServerProxy
+        self.logged_shards = set()  # Shards em que o usuário já fez login
+        self.replica_urls = {}  # Shard -> URLs das suas réplicas, que atendem as páginas antigas do histórico
 
         self.master.geometry("500x300")  # Define o tamanho inicial da janela (300x300 pixels)
 
@@ -29,11 +54,114 @@ class ChatClientGUI:
     def connect_to_server(self):
         #Conecta ao servidor de chat usando o binder para encontrar o endereço.
         try:
-            server_address, server_port = self.binder.lookup_procedure('chat_server')
-            server_url = f'http://{server_address}:{server_port}'
-            self.chat_server = xmlrpc.client.ServerProxy(server_url)  # Conecta ao servidor de chat
+            # O binder lista as instâncias ativas com a carga de cada uma; usa a menos carregada
+            endpoints = self.binder.lookup_endpoints('chat_server')
+            if not endpoints:
+                raise ConnectionError("Nenhum servidor de chat disponível.")
+            endpoint = min(endpoints, key=lambda endpoint: endpoint['load'])
+            server_address, server_port = endpoint['address'], endpoint['port']
+            self.server_url = f'http://{server_address}:{server_port}'
+            self.chat_server = self.open_server(self.server_url)  # Conecta ao servidor de chat
         except xmlrpc.client.Fault as e:
             messagebox.showerror("Erro", f"Erro ao conectar ao servidor: {e}")
+        self.refresh_shard_map()
+
+    def open_server(self, url):
+        #Abre uma conexão com o servidor, preferindo o protocolo JSON (mais leve) quando ele é oferecido.
+        proxy = xmlrpc.client.ServerProxy(url, allow_none=True)
+        try:
+            transports = proxy.get_transports()
+        except xmlrpc.client.Fault:
+            return proxy  # Servidor antigo: só XML-RPC
+        if 'json' in transports:
+            try:
+                return WireProxy(urllib.parse.urlsplit(url).hostname, transports['json'])
+            except OSError:
+                pass  # Porta JSON inacessível (ex.: firewall): continua no XML-RPC
+        return proxy
+
+    def open_stream(self, url, on_event):
+        #Abre uma conexão de streaming de eventos; None se o servidor não oferece o protocolo JSON.
+        try:
+            transports = xmlrpc.client.ServerProxy(url, allow_none=True).get_transports()
+        except xmlrpc.client.Fault:
+            return None  # Servidor antigo: só XML-RPC
+        if 'json' not in transports:
+            return None
+        return WireProxy(urllib.parse.urlsplit(url).hostname, transports['json'], on_event=on_event)
+
+    def refresh_shard_map(self):
+        #Busca no binder o mapa de shards atual (servidores que dividem as salas entre si).
+        shard_map = self.binder.get_shard_map('chat_server')
+        self.shard_ring = HashRing(shard_map['shards']) if shard_map['shards'] else None
+        self.replica_urls = {}  # Após um failover as réplicas mudam de primário: busca de novo quando precisar
+
+    def shard_url(self, room_name):
+        #URL do servidor dono da sala (o servidor conectado, se não houver mapa de shards).
+        shard = self.shard_ring.node_for(room_name) if self.shard_ring else None
+        return f'http://{shard}' if shard else self.server_url
+
+    def room_server(self, room_name):
+        #Conexão com o servidor dono da sala, fazendo login nele na primeira vez.
+        url = self.shard_url(room_name)
+        if url == self.server_url:
+            if getattr(self.chat_server, 'closed', False):
+                self.chat_server = self.open_server(url)  # Conexão JSON caiu: reconecta
+            return self.chat_server
+        proxy = self.shard_proxies.get(url)
+        if proxy is None or getattr(proxy, 'closed', False):
+            proxy = self.shard_proxies[url] = self.open_server(url)
+        if url not in self.logged_shards and self.username:
+            proxy.login_user(self.username, self.password)
+            self.logged_shards.add(url)
+        return proxy
+
+    def call_room(self, room_name, method, *args):
+        #Chama um método no dono da sala; se a sala mudou de servidor, atualiza o mapa e tenta de novo.
+        try:
+            return getattr(self.room_server(room_name), method)(*args)
+        except xmlrpc.client.Fault as e:
+            if 'WRONG_SHARD' not in e.faultString and 'READ_ONLY' not in e.faultString:
+                raise
+        except OSError:
+            pass  # Dono fora do ar: se uma réplica foi promovida, o mapa do binder já aponta para ela
+        self.refresh_shard_map()
+        return getattr(self.room_server(room_name), method)(*args)
+
+    def replica_server(self, room_name):
+        #Conexão com uma réplica do dono da sala (None se não houver), para leituras que aceitam atraso.
+        owner = urllib.parse.urlsplit(self.shard_url(room_name)).netloc
+        urls = self.replica_urls.get(owner)
+        if urls is None:
+            endpoints = self.binder.lookup_endpoints(replica_procedure(owner))
+            urls = self.replica_urls[owner] = [f"http://{e['address']}:{e['port']}" for e in endpoints]
+        if not urls:
+            return None
+        return xmlrpc.client.ServerProxy(random.choice(urls), allow_none=True)
+
+    def read_history(self, room_name, before_seq):
+        #Página antiga do histórico: numa réplica, se houver, para aliviar o primário; senão no dono da sala.
+        try:
+            replica = self.replica_server(room_name)
+            if replica is not None:
+                return replica.get_history(self.username, room_name, before_seq, HISTORY_PAGE)
+        except (OSError, xmlrpc.client.Error):
+            self.replica_urls.pop(urllib.parse.urlsplit(self.shard_url(room_name)).netloc, None)
+        with self.server_lock:
+            return self.call_room(room_name, 'get_history', self.username, room_name, before_seq, HISTORY_PAGE)
+
+    def list_all_rooms(self):
+        #Junta as salas de todos os shards, consultados em paralelo.
+        shards = sorted(set(self.shard_ring.owners)) if self.shard_ring else []
+        if len(shards) <= 1:
+            return self.chat_server.list_rooms(self.username)
+
+        def fetch(shard):
+            return xmlrpc.client.ServerProxy(f'http://{shard}').list_rooms(self.username)
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            results = list(executor.map(fetch, shards))
+        return sorted({room for rooms in results for room in rooms})
 
     def save_user_data(self):
         #Salva os dados do usuário em um arquivo JSON.
@@ -79,6 +207,9 @@ class ChatClientGUI:
                 # Tenta fazer login ou registrar o usuário
                 if self.chat_server.login_user(username, password):  
                     self.username = username
+                    self.cache = MessageCache(f"cache_{username}.db")  # Um cache por usuário (inclui as privadas)
+                    self.password = password
+                    self.logged_shards = {self.server_url}
                     self.save_user_data()  # Salva os dados do usuário
                     self.create_room_screen()  # Cria a tela de seleção de sala
                 else:
@@ -109,7 +240,7 @@ class ChatClientGUI:
             room_name = self.ask_room_name()  # Solicita o nome da nova sala
             if room_name:
                 try:
-                    if self.chat_server.create_room(room_name):  # Tenta criar a sala
+                    if self.call_room(room_name, 'create_room', room_name, self.username):  # Tenta criar a sala no shard dono
                         self.show_custom_message("Sucesso", f"Sala '{room_name}' criada.")
                 except xmlrpc.client.Fault as e:
                     self.show_custom_message("Erro", f"Erro ao criar sala: {e}")
@@ -117,7 +248,7 @@ class ChatClientGUI:
         def list_rooms():
             #Função para listar as salas disponíveis.
             try:
-                rooms = self.chat_server.list_rooms()  # Obtém a lista de salas
+                rooms = self.list_all_rooms()  # Obtém a lista de salas de todos os servidores
                 self.show_custom_message("Salas Disponíveis", "\n".join(rooms))  # Exibe as salas em uma janela personalizada
             except xmlrpc.client.Fault as e:
                 self.show_custom_message("Erro", f"Erro ao listar salas: {e}")
@@ -144,7 +275,7 @@ class ChatClientGUI:
         self.add_hover_effect(join_room_button)
         self.add_hover_effect(exit_button)
     
-    def create_chat_screen(self):
+    def create_chat_screen(self, joined):
         #Cria a tela principal de chat onde as mensagens são enviadas e recebidas.
         self.master.geometry("600x650")  # Define o tamanho da tela de chat
         self.master.config(bg="#2c3e50")
@@ -166,9 +297,16 @@ class ChatClientGUI:
         # Barra de rolagem para as mensagens
         scrollbar = tk.Scrollbar(messages_frame, bg="#34495e")
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.message_list.config(yscrollcommand=scrollbar.set)
+        self.message_list.config(yscrollcommand=lambda first, last: self.on_scroll(scrollbar, first, last))
         scrollbar.config(command=self.message_list.yview)
 
+        # Janela de mensagens: só as últimas MAX_LINES linhas ficam no Listbox
+        self.line_seqs = deque()  # seq da mensagem de cada linha (None para avisos como "entrou na sala")
+        self.older_before = (joined['messages'][0]['seq'] if joined['messages'] else joined['cursor'] + 1)
+        self.has_older = self.older_before > 1  # Há mensagens anteriores à primeira linha
+        self.detached = False  # Linhas recentes descartadas ao carregar antigas: a tela não segue a sala
+        self.loading = False  # Uma busca de página por vez
+
         # Frame para o campo de entrada de mensagens e destinatário
         input_frame = tk.Frame(self.master, bg="#2c3e50")
         input_frame.pack(pady=10)
@@ -182,14 +320,15 @@ class ChatClientGUI:
         recipient_entry.insert(0, "Para (opcional)")  # Placeholder para o destinatário
         recipient_entry.pack(side=tk.LEFT, padx=5)
 
-        # Inicia a atualização automática do chat
-        self.update_chat()
+        # Mostra as mensagens recebidas no join_room e continua a partir do cursor devolvido
+        self.show_messages(joined['messages'])
+        self.update_chat(joined['cursor'])
         
         def list_users():
             #Lista os usuários na sala atual.
             try:
                 with self.server_lock:  # Garante que apenas uma requisição seja feita por vez
-                    users = self.chat_server.list_users(self.current_room)
+                    users = self.call_room(self.current_room, 'list_users', self.current_room, self.username)
                 if users:
                     self.show_custom_message("Usuários na sala", "\n".join(users))
                 else:
@@ -222,16 +361,55 @@ class ChatClientGUI:
         room_name = self.ask_room_name()  # Solicita o nome da sala
         if room_name:
             try:
-                self.chat_server.join_room(self.username, room_name)  # Tenta entrar na sala
+                # join_room já devolve os usuários, as mensagens e o cursor: uma única ida ao servidor.
+                # Com cache, pede só as posteriores à última em cache (mais uma, para conferir a sala).
+                cached_seq = self.cache.last_seq(room_name)
+                joined = self.call_room(room_name, 'join_room', self.username, room_name, max(cached_seq - 1, 0) if cached_seq else None)  # Tenta entrar na sala
+                messages = self.sync_cache(room_name, joined, cached_seq)
                 self.current_room = room_name
-                self.create_chat_screen()  # Cria a tela de chat após entrar na sala
+                self.create_chat_screen({'messages': messages, 'cursor': joined['cursor']})  # Cria a tela de chat após entrar na sala
             except xmlrpc.client.Fault as e:
                 self.show_custom_message("Erro", f"Erro ao entrar na sala: {e}")
 
+    def sync_cache(self, room_name, joined, cached_seq):
+        #Junta o cache local da sala com a resposta do join_room e busca só o intervalo que falta.
+        cursor = joined['cursor']
+        if cached_seq and (cached_seq > cursor or cursor - cached_seq > MAX_DELTA
+                           or not self.cache.matches(room_name, joined['messages'])):
+            # Sala recriada no servidor (seqs reiniciadas) ou cache muito defasado: começa do zero
+            self.cache.clear_room(room_name)
+            joined = self.call_room(room_name, 'join_room', self.username, room_name)
+            cached_seq = 0
+        if not cached_seq:
+            self.cache.add(room_name, joined['messages'])
+            return joined['messages']
+
+        # O join_room devolve no máximo as últimas 50: o que houver entre o cache e elas vem em lotes
+        first_joined = joined['messages'][0]['seq'] if joined['messages'] else cursor + 1
+        after = cached_seq
+        while after + 1 < first_joined:
+            result = self.call_room(room_name, 'receive_messages_since', self.username, room_name, after)
+            self.cache.add(room_name, [msg for msg in result['messages'] if msg['seq'] < first_joined])
+            if result['cursor'] <= after:
+                break
+            after = result['cursor']
+        self.cache.add(room_name, joined['messages'])
+        return self.cache.recent(room_name, MAX_LINES)
+
+    def close(self):
+        #Encerra o cliente ao fechar a janela: sai da sala atual e fecha o cache local antes de destruir a janela.
+        try:
+            if self.current_room:
+                self.leave_room()
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+            self.master.destroy()
+
     def leave_room(self):
         #Deixa a sala atual e retorna à tela de criação de salas.
         with self.server_lock:
-            self.chat_server.leave_room(self.current_room, self.username)  # Sai da sala
+            self.call_room(self.current_room, 'leave_room', self.current_room, self.username)  # Sai da sala
         self.current_room = None  # Limpa a sala atual
         self.create_room_screen()  # Cria a tela de criação de sala
 
@@ -245,15 +423,12 @@ class ChatClientGUI:
                 with self.server_lock:
                     # Verifica se o destinatário é válido (não está vazio)
                     recipient = recipient if recipient != "Para (opcional)" else ""
-                    
-                    # Verifica se o destinatário está na sala atual
-                    if recipient:
-                        if not self.chat_server.is_user_in_room(recipient, self.current_room):
-                            self.show_custom_message("Erro", f"O usuário '{recipient}' não está na sala atual.")
-                            return
-                    
-                    # Envia a mensagem
-                    self.chat_server.send_message(self.username, self.current_room, message, recipient)
+
+                    # Envia a mensagem; o servidor verifica se o destinatário está na sala na mesma chamada
+                    sent = self.call_room(self.current_room, 'bulk_send_message', self.username, self.current_room, message, recipient)
+                if not sent:
+                    self.show_custom_message("Erro", f"O usuário '{recipient}' não está na sala atual.")
+                    return
                 
                 # Limpa os campos de entrada após o envio
                 message_entry.delete(0, tk.END)
@@ -261,47 +436,260 @@ class ChatClientGUI:
                 recipient_entry.insert(0, "Para (opcional)")  # Redefine o campo do destinatário
             
             except xmlrpc.client.Fault as e:
-                messagebox.showerror("Erro", f"Erro ao enviar mensagem: {e}")
+                if 'RATE_LIMITED' in e.faultString or 'SERVER_BUSY' in e.faultString:
+                    self.show_custom_message("Aviso", "Muitas mensagens em pouco tempo. Aguarde um instante e envie de novo.")
+                else:
+                    messagebox.showerror("Erro", f"Erro ao enviar mensagem: {e}")
             except Exception as e:
                 messagebox.showerror("Erro", f"Erro desconhecido: {e}")
 
-    def update_chat(self):
-        #Atualiza as mensagens da sala em tempo real.
+    def format_message(self, msg):
+        #Texto de uma linha da lista, ou None se a mensagem não deve ser exibida.
+        timestamp = msg['timestamp']
+        if msg['type'] == 'broadcast':
+            return f"[{timestamp}] {msg['from']}: {msg['message']}"
+        elif msg['type'] == 'unicast' and msg['to'] == self.username:
+            return f"[{timestamp}] (Privado) {msg['from']}: {msg['message']}"
+        return None
+
+    def show_messages(self, messages):
+        #Adiciona mensagens novas ao fim da lista exibida.
+        if self.detached:
+            return  # Vendo mensagens antigas: as novas são buscadas ao voltar para o fim da lista
+        self.append_lines([(msg['seq'], self.format_message(msg)) for msg in messages])
+
+    def append_lines(self, lines):
+        #Insere linhas (seq, texto) no fim e descarta as do topo acima de MAX_LINES. Custo O(linhas novas).
+        try:
+            at_bottom = self.message_list.yview()[1] >= 1.0
+            for seq, text in lines:
+                if text is None:
+                    continue
+                self.message_list.insert(tk.END, text)  # Adiciona somente as mensagens novas
+                self.line_seqs.append(seq)
+            excess = len(self.line_seqs) - MAX_LINES
+            if excess > 0:
+                self.message_list.delete(0, excess - 1)
+                for _ in range(excess):
+                    self.line_seqs.popleft()
+                self.older_before = self.first_seq() or self.older_before
+                self.has_older = True
+            if at_bottom:
+                self.message_list.see(tk.END)  # Acompanha a conversa se o usuário estava no fim
+        except tk.TclError:
+            pass  # Ignora erros se os widgets foram destruídos
+
+    def first_seq(self):
+        return next((seq for seq in self.line_seqs if seq is not None), None)
+
+    def last_seq_shown(self):
+        return next((seq for seq in reversed(self.line_seqs) if seq is not None), None)
+
+    def on_scroll(self, scrollbar, first, last):
+        #Atualiza a barra de rolagem e busca mais mensagens ao chegar ao topo (antigas) ou ao fim (recentes).
+        scrollbar.set(first, last)
+        if self.loading or self.current_room is None:
+            return
+        if float(first) <= 0.0 and self.has_older:
+            self.load_page('older')
+        elif float(last) >= 1.0 and self.detached:
+            self.load_page('newer')
+
+    def load_page(self, direction):
+        #Busca em segundo plano uma página de mensagens antigas (get_history) ou recentes (receive_messages_since).
+        self.loading = True
+        room_name = self.current_room
+        generation = self.poll_generation
+        older_before = self.older_before
+        args = ('receive_messages_since', self.username, room_name, self.last_seq_shown() or 0)
+
+        def fetch():
+            try:
+                cached = self.cache.before(room_name, older_before, HISTORY_PAGE) if direction == 'older' else None
+                if cached:
+                    # O cache não tem lacunas abaixo da última seq: a página sai do disco local
+                    result = {'messages': cached, 'before_seq': cached[0]['seq'], 'has_more': cached[0]['seq'] > 1}
+                elif direction == 'older':
+                    result = self.read_history(room_name, older_before)
+                    self.cache.add(room_name, result['messages'])
+                else:
+                    with self.server_lock:
+                        result = self.call_room(room_name, *args)
+            except Exception as e:
+                print(f"Erro ao carregar mensagens: {e}")
+                result = None
+
+            def apply():
+                if result is None or self.poll_generation != generation:
+                    self.loading = False
+                    return  # Falhou ou o usuário já trocou de sala
+                if direction == 'older':
+                    added = self.prepend_page(result)
+                    self.loading = False
+                    if not added and self.has_older:
+                        self.load_page('older')  # Página só com privadas de outros: a rolagem não muda, busca a próxima
+                else:
+                    self.detached = result['cursor'] < self.last_seq  # Ainda há mais até o fim
+                    self.append_lines([(msg['seq'], self.format_message(msg)) for msg in result['messages']])
+                    self.loading = False
+            self.master.after(0, apply)
+
+        threading.Thread(target=fetch, daemon=True).start()
+
+    def prepend_page(self, result):
+        #Insere no topo uma página de mensagens antigas, mantendo a posição visível e o limite de linhas.
+        lines = [(msg['seq'], self.format_message(msg)) for msg in result['messages']]
+        lines = [(seq, text) for seq, text in lines if text is not None]
+        self.older_before = result['before_seq']
+        self.has_older = result['has_more']
+        try:
+            for index, (seq, text) in enumerate(lines):
+                self.message_list.insert(index, text)
+            self.line_seqs.extendleft(seq for seq, _ in reversed(lines))
+            self.message_list.yview_scroll(len(lines), 'units')  # A linha que estava no topo continua visível
+            excess = len(self.line_seqs) - MAX_LINES
+            if excess > 0:
+                # Descarta as mais recentes; elas voltam quando o usuário rolar até o fim
+                self.message_list.delete(MAX_LINES, tk.END)
+                for _ in range(excess):
+                    self.line_seqs.pop()
+                self.detached = True
+        except tk.TclError:
+            pass  # Ignora erros se os widgets foram destruídos
+        return len(lines)
+
+    def update_chat(self, cursor):
+        #Atualiza as mensagens da sala em tempo real: por streaming de eventos ou, sem ele, por long-polling.
+        self.poll_generation += 1
+        generation = self.poll_generation  # Threads de salas anteriores param ao detectar outra geração
+        room_name = self.current_room
+        self.last_seq = cursor  # Continua de onde o join_room parou; depois só recebe o que for novo
+
+        def active():
+            return self.poll_generation == generation and self.current_room == room_name
+
         def fetch_and_update():
-            while True:
+            # Conexão própria: o streaming/long-polling fica aberto sem segurar o server_lock
+            poll_server = None
+            use_stream = True
+            while active():
                 try:
-                    if self.current_room:  # Verifica se o cliente está em uma sala
-                        with self.server_lock:  # Garante que apenas uma thread acesse o servidor
-                            new_messages = self.chat_server.receive_messages(self.username, self.current_room)
-
-                        if new_messages is None:
-                            new_messages = []  # Inicializa a lista de mensagens se estiver vazia
-
-                        def update_gui():
-                            try:
-                                self.message_list.delete(0, tk.END)  # Limpa a lista de mensagens
-                                for msg in new_messages:
-                                    timestamp = msg['timestamp']
-                                    if msg['type'] == 'broadcast':
-                                        display_message = f"[{timestamp}] {msg['from']}: {msg['message']}"
-                                    elif msg['type'] == 'unicast' and msg['to'] == self.username:
-                                        display_message = f"[{timestamp}] (Privado) {msg['from']}: {msg['message']}"
-                                    else:
-                                        continue
-
-                                    self.message_list.insert(tk.END, display_message)  # Adiciona a mensagem à lista
-                            except tk.TclError:
-                                pass  # Ignora erros se os widgets foram destruídos
-
-                        if self.current_room:
-                            self.master.after(0, update_gui)  # Atualiza a GUI com as novas mensagens
+                    if use_stream:
+                        events = queue.Queue()
+                        stream = self.open_stream(self.shard_url(room_name), events.put)
+                        if stream is None:
+                            use_stream = False  # Servidor sem protocolo JSON: usa o long-polling
+                            continue
+                        try:
+                            if not self.follow_stream(stream, events, room_name, active):
+                                return  # Sala removida
+                        finally:
+                            stream.close()
+                        if active():
+                            time.sleep(1)  # Conexão perdida ou consumidor lento: assina de novo em seguida
+                        continue
+
+                    if poll_server is None:
+                        poll_server = self.open_server(self.shard_url(room_name))
+                    # Retorna assim que houver mensagens novas ou quando o timeout expirar
+                    started = time.monotonic()
+                    result = poll_server.wait_for_messages(self.username, room_name, self.last_seq, POLL_TIMEOUT)
+                    if not result['messages'] and time.monotonic() - started < 1:
+                        time.sleep(1)  # Servidor sem long-polling disponível: volta ao intervalo de 1 segundo
+
+                    self.last_seq = result['cursor']
+                    if active():
+                        self.post_messages(room_name, result['messages'])
+                        if not result.get('member', True):
+                            self.rejoin(room_name)  # Presença expirada (ex.: conexão suspensa): entra de novo
+                except xmlrpc.client.Fault as e:
+                    if 'WRONG_SHARD' in e.faultString:
+                        # A sala foi transferida para outro servidor: entra de novo nela no novo dono
+                        try:
+                            self.rejoin(room_name)
+                            poll_server = None  # Reconecta no novo dono na próxima volta
+                            continue
+                        except Exception as e:
+                            print(f"Erro ao trocar de servidor: {e}")
+                    else:
+                        print(f"Erro ao atualizar mensagens: {e}")
+                    time.sleep(1)
                 except Exception as e:
                     print(f"Erro ao atualizar mensagens: {e}")
-                time.sleep(1)  # Atraso entre as atualizações de mensagens
+                    poll_server = None  # Conexão possivelmente perdida: abre outra na próxima tentativa
+                    if isinstance(e, OSError):
+                        try:
+                            self.refresh_shard_map()  # O servidor pode ter caído e uma réplica assumido a sala
+                        except Exception:
+                            pass
+                    time.sleep(1)  # Aguarda antes de tentar novamente em caso de erro
 
         # Inicia a thread que atualiza as mensagens
         threading.Thread(target=fetch_and_update, daemon=True).start()
 
+    def follow_stream(self, stream, events, room_name, active):
+        #Assina a sala e exibe os eventos recebidos. Retorna False se a sala foi removida.
+        while True:
+            # Recebe o que perdeu desde last_seq; repete em lotes até o servidor confirmar a assinatura
+            result = stream.subscribe(self.username, room_name, self.last_seq)
+            self.last_seq = result['cursor']
+            self.post_messages(room_name, result['messages'])
+            if result['subscribed']:
+                break
+
+        while active():
+            try:
+                batch = events.get(timeout=1)
+            except queue.Empty:
+                continue
+            if batch is None:
+                return True  # Conexão encerrada
+            for event in batch:
+                if not active():
+                    break  # O usuário saiu da sala: descarta o resto do lote
+                if event['type'] == 'message':
+                    if event['message']['seq'] > self.last_seq:
+                        self.last_seq = event['message']['seq']
+                        self.post_messages(room_name, [event['message']])
+                elif event['type'] in ('join', 'leave'):
+                    action = "entrou na" if event['type'] == 'join' else "saiu da"
+                    self.post_lines([f"*** {event['user']} {action} sala"])
+                elif event['type'] == 'removed':
+                    if event.get('moved_to'):
+                        self.rejoin(room_name)  # Sala transferida: segue para o novo servidor
+                        return True
+                    self.post_lines(["*** A sala foi removida."])
+                    return False
+                elif event['type'] == 'dropped':
+                    return True  # O servidor desconectou por atraso: assina de novo a partir do cursor
+                elif event['type'] == 'ping':
+                    # Responde na própria conexão sem esperar: o heartbeat renova a presença no servidor
+                    stream.call_async('heartbeat', self.username)
+                elif event['type'] == 'expired':
+                    self.rejoin(room_name)  # Presença expirada (ex.: conexão suspensa): entra de novo e assina
+                    return True
+        return True
+
+    def rejoin(self, room_name):
+        #Entra de novo na sala depois que ela mudou de servidor ou que a presença do usuário expirou.
+        self.refresh_shard_map()
+        with self.server_lock:
+            self.call_room(room_name, 'join_room', self.username, room_name)
+
+    def post_messages(self, room_name, messages):
+        #Grava no cache e exibe mensagens a partir de outra thread (a GUI só pode ser alterada no loop do Tk).
+        if messages:
+            # Gravadas mesmo se a tela estiver vendo o histórico: o cache continua sem lacunas
+            self.cache.add(room_name, messages)
+            self.master.after(0, lambda: self.show_messages(messages))
+
+    def post_lines(self, lines):
+        #Exibe avisos (entradas, saídas) a partir de outra thread.
+        def insert():
+            if not self.detached:
+                self.append_lines([(None, line) for line in lines])
+        self.master.after(0, insert)
+
     def clear_screen(self):
         #Limpa todos os widgets da tela.
         for widget in self.master.winfo_children():
@@ -395,5 +783,5 @@ if __name__ == "__main__":
     binder_url = 'http://localhost:5000'  # URL do binder
     root = tk.Tk()
     client_gui = ChatClientGUI(root, binder_url)
-    root.protocol("WM_DELETE_WINDOW", lambda: [client_gui.leave_room() if client_gui.current_room else None, root.destroy()])
+    root.protocol("WM_DELETE_WINDOW", client_gui.close)
     root.mainloop()  # Inicia a interface gráfica
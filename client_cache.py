@@ -0,0 +1,77 @@
+import json
+import sqlite3
+import threading
+
+
+class MessageCache:
+    # Cache local das mensagens já recebidas, por usuário (inclui as privadas dele), em SQLite.
+    # Chave: (sala, seq do servidor). Ao entrar de novo em uma sala, o cliente mostra o que já tem
+    # e busca no servidor só as mensagens depois da última seq em cache.
+
+    def __init__(self, path):
+        # Usado pela thread da GUI e pelas de atualização: uma conexão compartilhada protegida por lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.closed = False
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")  # Escritas por append, sem reescrever o arquivo
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " room TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (room, seq)) WITHOUT ROWID"
+            )
+
+    def add(self, room_name, messages):
+        #Grava mensagens no formato recebido do servidor (dicionários com 'seq').
+        if not messages:
+            return
+        rows = [(room_name, msg['seq'], json.dumps(msg, ensure_ascii=False)) for msg in messages]
+        with self.lock:
+            if self.closed:
+                return  # Mensagens que chegaram durante o encerramento do cliente
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", rows)
+
+    def last_seq(self, room_name):
+        with self.lock:
+            row = self.db.execute("SELECT MAX(seq) FROM messages WHERE room = ?", (room_name,)).fetchone()
+        return row[0] or 0
+
+    def recent(self, room_name, limit):
+        #Últimas limit mensagens da sala, em ordem crescente de seq.
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT data FROM messages WHERE room = ? ORDER BY seq DESC LIMIT ?", (room_name, limit)
+            ).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def before(self, room_name, before_seq, limit):
+        #Até limit mensagens anteriores a before_seq, em ordem crescente de seq.
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT data FROM messages WHERE room = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (room_name, before_seq, limit)
+            ).fetchall()
+        return [json.loads(data) for (data,) in reversed(rows)]
+
+    def matches(self, room_name, messages):
+        #Confere se as mensagens do servidor coincidem com as em cache de mesma seq (a sala não foi recriada).
+        for msg in messages:
+            with self.lock:
+                row = self.db.execute(
+                    "SELECT data FROM messages WHERE room = ? AND seq = ?", (room_name, msg['seq'])
+                ).fetchone()
+            if row is not None:
+                cached = json.loads(row[0])
+                return cached['from'] == msg['from'] and cached['message'] == msg['message']
+        return True
+
+    def clear_room(self, room_name):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE room = ?", (room_name,))
+
+    def close(self):
+        #Fecha a conexão SQLite (grava o WAL no arquivo principal). Chamado ao fechar a janela do cliente.
+        with self.lock:
+            self.closed = True
+            self.db.close()
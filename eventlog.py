@@ -0,0 +1,119 @@
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# Taxa de amostragem padrão por tipo de evento (0 = nunca, 1 = sempre; tipos ausentes = 1).
+# As mensagens são o evento mais frequente e levam o texto do usuário: ficam fora do log por padrão.
+# As linhas de acesso HTTP (request) também: uma por chamada.
+DEFAULT_SAMPLING = {'message': 0.0, 'request': 0.0}
+BATCH_SIZE = 500  # Registros gravados por escrita no arquivo
+
+
+class EventLog:
+    # Log assíncrono: as threads das requisições só sorteiam a amostragem e enfileiram uma tupla
+    # (horário, modelo do texto, campos). A thread de escrita formata, grava em lotes, faz flush
+    # uma vez por lote e rotaciona o arquivo pelo tamanho. Com a fila cheia, o registro é descartado
+    # (e contado) em vez de atrasar a requisição.
+
+    def __init__(self, sink=print, sampling=None, queue_size=10000):
+        self.sink = sink  # Antes de start(): cada registro é formatado e entregue aqui, na hora
+        self.sampling = dict(DEFAULT_SAMPLING, **(sampling or {}))
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = None
+        self.file = None
+
+    def emit(self, event, template, **fields):
+        #Registra um evento. template usa str.format com os campos, formatado só na thread de escrita.
+        rate = self.sampling.get(event, 1.0)
+        if rate < 1.0 and (rate <= 0.0 or random.random() >= rate):
+            return
+        if self.thread is None:
+            self.sink(template.format(**fields) if fields else template)
+            return
+        try:
+            self.queue.put_nowait((time.time(), template, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self, log_dir, max_bytes=10 * 1024 * 1024, backups=5, console=True):
+        #Abre o arquivo de log e inicia a thread de escrita.
+        os.makedirs(log_dir, exist_ok=True)
+        self.path = os.path.join(log_dir, time.strftime("%H-%M_%d-%m-%Y") + ".txt")  # Nome com o horário de início
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.console = console
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.thread = threading.Thread(target=self.write_loop, name='event-log', daemon=True)
+        self.thread.start()
+
+    def write_loop(self):
+        last_second, stamp = None, ''
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            stop = False
+            for record in batch:
+                if record is None:
+                    stop = True
+                    continue
+                ts, template, fields = record
+                second = int(ts)
+                if second != last_second:  # Um strftime por segundo, não por registro
+                    last_second, stamp = second, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+                try:
+                    text = template.format(**fields) if fields else template
+                except (KeyError, IndexError, ValueError):
+                    text = f"{template} {fields}"
+                lines.append(f"{stamp} - {text}\n")
+            if self.dropped:
+                lines.append(f"{stamp} - {self.dropped} registros de log descartados (fila cheia).\n")
+                self.dropped = 0
+            data = ''.join(lines)
+            self.file.write(data)
+            self.file.flush()
+            if self.console:
+                sys.stderr.write(data)
+                sys.stderr.flush()
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+            if stop:
+                self.file.close()
+                return
+
+    def rotate(self):
+        # log.txt -> log.txt.1 -> log.txt.2 ...; o mais antigo além de backups é apagado
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        #Grava o que estiver na fila e encerra a thread de escrita.
+        if self.thread is not None:
+            self.queue.put(None)  # Bloqueante: o marcador de fim não pode ser descartado
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+def parse_sampling(values):
+    #Converte opções "evento=taxa" (ex.: message=0.01) em um dicionário.
+    sampling = {}
+    for value in values or ():
+        event, _, rate = value.partition('=')
+        sampling[event.strip()] = float(rate)
+    return sampling
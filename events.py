@@ -0,0 +1,109 @@
+import threading
+
+from message import Message
+
+MAX_PENDING = 1000  # Eventos na fila de um assinante; acima disso ele é desconectado (consumidor lento)
+
+
+class Subscriber:
+    # Uma conexão de streaming: recebe os eventos das salas assinadas em uma fila limitada.
+    # Quem publica nunca espera: se a fila encher, o assinante é marcado como atrasado e desconectado,
+    # e o cliente volta a assinar a partir do seu cursor.
+
+    def __init__(self, username, limit=MAX_PENDING):
+        self.username = username
+        self.limit = limit
+        self.rooms = set()  # Salas assinadas
+        self.pending = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = False  # Fechado por não acompanhar o ritmo dos eventos
+
+    def push(self, event):
+        with self.cond:
+            if self.closed:
+                return
+            if len(self.pending) >= self.limit:
+                self.closed = self.dropped = True
+                self.pending = []
+            else:
+                self.pending.append(event)
+            self.cond.notify()
+
+    def next_batch(self, timeout=None):
+        #Espera e retorna todos os eventos pendentes (um lote por escrita no socket); None se fechado e [] se o timeout vencer.
+        with self.cond:
+            if not self.pending and not self.closed:
+                self.cond.wait_for(lambda: self.pending or self.closed, timeout)
+            if self.closed:
+                return None
+            batch, self.pending = self.pending, []
+            return batch
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class EventHub:
+    # Assinantes por sala. publish custa O(assinantes da sala), sem depender de quantos clientes fazem polling.
+
+    def __init__(self):
+        self.rooms = {}  # nome da sala -> conjunto de Subscriber
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber, room_name):
+        with self.lock:
+            self.rooms.setdefault(room_name, set()).add(subscriber)
+            subscriber.rooms.add(room_name)
+
+    def unsubscribe(self, subscriber, room_name=None):
+        #Cancela a assinatura de uma sala, ou de todas se room_name for None (conexão encerrada).
+        with self.lock:
+            room_names = list(subscriber.rooms) if room_name is None else [room_name]
+            for name in room_names:
+                subscribers = self.rooms.get(name)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.rooms[name]
+                subscriber.rooms.discard(name)
+
+    def drop_user(self, room_name, username):
+        #Encerra as assinaturas do usuário na sala (presença expirada) e avisa cada conexão com o evento 'expired'.
+        with self.lock:
+            room_subscribers = self.rooms.get(room_name, set())
+            subscribers = [subscriber for subscriber in room_subscribers if subscriber.username == username]
+            for subscriber in subscribers:
+                room_subscribers.discard(subscriber)
+                subscriber.rooms.discard(room_name)
+            if subscribers and not room_subscribers:
+                del self.rooms[room_name]
+        for subscriber in subscribers:
+            subscriber.push({'type': 'expired', 'room': room_name})
+
+    def publish(self, room_name, event, recipient=None):
+        #Entrega o evento aos assinantes da sala; com recipient, só a ele (mensagem privada).
+        with self.lock:
+            subscribers = list(self.rooms.get(room_name, ()))
+        for subscriber in subscribers:
+            if recipient is None or subscriber.username == recipient:
+                subscriber.push(event)
+
+    def close_room(self, room_name, event):
+        #Publica o último evento da sala (removida ou transferida) e encerra as assinaturas dela.
+        with self.lock:
+            subscribers = self.rooms.pop(room_name, set())
+            for subscriber in subscribers:
+                subscriber.rooms.discard(room_name)
+        for subscriber in subscribers:
+            subscriber.push(event)
+
+
+def export_event(event):
+    #Formato enviado ao cliente: as mensagens só viram dicionário aqui, fora dos locks do servidor.
+    message = event.get('message')
+    if isinstance(message, Message):
+        event = dict(event, message=message.to_dict())
+    return event
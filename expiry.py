@@ -0,0 +1,51 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExpiryScheduler:
+    # Agenda prazos em um min-heap e chama callback(key) quando cada um vence. A thread dorme até o
+    # próximo prazo, então o custo é proporcional aos itens vencidos (O(log n) cada), não ao total.
+    # O callback decide se o item realmente expirou e pode reagendá-lo (por exemplo, se houve atividade).
+
+    def __init__(self, callback, name='expiry'):
+        self.callback = callback
+        self.heap = []  # (prazo em epoch, desempate, key)
+        self.counter = itertools.count()  # Desempate estável: keys não precisam ser comparáveis
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def schedule(self, key, deadline):
+        #Agenda key para o prazo deadline (epoch, segundos).
+        with self.cond:
+            heapq.heappush(self.heap, (deadline, next(self.counter), key))
+            if self.heap[0][2] is key:
+                self.cond.notify()  # Novo prazo mais próximo: acorda a thread para reajustar a espera
+
+    def run(self):
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                delay = self.heap[0][0] - time.time()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                _, _, key = heapq.heappop(self.heap)
+                # O callback roda sem o lock do agendador: ele pode chamar schedule() de novo
+                self.cond.release()
+                try:
+                    self.callback(key)
+                except Exception as e:
+                    print(f"Erro ao processar expiração: {e}")
+                finally:
+                    self.cond.acquire()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
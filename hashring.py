@@ -0,0 +1,33 @@
+import bisect
+import hashlib
+
+
+class HashRing:
+    # Hash consistente: cada nó (servidor "endereço:porta") ocupa várias posições (nós virtuais) em um
+    # anel de 64 bits, e cada chave (nome da sala) pertence ao primeiro nó no sentido horário. Ao
+    # adicionar ou remover um nó, só as chaves do trecho do anel afetado mudam de dono.
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas  # Nós virtuais por nó: distribuem as chaves de forma mais uniforme
+        self.positions = []  # Posições ordenadas no anel (busca binária)
+        self.owners = []  # Nó dono de cada posição, na mesma ordem
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        for i in range(self.replicas):
+            position = self.hash(f"{node}#{i}")
+            index = bisect.bisect(self.positions, position)
+            self.positions.insert(index, position)
+            self.owners.insert(index, node)
+
+    def node_for(self, key):
+        #Nó dono da chave, ou None se o anel estiver vazio.
+        if not self.positions:
+            return None
+        index = bisect.bisect(self.positions, self.hash(key)) % len(self.positions)
+        return self.owners[index]
@@ -0,0 +1,209 @@
+import bisect
+import collections
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+
+from message import Message
+
+OFFSET = struct.Struct('<Q')  # Cada entrada do índice é o offset (8 bytes) de uma mensagem no segmento
+MAX_MAPPED_SEGMENTS = 8  # Segmentos fechados mantidos mapeados em memória (mmap) por sala
+
+
+class RoomLog:
+    # Histórico de uma sala em disco: segmentos append-only de mensagens (uma linha JSON por mensagem)
+    # e, para cada segmento, um índice compacto com o offset de cada mensagem. A mensagem de número
+    # de sequência N fica no segmento cujo primeiro seq é o maior <= N, na posição N - primeiro seq.
+
+    def __init__(self, path, segment_size):
+        self.path = path
+        self.segment_size = segment_size  # Mensagens por segmento antes de abrir o próximo
+        self.maps = collections.OrderedDict()  # seq inicial -> (mmap do índice, mmap do segmento), em ordem de uso
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(
+            int(name[:-4]) for name in os.listdir(path) if name.endswith('.seg')
+        )  # Primeiro seq de cada segmento, em ordem
+        if not self.segments:
+            self.segments = [1]
+            open(self.segment_path(1, '.seg'), 'ab').close()
+            open(self.segment_path(1, '.idx'), 'ab').close()
+
+        # Só o último segmento recebe gravações; os anteriores estão completos
+        last = self.segments[-1]
+        self.last_count = self.recover_segment(last)
+        self.next_seq = last + self.last_count
+        self.seg_file = open(self.segment_path(last, '.seg'), 'ab')
+        self.idx_file = open(self.segment_path(last, '.idx'), 'ab')
+
+    def segment_path(self, first_seq, ext):
+        return os.path.join(self.path, f"{first_seq:012d}{ext}")
+
+    def recover_segment(self, first_seq):
+        # Corrige um segmento interrompido por uma queda: descarta a linha incompleta do final e
+        # completa o índice com as linhas que foram gravadas mas não chegaram a ser indexadas
+        seg_path = self.segment_path(first_seq, '.seg')
+        idx_path = self.segment_path(first_seq, '.idx')
+        if not os.path.exists(idx_path):
+            open(idx_path, 'ab').close()
+        with open(idx_path, 'rb') as f:
+            index = f.read()
+        index = index[:len(index) - len(index) % OFFSET.size]
+        offsets = [OFFSET.unpack_from(index, i)[0] for i in range(0, len(index), OFFSET.size)]
+
+        with open(seg_path, 'rb') as f:
+            # Confere a partir da última entrada indexada (o restante do segmento já foi validado)
+            start = offsets[-1] if offsets else 0
+            f.seek(start)
+            rest = f.read()
+        if offsets:
+            offsets.pop()  # A última entrada indexada é conferida junto com o restante
+
+        end = start
+        for line in rest.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            offsets.append(end)
+            end += len(line)
+
+        with open(seg_path, 'r+b') as f:
+            f.truncate(end)
+        with open(idx_path, 'wb') as f:
+            f.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+        return len(offsets)
+
+    def append(self, msg):
+        #Grava uma mensagem no final do histórico. Quem chama garante a ordem (lock da sala).
+        if self.last_count >= self.segment_size:
+            self.roll_segment()
+        offset = self.seg_file.tell()
+        self.seg_file.write(json.dumps(msg.to_record(), separators=(',', ':')).encode('utf-8') + b'\n')
+        self.seg_file.flush()
+        self.idx_file.write(OFFSET.pack(offset))
+        self.idx_file.flush()
+        self.last_count += 1
+        self.next_seq += 1
+
+    def roll_segment(self):
+        # Fecha o segmento cheio e começa um novo a partir do próximo seq
+        self.seg_file.close()
+        self.idx_file.close()
+        self.segments.append(self.next_seq)
+        self.seg_file = open(self.segment_path(self.next_seq, '.seg'), 'ab')
+        self.idx_file = open(self.segment_path(self.next_seq, '.idx'), 'ab')
+        self.last_count = 0
+
+    def read_range(self, first_seq, last_seq):
+        #Lê do disco as mensagens com seq entre first_seq e last_seq (inclusive).
+        first_seq = max(first_seq, 1)
+        last_seq = min(last_seq, self.next_seq - 1)
+        messages = []
+        # Primeiro segmento que pode conter first_seq; daí em diante, até passar de last_seq
+        start = max(bisect.bisect_right(self.segments, first_seq) - 1, 0)
+        for i in range(start, len(self.segments)):
+            seg_first = self.segments[i]
+            seg_last = self.segments[i + 1] - 1 if i + 1 < len(self.segments) else self.next_seq - 1
+            if seg_first > last_seq:
+                break
+            if seg_last < first_seq:
+                continue
+            lo = max(first_seq, seg_first) - seg_first
+            hi = min(last_seq, seg_last) - seg_first  # Posições (inclusive) dentro do segmento
+            messages.extend(self.read_segment(seg_first, lo, hi))
+        return messages
+
+    def read_segment(self, seg_first, lo, hi):
+        # Usa o índice para localizar só o trecho do segmento com as mensagens pedidas (via mmap)
+        index, data = self.map_segment(seg_first)
+        start = OFFSET.unpack_from(index, lo * OFFSET.size)[0]
+        end_pos = (hi + 1) * OFFSET.size
+        end = OFFSET.unpack_from(index, end_pos)[0] if end_pos < len(index) else len(data)
+        return [Message.from_record(json.loads(line)) for line in data[start:end].splitlines()]
+
+    def map_segment(self, seg_first):
+        # Segmentos fechados não mudam mais: ficam mapeados (LRU). O segmento ativo ainda cresce,
+        # então é mapeado de novo a cada leitura para enxergar as últimas gravações
+        if seg_first in self.maps:
+            self.maps.move_to_end(seg_first)
+            return self.maps[seg_first]
+        maps = (self.map_file(self.segment_path(seg_first, '.idx')),
+                self.map_file(self.segment_path(seg_first, '.seg')))
+        if seg_first != self.segments[-1] and all(isinstance(m, mmap.mmap) for m in maps):
+            self.maps[seg_first] = maps
+            if len(self.maps) > MAX_MAPPED_SEGMENTS:
+                _, (index, data) = self.maps.popitem(last=False)
+                index.close()
+                data.close()
+        return maps
+
+    @staticmethod
+    def map_file(path):
+        # mmap não aceita arquivos vazios; nesse caso um bytes vazio serve
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def tail(self, count):
+        #Lê as últimas count mensagens do histórico.
+        return self.read_range(self.next_seq - count, self.next_seq - 1)
+
+    def close(self):
+        self.seg_file.close()
+        self.idx_file.close()
+        for index, data in self.maps.values():
+            index.close()
+            data.close()
+        self.maps.clear()
+
+
+class HistoryStore:
+    # Diretório com o histórico de todas as salas: um subdiretório por sala, com meta.json e os segmentos.
+    # Nada é lido na inicialização além da lista de salas; o histórico de cada sala é aberto sob demanda.
+
+    def __init__(self, base_dir, segment_size=10000):
+        self.base_dir = base_dir
+        self.segment_size = segment_size
+        os.makedirs(base_dir, exist_ok=True)
+
+    def room_path(self, room_name):
+        # Diretório com o sha1 do nome da sala: tamanho fixo e seguro para qualquer nome (o nome fica no meta.json)
+        return os.path.join(self.base_dir, hashlib.sha1(room_name.encode('utf-8')).hexdigest())
+
+    def list_rooms(self):
+        #Lista as salas salvas lendo apenas o meta.json de cada uma.
+        rooms = []
+        for entry in os.listdir(self.base_dir):
+            meta_path = os.path.join(self.base_dir, entry, 'meta.json')
+            if entry.startswith('.') or not os.path.exists(meta_path):
+                continue
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                rooms.append(json.load(f)['name'])
+        return rooms
+
+    def open_room(self, room_name):
+        #Abre (criando, se preciso) o histórico de uma sala.
+        path = self.room_path(room_name)
+        meta_path = os.path.join(path, 'meta.json')
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(meta_path):
+            # Gravado antes dos segmentos: o nome real da sala nunca se perde (o diretório só tem o sha1)
+            tmp_path = meta_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'name': room_name, 'created': time.time()}, f)
+            os.replace(tmp_path, meta_path)
+        return RoomLog(path, self.segment_size)
+
+    def delete_room(self, room_name):
+        #Remove o histórico de uma sala. O diretório é renomeado na hora (uma sala nova com o mesmo
+        #nome já pode ser criada) e apagado em segundo plano.
+        path = self.room_path(room_name)
+        if not os.path.exists(path):
+            return
+        trash = os.path.join(self.base_dir, f".deleted-{os.path.basename(path)}-{time.monotonic_ns()}")
+        os.rename(path, trash)
+        threading.Thread(target=shutil.rmtree, args=(trash, True), daemon=True).start()
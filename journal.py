@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class UserJournal:
+    # Persistência dos usuários em duas partes: um snapshot JSON (user_data.json) e um journal
+    # append-only com um registro por alteração. Cada gravação custa um append, não a reescrita
+    # do arquivo inteiro; de tempos em tempos o journal é compactado em um novo snapshot.
+
+    def __init__(self, snapshot_path='user_data.json', journal_path='user_data.journal',
+                 fsync='always', fsync_interval=1.0, compact_every=1000, snapshot_source=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync inválida: {fsync}")
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.fsync = fsync  # always: fsync a cada lote; interval: no máximo a cada fsync_interval; never: só flush
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every  # Registros no journal que disparam a compactação
+        self.snapshot_source = snapshot_source  # Função que devolve o snapshot completo já serializado em JSON
+
+        self.cond = threading.Condition()
+        self.pending = []  # Linhas aguardando o próximo commit em grupo
+        self.appended = 0  # Total de registros enfileirados
+        self.committed = 0  # Total de registros já gravados no journal
+        self.journal_records = 0  # Registros no journal desde o último snapshot
+        self.last_fsync = time.monotonic()
+        self.closed = False
+        self.file = None
+        self.writer = None
+
+    def load(self):
+        #Recupera o estado: carrega o snapshot e reaplica os registros do journal por cima.
+        users = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                users = json.load(f).get('users', {})
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Última linha incompleta (queda no meio da gravação): descarta o resto
+                    self.apply(users, record)
+                    self.journal_records += 1
+
+        self.file = open(self.journal_path, 'a', encoding='utf-8')
+        self.writer = threading.Thread(target=self.write_loop, name='journal-writer', daemon=True)
+        self.writer.start()
+        return users
+
+    @staticmethod
+    def apply(users, record):
+        # Registros são idempotentes (estado completo do usuário): reaplicar duas vezes dá o mesmo resultado
+        if record['op'] == 'put_user':
+            users[record['username']] = record['data']
+
+    def enqueue(self, record):
+        #Enfileira um registro sem aguardar a gravação e devolve o ticket para wait().
+        # Quem chama sob o próprio lock garante que a ordem no journal é a ordem das alterações
+        line = json.dumps(record) + '\n'
+        with self.cond:
+            if self.closed:
+                raise Exception("Journal de usuários encerrado.")
+            self.pending.append(line)
+            self.appended += 1
+            self.cond.notify_all()
+            return self.appended
+
+    def wait(self, ticket):
+        #Aguarda até o registro do ticket estar gravado no journal (conforme a política de fsync).
+        with self.cond:
+            while self.committed < ticket and not self.closed:
+                self.cond.wait()
+
+    def write_loop(self):
+        # Thread de escrita: grava de uma vez tudo o que chegou enquanto o lote anterior era gravado
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                upto = self.appended
+
+            self.file.write(''.join(batch))
+            self.file.flush()
+            now = time.monotonic()
+            if self.fsync == 'always' or (self.fsync == 'interval' and now - self.last_fsync >= self.fsync_interval):
+                os.fsync(self.file.fileno())
+                self.last_fsync = now
+            self.journal_records += len(batch)
+
+            with self.cond:
+                self.committed = upto
+                self.cond.notify_all()
+
+            if self.snapshot_source is not None and self.journal_records >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        #Grava um snapshot completo (de forma atômica) e esvazia o journal.
+        # Tudo o que já está no journal aconteceu antes do snapshot; o que chegar depois vai para o journal novo
+        data = self.snapshot_source()
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)  # Troca atômica: uma queda aqui não corrompe o snapshot
+        self.file.close()
+        self.file = open(self.journal_path, 'w', encoding='utf-8')
+        self.journal_records = 0
+
+    def close(self):
+        #Grava o que estiver pendente e encerra a thread de escrita.
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.writer is not None:
+            self.writer.join()
+        if self.file is not None:
+            self.file.flush()
+            if self.fsync != 'never':
+                os.fsync(self.file.fileno())
+            self.file.close()
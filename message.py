@@ -0,0 +1,47 @@
+import functools
+import sys
+import time
+
+
+class Message:
+    # Mensagem de uma sala em formato compacto: sem dicionário por instância (__slots__), com o horário
+    # como inteiro (epoch) e os nomes de usuário internados (uma única string por usuário no servidor).
+    # O formato do cliente (dicionário com 'timestamp' "%H:%M") só é montado na resposta da RPC.
+    __slots__ = ('seq', 'ts', 'sender', 'recipient', 'text')
+
+    def __init__(self, seq, ts, sender, recipient, text):
+        self.seq = seq
+        self.ts = ts  # Segundos desde a época
+        self.sender = sys.intern(sender)
+        self.recipient = sys.intern(recipient) if recipient else None  # None = mensagem pública (broadcast)
+        self.text = text
+
+    def visible_to(self, username):
+        # Públicas são vistas por todos; privadas, apenas pelo destinatário
+        return self.recipient is None or self.recipient == username
+
+    def to_dict(self):
+        #Formato enviado aos clientes (o mesmo de antes da representação compacta).
+        return {
+            'seq': self.seq,
+            'type': 'broadcast' if self.recipient is None else 'unicast',
+            'from': self.sender,
+            'to': self.recipient,
+            'message': self.text,
+            'timestamp': format_minute(self.ts // 60)
+        }
+
+    def to_record(self):
+        #Formato gravado em disco: uma lista, sem repetir os nomes dos campos em cada linha.
+        return [self.seq, self.ts, self.sender, self.recipient, self.text]
+
+    @classmethod
+    def from_record(cls, record):
+        #Lê uma mensagem gravada em disco (lista de to_record).
+        return cls(*record)
+
+
+@functools.lru_cache(maxsize=1024)
+def format_minute(minute):
+    # As mensagens de um mesmo minuto compartilham o mesmo texto de horário, formatado uma única vez
+    return time.strftime("%H:%M", time.localtime(minute * 60))
@@ -0,0 +1,181 @@
+import bisect
+import os
+import threading
+import time
+
+# Limites (em segundos) dos buckets do histograma de latência, no estilo do Prometheus
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+XMLRPC_MAX_INT = 2 ** 31 - 1  # Inteiros maiores não cabem no <int> do XML-RPC
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'total', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0  # Soma das latências (segundos)
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # Último = acima do maior limite (+Inf)
+
+
+class LockStats:
+    __slots__ = ('acquires', 'contended', 'wait')
+
+    def __init__(self):
+        self.acquires = 0  # Aquisições que precisaram esperar são contadas também em contended
+        self.contended = 0
+        self.wait = 0.0  # Tempo total esperando o lock (segundos)
+
+
+class Metrics:
+    # Contadores por RPC e por lock. Cada registro custa um lock curto e algumas somas: pode ficar
+    # ligado em produção. Os gauges (salas, mensagens...) são calculados só quando alguém consulta.
+
+    def __init__(self):
+        self.methods = {}  # nome do método -> MethodStats
+        self.locks = {}  # nome do lock -> LockStats
+        self.rejected = {}  # (método, motivo) -> chamadas recusadas pelo controle de admissão
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def record_call(self, method, elapsed, error=False):
+        index = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.buckets[index] += 1
+            if error:
+                stats.errors += 1
+
+    def record_rejected(self, method, reason):
+        with self.lock:
+            self.rejected[method, reason] = self.rejected.get((method, reason), 0) + 1
+
+    def lock_stats(self, name):
+        with self.lock:
+            stats = self.locks.get(name)
+            if stats is None:
+                stats = self.locks[name] = LockStats()
+            return stats
+
+    def snapshot(self, gauges):
+        #Cópia dos contadores em um dicionário serializável (get_stats).
+        with self.lock:
+            methods = {
+                name: {
+                    'calls': safe_int(stats.calls),
+                    'errors': safe_int(stats.errors),
+                    'total_seconds': stats.total,
+                    'buckets': [safe_int(count) for count in stats.buckets],
+                }
+                for name, stats in self.methods.items()
+            }
+            locks = {
+                name: {'acquires': safe_int(stats.acquires), 'contended': safe_int(stats.contended),
+                       'wait_seconds': stats.wait}
+                for name, stats in self.locks.items()
+            }
+            rejected = {}
+            for (method, reason), count in self.rejected.items():
+                rejected.setdefault(method, {})[reason] = safe_int(count)
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'latency_buckets': list(LATENCY_BUCKETS),
+            'methods': methods,
+            'locks': locks,
+            'rejected': rejected,  # método -> {'rate': ..., 'load': ...}
+            'gauges': {name: safe_int(value) for name, value in gauges.items()},
+        }
+
+
+class TimedLock:
+    # threading.Lock que mede a espera quando está ocupado. Sem disputa, o custo é um acquire
+    # não bloqueante a mais. Compatível com threading.Condition e com o "with".
+
+    def __init__(self, stats):
+        self._lock = threading.Lock()
+        self.stats = stats  # LockStats compartilhado pelos locks do mesmo tipo (ex.: todas as salas)
+
+    def acquire(self, blocking=True, timeout=-1):
+        stats = self.stats
+        if self._lock.acquire(False):
+            stats.acquires += 1  # Sem lock de métricas: contagem aproximada sob disputa basta
+            return True
+        if not blocking:
+            return False
+        started = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        stats.wait += time.perf_counter() - started
+        stats.contended += 1
+        if acquired:
+            stats.acquires += 1
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def safe_int(value):
+    # Contadores acima do limite do XML-RPC vão como float (perdem precisão só acima de 2^53)
+    return value if value <= XMLRPC_MAX_INT else float(value)
+
+
+def prometheus_text(snapshot, prefix='chat'):
+    #Formata um snapshot no formato de texto do Prometheus.
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    metric('rpc_calls_total', 'counter', "Chamadas RPC por método.")
+    for method, stats in sorted(snapshot['methods'].items()):
+        lines.append(f'{prefix}_rpc_calls_total{{method="{method}"}} {stats["calls"]}')
+    metric('rpc_errors_total', 'counter', "Chamadas RPC que terminaram em erro.")
+    for method, stats in sorted(snapshot['methods'].items()):
+        lines.append(f'{prefix}_rpc_errors_total{{method="{method}"}} {stats["errors"]}')
+    metric('rpc_rejected_total', 'counter', "Chamadas recusadas por limite de taxa (rate) ou carga (load).")
+    for method, reasons in sorted(snapshot['rejected'].items()):
+        for reason, count in sorted(reasons.items()):
+            lines.append(f'{prefix}_rpc_rejected_total{{method="{method}",reason="{reason}"}} {count}')
+    metric('rpc_latency_seconds', 'histogram', "Latência das chamadas RPC.")
+    for method, stats in sorted(snapshot['methods'].items()):
+        cumulative = 0
+        for bound, count in zip(list(snapshot['latency_buckets']) + ['+Inf'], stats['buckets']):
+            cumulative += count
+            lines.append(f'{prefix}_rpc_latency_seconds_bucket{{method="{method}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_rpc_latency_seconds_sum{{method="{method}"}} {stats["total_seconds"]}')
+        lines.append(f'{prefix}_rpc_latency_seconds_count{{method="{method}"}} {stats["calls"]}')
+    metric('lock_wait_seconds_total', 'counter', "Tempo esperando locks ocupados.")
+    for name, stats in sorted(snapshot['locks'].items()):
+        lines.append(f'{prefix}_lock_wait_seconds_total{{lock="{name}"}} {stats["wait_seconds"]}')
+    metric('lock_contended_total', 'counter', "Aquisições de lock que precisaram esperar.")
+    for name, stats in sorted(snapshot['locks'].items()):
+        lines.append(f'{prefix}_lock_contended_total{{lock="{name}"}} {stats["contended"]}')
+    for name, value in sorted(snapshot['gauges'].items()):
+        metric(name, 'gauge', f"Valor atual de {name}.")
+        lines.append(f"{prefix}_{name} {value}")
+    metric('uptime_seconds', 'gauge', "Segundos desde o início do servidor.")
+    lines.append(f"{prefix}_uptime_seconds {snapshot['uptime_seconds']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_atomic(path, text):
+    # Quem lê o arquivo (ex.: node_exporter textfile) nunca vê uma versão pela metade
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,30 @@
+import hmac
+import xmlrpc.client
+
+PEER_CALL = 'peer_call'  # Único nome pelo qual as operações internas do cluster chegam pelo RPC
+
+
+def check_secret(expected, secret):
+    #Confere o segredo do cluster em tempo constante; sem segredo configurado, nenhuma chamada interna é aceita.
+    if not expected or not isinstance(secret, str):
+        return False
+    return hmac.compare_digest(secret.encode('utf-8'), expected.encode('utf-8'))
+
+
+class PeerProxy:
+    # Conexão com outro servidor do cluster para as operações internas (replicação, failover, transferência
+    # de salas). proxy.metodo(*params) vira peer_call(segredo, 'metodo', params): os métodos internos são
+    # privados no servidor e só respondem com o segredo compartilhado (--peer-secret).
+
+    def __init__(self, url, secret):
+        self.url = url
+        self.secret = secret
+        self.proxy = xmlrpc.client.ServerProxy(url, allow_none=True)
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(*params):
+            return getattr(self.proxy, PEER_CALL)(self.secret, method, list(params))
+        return call
@@ -0,0 +1,121 @@
+import threading
+import time
+
+# Limites padrão por método: (tokens por segundo, rajada máxima). Métodos ausentes não são limitados
+# (ex.: peer_call entre servidores). Os valores cabem com folga no uso do cliente e de um coletor de métricas.
+DEFAULT_LIMITS = {
+    'send_message': (5, 20),
+    'bulk_send_message': (5, 20),
+    'create_room': (1, 30),
+    'join_room': (2, 20),
+    'leave_room': (2, 20),
+    'login_user': (1, 5),
+    'register_user': (1, 5),
+    'receive_messages': (5, 20),
+    'receive_messages_since': (10, 30),
+    'wait_for_messages': (10, 30),
+    'get_history': (10, 30),
+    'search_messages': (2, 10),
+    'list_rooms': (2, 10),
+    'list_users': (2, 10),
+    'heartbeat': (1, 10),
+    'subscribe': (10, 30),
+    # Fora do descarte de carga (SHED_NEVER) para o monitoramento continuar sob carga, mas limitadas por endereço
+    'get_stats': (1, 10),
+    'metrics_text': (1, 10),
+}
+
+# Posição do nome do usuário nos parâmetros de cada método; os demais são limitados pelo endereço do cliente
+USER_PARAM = {
+    'send_message': 0, 'bulk_send_message': 0, 'join_room': 0, 'leave_room': 1, 'login_user': 0,
+    'register_user': 0, 'receive_messages': 0, 'receive_messages_since': 0, 'wait_for_messages': 0,
+    'get_history': 0, 'heartbeat': 0, 'search_messages': 0, 'subscribe': 0, 'unsubscribe': 0,
+    # Parâmetro opcional: sem ele (clientes antigos), a chamada fica com o endereço do cliente
+    'create_room': 1, 'list_rooms': 0, 'list_users': 1,
+}
+
+PRUNE_INTERVAL = 60  # Segundos entre as limpezas dos baldes parados
+
+# Endereço do cliente da requisição em andamento, preenchido pelos handlers do XML-RPC e do protocolo JSON
+client = threading.local()
+
+
+def set_client_address(address):
+    client.address = address
+
+
+def client_address():
+    return getattr(client, 'address', None)
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+
+class RateLimiter:
+    # Token bucket por (usuário ou endereço, método). allow() custa um lock curto e algumas contas:
+    # as chamadas acima do limite são recusadas antes de tocar nas salas ou criar mensagens.
+
+    def __init__(self, limits=None):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))  # método -> (taxa, rajada); taxa 0 = sem limite
+        self.buckets = {}  # (chave, método) -> TokenBucket
+        self.lock = threading.Lock()
+        self.last_prune = time.monotonic()
+
+    def key(self, method, params):
+        #Quem paga pela chamada: o usuário dos parâmetros ou, sem ele, o endereço do cliente.
+        index = USER_PARAM.get(method)
+        if index is not None and len(params) > index and isinstance(params[index], str):
+            return params[index]
+        return client_address()
+
+    def allow(self, method, params):
+        #Consome um token do balde da chamada; False se o balde estiver vazio.
+        limit = self.limits.get(method)
+        if limit is None or limit[0] <= 0:
+            return True
+        rate, burst = limit
+        bucket_key = (self.key(method, params), method)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self.buckets[bucket_key] = TokenBucket(burst, now)
+            else:
+                bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+            if now - self.last_prune >= PRUNE_INTERVAL:
+                self.prune(now)
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def prune(self, now):
+        # Remove os baldes que já estariam cheios de novo: recriá-los dá o mesmo resultado.
+        # Deve ser chamado com o lock adquirido.
+        self.last_prune = now
+        for bucket_key, bucket in list(self.buckets.items()):
+            rate, burst = self.limits[bucket_key[1]]
+            if bucket.tokens + (now - bucket.updated) * rate >= burst:
+                del self.buckets[bucket_key]
+
+
+def disabled_limits():
+    #Limites que desligam todos os padrões (benchmarks com poucos clientes gerando a carga de muitos usuários).
+    return {method: (0, 0) for method in DEFAULT_LIMITS}
+
+
+def parse_limits(values):
+    #Converte opções "método=taxa:rajada" (ex.: send_message=2:10) em um dicionário; taxa 0 desativa.
+    limits = {}
+    for value in values or ():
+        method, _, spec = value.partition('=')
+        rate, _, burst = spec.partition(':')
+        rate = float(rate)
+        limits[method.strip()] = (rate, float(burst) if burst else max(1.0, rate))
+    return limits
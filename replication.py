@@ -0,0 +1,139 @@
+import collections
+import itertools
+import os
+import random
+import threading
+import time
+import xmlrpc.client
+
+from peer import PeerProxy
+
+LOG_LIMIT = 100000  # Registros mantidos no log do primário; réplica mais atrasada que isso recomeça pelo snapshot
+PULL_LIMIT = 1000  # Registros por chamada de replication_pull
+PULL_TIMEOUT = 10  # Segundos que um replication_pull aguarda registros novos (long-polling)
+REPLICA_PROCEDURE = 'chat_server_replica'  # Nome no binder: "chat_server_replica:<primário>"
+
+
+def replica_procedure(primary_id):
+    #Nome com que as réplicas de um primário ("endereço:porta") se registram no binder.
+    return f"{REPLICA_PROCEDURE}:{primary_id}"
+
+
+class ChangeLog:
+    # Log ordenado das alterações do primário (usuários, salas, membros e mensagens), em memória.
+    # Cada registro é um dicionário com 'seq' e 'op'. As réplicas leem a partir da última seq aplicada;
+    # o epoch muda a cada início do primário, e uma réplica de outro epoch recomeça pelo snapshot.
+
+    def __init__(self, limit=LOG_LIMIT):
+        self.records = collections.deque(maxlen=limit)
+        self.last_seq = 0
+        self.epoch = os.urandom(8).hex()
+        self.cond = threading.Condition()
+
+    def append(self, record):
+        #Acrescenta um registro. Quem chama garante a ordem entre alterações dependentes (locks do servidor).
+        with self.cond:
+            self.last_seq += 1
+            record['seq'] = self.last_seq
+            self.records.append(record)
+            self.cond.notify_all()
+
+    def read(self, epoch, after_seq, limit, timeout):
+        #Registros depois de after_seq (até limit), aguardando até timeout; None se a réplica precisa do snapshot.
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if epoch != self.epoch or after_seq > self.last_seq:
+                return None  # Outro primário (ou reiniciado): as seqs não correspondem
+            while self.last_seq == after_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+            missing = self.last_seq - after_seq
+            if missing > len(self.records):
+                return None  # Os registros pedidos já saíram do log
+            # Percorre a partir do fim: o custo é proporcional ao atraso da réplica, não ao tamanho do log
+            newest = list(itertools.islice(reversed(self.records), missing))
+            return newest[::-1][:limit]
+
+
+class ReplicaFollower:
+    # Thread de uma réplica: aplica no servidor local o snapshot e depois os registros do log do primário.
+    # Se o primário ficar fora do ar por failover_after segundos, chama on_failover (promoção automática).
+    # As chamadas ao primário vão por PeerProxy, com o segredo do cluster.
+
+    def __init__(self, chat_server, primary_url, replica_id, failover_after=None, on_failover=None):
+        self.chat_server = chat_server
+        self.primary_url = primary_url
+        self.replica_id = replica_id  # "endereço:porta" desta réplica, informado ao primário
+        self.failover_after = failover_after
+        self.on_failover = on_failover
+        self.epoch = None  # None: precisa de snapshot antes de seguir o log
+        self.last_seq = 0
+        self.last_contact = time.monotonic()
+        self.lock = threading.Lock()  # Troca de primário (follow) durante o laço
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='replica', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def follow(self, primary_url):
+        #Passa a seguir outro primário (após um failover); recomeça pelo snapshot.
+        with self.lock:
+            self.primary_url = primary_url
+            self.epoch = None
+            self.last_contact = time.monotonic()
+
+    def proxy(self):
+        return PeerProxy(self.primary_url, self.chat_server.peer_secret)
+
+    def run(self):
+        # Jitter na espera do failover: várias réplicas não tentam se promover no mesmo instante
+        failover_after = self.failover_after and self.failover_after * random.uniform(1, 1.5)
+        while not self.stop.is_set():
+            with self.lock:
+                primary, epoch = self.proxy(), self.epoch
+            try:
+                if epoch is None:
+                    self.sync(primary)
+                    continue
+                started = time.monotonic()
+                records = primary.replication_pull(self.replica_id, epoch, self.last_seq, PULL_LIMIT, PULL_TIMEOUT)
+                self.last_contact = time.monotonic()
+                if records is None:
+                    self.epoch = None  # Atraso maior que o log ou primário reiniciado
+                    continue
+                for record in records:
+                    self.chat_server._apply_change(record, primary)
+                    self.last_seq = record['seq']
+                if not records and self.last_contact - started < 1:
+                    self.stop.wait(1)  # Primário sem long-polling (modo single): consulta a cada segundo
+            except xmlrpc.client.Fault as e:
+                # O primário respondeu, mas recusou (ex.: replicação desativada): não conta para o failover
+                self.last_contact = time.monotonic()
+                print(f"Primário {self.primary_url} recusou a replicação: {e}")
+                self.epoch = None
+                self.stop.wait(5)
+            except (OSError, xmlrpc.client.Error) as e:
+                if failover_after and time.monotonic() - self.last_contact > failover_after:
+                    print(f"Primário {self.primary_url} sem resposta há {failover_after:.0f}s: promovendo esta réplica.")
+                    self.on_failover()
+                    return
+                print(f"Falha ao replicar de {self.primary_url}: {e}")
+                self.stop.wait(1)
+            except Exception as e:
+                # Registro que não pôde ser aplicado (ex.: histórico que o primário não tem mais): recomeça pelo snapshot
+                print(f"Réplica fora de sincronia com {self.primary_url}: {e}")
+                self.epoch = None
+                self.stop.wait(1)
+
+    def sync(self, primary):
+        # Snapshot difuso: o estado é lido depois de anotar a posição do log, e os registros seguintes
+        # são aplicados de novo por cima. A aplicação é idempotente, então o resultado converge.
+        snapshot = primary.replication_snapshot()
+        self.chat_server._apply_snapshot(snapshot, primary)
+        self.epoch = snapshot['epoch']
+        self.last_seq = snapshot['log_seq']
+        self.last_contact = time.monotonic()
+        print(f"Réplica sincronizada com {self.primary_url} (log em {self.last_seq}).")
@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import marshal
+import queue
+import sys
+import threading
+import time
+
+TRACE_VERSION = 1
+BATCH_SIZE = 500  # Registros serializados por escrita no arquivo
+MAX_BYTES = 1024 * 1024 * 1024  # Tamanho a partir do qual a captura para sozinha
+# O arquivo fica na ordem de término das chamadas; a leitura as devolve na ordem de chegada, segurando
+# os registros por este tempo (segundos de trace), maior que a chamada mais longa (long-polling, até 30 s)
+REORDER_WINDOW = 60
+
+# Parâmetros com texto do usuário (mensagens e senhas). Sem full=True são gravados como um texto
+# do mesmo tamanho: o replay mantém o custo (tamanho das mensagens, senha igual em todo login do
+# usuário) sem guardar o conteúdo.
+REDACTED_PARAMS = {
+    'send_message': (2,),
+    'bulk_send_message': (2,),
+    'login_user': (1,),
+    'register_user': (1,),
+}
+# Parâmetros removidos também com full=True: o segredo do cluster nunca vai para o arquivo
+SECRET_PARAMS = {
+    'peer_call': (0,),
+}
+
+# Campos de cada registro do trace, nesta ordem
+RECORD_FIELDS = ('offset', 'method', 'params', 'arg_sizes', 'response_size', 'duration', 'ok')
+
+
+def size_of(value):
+    #Bytes do valor serializado (marshal): aproxima o tamanho no protocolo; -1 se não serializável.
+    try:
+        return len(marshal.dumps(value))
+    except ValueError:
+        return -1
+
+
+def redact(method, params, full=False):
+    indexes = SECRET_PARAMS.get(method, ()) if full else REDACTED_PARAMS.get(method, ()) + SECRET_PARAMS.get(method, ())
+    if not indexes:
+        return params
+    params = list(params)
+    for index in indexes:
+        if index < len(params) and isinstance(params[index], str):
+            params[index] = 'x' * len(params[index])
+    return params
+
+
+class TraceWriter:
+    # Captura das chamadas RPC do servidor em um arquivo binário: um cabeçalho e um registro
+    # marshal por chamada (RECORD_FIELDS), lidos por read_trace e benchmarks/replay_trace.py.
+    # A requisição só enfileira uma tupla; os tamanhos, a remoção dos textos e a serialização
+    # ficam na thread de escrita. Com a fila cheia o registro é descartado (e contado).
+
+    def __init__(self, path, full=False, max_bytes=MAX_BYTES, queue_size=10000):
+        self.path = path
+        self.full = full  # Grava os textos das mensagens e as senhas como chegaram (nunca o segredo do cluster)
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.stopped = False  # Captura encerrada (close ou limite de tamanho)
+        self.started = time.monotonic()  # Os registros guardam o horário de chegada relativo a este
+        self.file = open(path, 'wb')
+        marshal.dump({'version': TRACE_VERSION, 'started': time.time(), 'full': full}, self.file)
+        self.thread = threading.Thread(target=self.write_loop, name='rpc-trace', daemon=True)
+        self.thread.start()
+
+    def record(self, arrived, method, params, result, duration, ok):
+        #Registra uma chamada; arrived é um time.monotonic() anotado na chegada.
+        if self.stopped:
+            return
+        try:
+            self.queue.put_nowait((arrived - self.started, method, params, result, duration, ok))
+        except queue.Full:
+            self.dropped += 1
+
+    def write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            chunks = []
+            stop = False
+            for item in batch:
+                if item is None:
+                    stop = True
+                    continue
+                offset, method, params, result, duration, ok = item
+                arg_sizes = tuple(size_of(param) for param in params)
+                response_size = size_of(result) if ok else 0
+                params = redact(method, params, self.full)
+                try:
+                    chunks.append(marshal.dumps((offset, method, list(params), arg_sizes, response_size, duration, ok)))
+                except ValueError:
+                    # Parâmetro sem equivalente no marshal (ex.: DateTime do XML-RPC): fica só o tamanho
+                    chunks.append(marshal.dumps((offset, method, None, arg_sizes, response_size, duration, ok)))
+            if self.dropped:
+                print(f"Trace: {self.dropped} chamadas descartadas (fila cheia).", file=sys.stderr)
+                self.dropped = 0
+            if not self.file.closed:
+                self.file.write(b''.join(chunks))
+                self.file.flush()
+                if self.file.tell() >= self.max_bytes:
+                    self.stopped = True
+                    self.file.close()
+                    print(f"Trace {self.path} atingiu {self.max_bytes} bytes: captura encerrada.", file=sys.stderr)
+            if stop:
+                self.file.close()
+                return
+
+    def close(self):
+        #Grava o que estiver na fila e fecha o arquivo.
+        if not self.thread.is_alive():
+            return
+        self.stopped = True
+        self.queue.put(None)  # Bloqueante: o marcador de fim não pode ser descartado
+        self.thread.join(timeout=5)
+
+
+def read_trace(path):
+    #Abre um trace gravado por TraceWriter: (cabeçalho, iterador dos registros, na ordem de chegada).
+    f = open(path, 'rb')
+    try:
+        header = marshal.load(f)
+    except (EOFError, ValueError, TypeError):
+        f.close()
+        raise Exception(f"{path} não é um trace de chamadas RPC.")
+    if not isinstance(header, dict) or header.get('version') != TRACE_VERSION:
+        f.close()
+        raise Exception(f"{path}: versão de trace não suportada.")
+
+    def records():
+        pending = []  # Heap por horário de chegada
+        with f:
+            for count in itertools.count():
+                try:
+                    record = marshal.load(f)
+                except (EOFError, ValueError, TypeError):
+                    break  # Fim do arquivo (ou último registro incompleto, se o servidor foi morto)
+                heapq.heappush(pending, (record[0], count, record))
+                finished = record[0] + record[5]
+                # Os registros ainda não lidos terminaram depois deste e não chegaram antes de finished - REORDER_WINDOW
+                while pending[0][0] < finished - REORDER_WINDOW:
+                    yield heapq.heappop(pending)[2]
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    return header, records()
@@ -0,0 +1,184 @@
+import array
+import bisect
+import heapq
+import itertools
+import marshal
+import os
+import re
+import unicodedata
+
+WORD = re.compile(r'\w+')
+MAX_TERM_LENGTH = 32  # Termos maiores são truncados (no índice e na consulta)
+MAX_TERMS_PER_MESSAGE = 64  # Termos distintos indexados por mensagem: limita o custo de textos enormes
+MIN_PREFIX = 2  # Prefixos menores são tratados como termo exato
+MAX_EXPANSIONS = 1000  # Termos considerados por prefixo
+MAX_SCAN = 200000  # Candidatos examinados por consulta antes de desistir (resultado parcial)
+SNAPSHOT_NAME = 'search.idx'  # Arquivo do índice no diretório da sala
+SNAPSHOT_VERSION = 1
+
+
+def normalize(text):
+    # Minúsculas e sem acentos: "Não" e "nao" viram o mesmo termo
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def message_terms(text):
+    #Termos distintos de um texto, na ordem em que aparecem.
+    words = dict.fromkeys(word[:MAX_TERM_LENGTH] for word in WORD.findall(normalize(text)))
+    return itertools.islice(words, MAX_TERMS_PER_MESSAGE)
+
+
+def parse_query(query):
+    #Converte a consulta em (termo, prefixo?). "cha*" busca por prefixo; as palavras são combinadas com E.
+    tokens = []
+    for part in query.split():
+        words = WORD.findall(normalize(part))
+        for i, word in enumerate(words):
+            prefix = part.endswith('*') and i == len(words) - 1 and len(word) >= MIN_PREFIX
+            tokens.append((word[:MAX_TERM_LENGTH], prefix))
+    return tokens
+
+
+def contains(postings, seq):
+    i = bisect.bisect_left(postings, seq)
+    return i < len(postings) and postings[i] == seq
+
+
+class RoomIndex:
+    # Índice invertido de uma sala: termo -> seqs das mensagens que o contêm (array compacto, 4 bytes
+    # por ocorrência, em ordem crescente porque as mensagens chegam em ordem). Atualizado a cada envio,
+    # sob o lock da sala. Cobre só as últimas `window` mensagens: ao passar disso, o quarto mais antigo
+    # sai do índice, então a memória fica limitada mesmo em salas com milhões de mensagens.
+
+    def __init__(self, window):
+        self.window = window
+        self.postings = {}  # termo -> array('I') de seqs
+        self.terms = []  # Os mesmos termos, para a busca por prefixo (ordenados só quando alguém busca)
+        self.terms_sorted = True
+        # Mensagens privadas: seq -> destinatário, em arrays paralelos (as públicas não aparecem aqui)
+        self.private_seqs = array.array('I')
+        self.private_to = []
+        self.first_seq = 1  # Mensagens anteriores não estão no índice
+        self.last_seq = 0  # Última mensagem indexada
+
+    def add(self, msg):
+        #Indexa uma mensagem. Deve ser chamado na ordem de seq (lock da sala).
+        if msg.seq <= self.last_seq:
+            return  # Já indexada
+        if not self.last_seq:
+            self.first_seq = msg.seq
+        for term in message_terms(msg.text):
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array.array('I')
+                self.terms.append(term)
+                self.terms_sorted = False
+            postings.append(msg.seq)
+        if msg.recipient is not None:
+            self.private_seqs.append(msg.seq)
+            self.private_to.append(msg.recipient)
+        self.last_seq = msg.seq
+        if self.last_seq - self.first_seq >= self.window:
+            self.trim(self.last_seq - self.window * 3 // 4 + 1)
+
+    def trim(self, first_seq):
+        # Remove as mensagens anteriores a first_seq (custo amortizado em window / 4 envios)
+        for term, postings in list(self.postings.items()):
+            del postings[:bisect.bisect_left(postings, first_seq)]
+            if not postings:
+                del self.postings[term]
+        if len(self.terms) != len(self.postings):
+            self.terms = list(self.postings)
+            self.terms_sorted = False
+        cut = bisect.bisect_left(self.private_seqs, first_seq)
+        del self.private_seqs[:cut]
+        del self.private_to[:cut]
+        self.first_seq = first_seq
+
+    def expand(self, prefix):
+        #Postings dos termos que começam com prefix.
+        if not self.terms_sorted:
+            self.terms.sort()  # Já ordenada exceto pelos termos novos no fim: o timsort resolve rápido
+            self.terms_sorted = True
+        start = bisect.bisect_left(self.terms, prefix)
+        matches = itertools.takewhile(lambda term: term.startswith(prefix), itertools.islice(self.terms, start, None))
+        return [self.postings[term] for term in itertools.islice(matches, MAX_EXPANSIONS)]
+
+    def visible(self, seq, username):
+        # Mesma regra de Message.visible_to: privadas só para o destinatário
+        i = bisect.bisect_left(self.private_seqs, seq)
+        if i < len(self.private_seqs) and self.private_seqs[i] == seq:
+            return self.private_to[i] == username
+        return True
+
+    def search(self, query, username, limit):
+        #Seqs das mensagens visíveis ao usuário com todos os termos da consulta, da mais nova para a mais antiga.
+        groups = []
+        for term, prefix in parse_query(query):
+            if prefix:
+                lists = self.expand(term)
+            else:
+                lists = [self.postings[term]] if term in self.postings else []
+            if not lists:
+                return []
+            groups.append(lists)
+        if not groups:
+            return []
+        # Percorre o termo mais raro (do fim para o início) e confere os demais por busca binária
+        groups.sort(key=lambda lists: sum(map(len, lists)))
+        driver, others = groups[0], groups[1:]
+        candidates = heapq.merge(*(reversed(postings) for postings in driver), reverse=True)
+        results = []
+        previous = None
+        for scanned, seq in enumerate(candidates):
+            if scanned >= MAX_SCAN or len(results) >= limit:
+                break
+            if seq == previous:
+                continue  # Mesma mensagem em dois termos do mesmo prefixo
+            previous = seq
+            if all(any(contains(postings, seq) for postings in lists) for lists in others) \
+                    and self.visible(seq, username):
+                results.append(seq)
+        return results
+
+    def save(self, path):
+        #Grava o índice (gravação atômica); no próximo início só as mensagens posteriores são indexadas.
+        data = {
+            'version': SNAPSHOT_VERSION,
+            'first_seq': self.first_seq,
+            'last_seq': self.last_seq,
+            'postings': {term: postings.tobytes() for term, postings in self.postings.items()},
+            'private_seqs': self.private_seqs.tobytes(),
+            'private_to': self.private_to,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, window):
+        #Lê um índice gravado por save(); None se não existir ou for de outra versão.
+        try:
+            with open(path, 'rb') as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+            return None
+        index = cls(window)
+        index.first_seq = data['first_seq']
+        index.last_seq = data['last_seq']
+        for term, raw in data['postings'].items():
+            postings = index.postings[term] = array.array('I')
+            postings.frombytes(raw)
+        index.terms = list(index.postings)
+        index.terms_sorted = False
+        index.private_seqs.frombytes(data['private_seqs'])
+        index.private_to = data['private_to']
+        if index.last_seq - index.first_seq >= window:
+            index.trim(index.last_seq - window + 1)  # Gravado com uma janela maior
+        return index
@@ -1,250 +1,1463 @@
+import argparse
+import collections
+import contextlib
+import heapq
+import itertools
 import json
 import logging
 import os
+import queue
+import socketserver
 import sys
+import xmlrpc.client
 import xmlrpc.server
-from datetime import datetime, timedelta
+from eventlog import EventLog, parse_sampling
+from events import EventHub
+from expiry import ExpiryScheduler
+from hashring import HashRing
+from history import HistoryStore
+from journal import FSYNC_POLICIES, UserJournal
+from message import Message
+from metrics import Metrics, TimedLock, prometheus_text, write_atomic
+from ratelimit import RateLimiter, parse_limits, set_client_address
+from peer import PEER_CALL, PeerProxy, check_secret
+from replication import LOG_LIMIT, PULL_LIMIT, ChangeLog, ReplicaFollower, replica_procedure
+from rpctrace import TraceWriter
+from search import SNAPSHOT_NAME, RoomIndex
+from wire import WireServer
 import threading
 import time
+import urllib.parse
+
+JOIN_HISTORY = 50  # Mensagens devolvidas ao entrar em uma sala (e carregadas ao abrir uma sala do disco)
+MAX_BATCH = 500  # Máximo de mensagens lidas do disco por chamada ao buscar mensagens antigas
+MAX_SEARCH_RESULTS = 100  # Resultados por chamada de search_messages
+INDEX_BATCH = 5000  # Mensagens indexadas por vez (com o lock da sala) ao construir o índice de busca
+SEARCH_WINDOW_FACTOR = 100  # --search-window padrão, em múltiplos de --history-limit
+SEARCH_BUDGET_FACTOR = 10  # --search-budget padrão, em múltiplos de --search-window (índices cheios em memória)
+
+# Descarte de carga: com shed_at chamadas em andamento, as de baixa prioridade são recusadas;
+# com o dobro, todas menos as de SHED_NEVER. O long-polling fica estacionado e não conta como carga.
+SHED_LOW = {'list_rooms', 'list_users', 'get_history', 'receive_messages', 'search_messages', 'subscribe'}
+SHED_NEVER = {'leave_room', 'unsubscribe', 'import_room', 'get_stats', 'metrics_text', 'get_transports'}
+# Heartbeats seguidos em sobrecarga até o servidor se declarar indisponível ao binder: um pico curto não o tira do
+# mapa de shards (o que moveria as salas dele)
+UNHEALTHY_BEATS = 3
+PARKED_METHODS = {'wait_for_messages', 'replication_pull'}
+
+# Operações internas do cluster: métodos privados (com '_') que só chegam por peer_call com o segredo
+# compartilhado (--peer-secret). Nenhum cliente comum consegue chamá-los.
+PEER_METHODS = {'replication_pull', 'replication_snapshot', 'replication_messages', 'promote', 'follow_primary',
+                'import_room'}
+
+# Streaming do protocolo JSON: só chegam pelo wire.py, que passa ao _dispatch o assinante da conexão.
+# params[0] é o usuário (para os limites de chamadas); a função privada recebe o assinante no lugar dele
+STREAM_METHODS = {'subscribe', 'unsubscribe'}
+
+# Chamadas que renovam o lease de presença do usuário (params[0]); no streaming, o cliente responde os pings com heartbeat
+PRESENCE_METHODS = {'join_room', 'send_message', 'bulk_send_message', 'receive_messages', 'receive_messages_since',
+                    'wait_for_messages', 'get_history', 'heartbeat'}
+
+# Réplicas só atendem leituras; as demais chamadas recebem READ_ONLY com o endereço do primário
+READ_METHODS = {'list_rooms', 'list_users', 'get_history', 'receive_messages', 'receive_messages_since',
+                'wait_for_messages', 'search_messages', 'is_user_in_room', 'subscribe', 'unsubscribe', 'get_stats',
+                'metrics_text', 'get_transports', 'get_load', 'replication_status', 'promote', 'follow_primary'}  # Inclui internas (peer_call)
 
 class ChatServer:
-    def __init__(self):
+    def __init__(self, data_dir='.', fsync='always', compact_every=1000, history_limit=1000, room_idle_ttl=300,
+                 log_sampling=None, rate_limits=None, shed_at=64, presence_ttl=60, search_window=None,
+                 search_budget=None, replication_log=None):
         self.users = {}  # Armazena os usuários registrados
+        self.history_limit = history_limit  # Mensagens mantidas em memória por sala; as demais só em disco
+        self.room_idle_ttl = room_idle_ttl  # Segundos que uma sala vazia pode ficar inativa antes de ser removida
+        # Mensagens mais recentes de cada sala cobertas pelo índice de busca, proporcional ao buffer em memória
+        self.search_window = search_window or SEARCH_WINDOW_FACTOR * history_limit
+        # Índices de busca em memória, do menos para o mais usado (nome -> sala). Acima de search_budget
+        # mensagens indexadas no total, os menos usados são gravados em search.idx e descarregados
+        self.search_budget = search_budget or SEARCH_BUDGET_FACTOR * self.search_window
+        self.search_lru = collections.OrderedDict()
+        self.search_lock = threading.Lock()  # Nunca adquirido com o lock de uma sala
         self.rooms = {}  # Armazena as salas de chat
-        self.lock = threading.Lock()  # Lock para garantir acesso seguro de múltiplas threads
+        # Log de eventos: até _setup_logger(), os registros saem pelo print na hora
+        self.log = EventLog(sink=lambda line: print(line), sampling=log_sampling)
+        self.metrics = Metrics()  # Contadores por RPC e tempo de espera nos locks (get_stats)
+        # Locks de granularidade fina. Ordem de aquisição: rooms_lock -> lock da sala -> users_lock
+        self.rooms_lock = TimedLock(self.metrics.lock_stats('rooms'))  # Protege apenas o dicionário de salas (seguro por pouco tempo)
+        self.users_lock = TimedLock(self.metrics.lock_stats('users'))  # Protege o dicionário de usuários e as listas de salas de cada um
+        self.max_wait = 30  # Tempo máximo (segundos) que wait_for_messages pode segurar uma requisição
+        self.wait_slots = None  # Limite de long-pollings simultâneos (None = sem limite)
 
-        # Criação e carregamento do arquivo JSON de dados
-        self.load_or_create_user_data()
-        
-        # Inicia a thread de monitoramento de salas inativas
-        threading.Thread(target=self.monitor_inactive_rooms, daemon=True).start()
-
-    def load_or_create_user_data(self):
-        #Cria ou carrega dados de usuários e salas do arquivo JSON.
-        if not os.path.exists('user_data.json'):
-            # Cria o arquivo JSON caso não exista
-            with open('user_data.json', 'w') as f:
-                json.dump({'users': {}}, f)
-        
-        # Carrega os dados do arquivo JSON
-        with open('user_data.json', 'r') as f:
-            data = json.load(f)
-            self.users = data.get('users', {})
-
-    def save_user_data(self):
-        #Salva os dados de usuários no arquivo JSON.
-        data = {
-            'users': self.users,
-        }
-        with open('user_data.json', 'w') as f:
-            json.dump(data, f)
+        # Controle de admissão, aplicado no _dispatch antes de qualquer lock das salas
+        self.rate_limiter = RateLimiter(rate_limits)  # Token bucket por usuário (ou endereço) e método
+        self.shed_at = shed_at  # Chamadas em andamento que ativam o descarte de carga (0 = desativado)
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+        # Sharding: salas distribuídas entre os servidores por hash consistente do nome (mapa vindo do binder)
+        self.shard_id = None  # "endereço:porta" desta instância no anel
+        self.shard_ring = None  # HashRing com os servidores ativos; None = sem sharding (servidor único)
+        self.shard_version = None
+        self.moved_rooms = {}  # Salas transferidas para outro servidor: nome -> novo dono
+        self.rebalance_lock = threading.Lock()  # Uma redistribuição de salas por vez
+
+        # Presença: lease por usuário, renovado pelas chamadas das PRESENCE_METHODS. Quando vence sem
+        # renovação, o reaper tira o usuário das salas (clientes que travaram ou perderam a conexão)
+        self.presence_ttl = presence_ttl
+        self.sessions = {}  # username -> prazo do lease (epoch)
+        self.sessions_lock = threading.Lock()
+        self.presence = ExpiryScheduler(self._expire_session, name='presence')
+
+        # Replicação: o primário registra as alterações em um log lido pelas réplicas (replication_pull).
+        # Só existe com a replicação ativada: cada registro de mensagem é uma cópia dela em memória
+        self.changes = ChangeLog(replication_log) if replication_log else None
+        self.replicas = {}  # id da réplica -> {'seq': última seq pedida, 'seen': horário}
+        self.follower = None  # ReplicaFollower enquanto este servidor for uma réplica (somente leitura)
+        self.server_id = None  # "endereço:porta" anunciado ao binder
+        self.binder_url = None
+        self.peer_secret = None  # Segredo compartilhado pelos servidores do cluster (peer_call)
+
+        self.tracer = None  # TraceWriter da captura de chamadas (--trace), para benchmarks/replay_trace.py
+
+        self.transports = {'xmlrpc': True}  # Protocolos oferecidos: nome -> porta (True = esta conexão)
+        self.events = EventHub()  # Assinantes do streaming de eventos das salas (protocolo JSON)
+
+        # Snapshot (user_data.json) + journal append-only com as alterações de usuários
+        self.journal = UserJournal(snapshot_path=os.path.join(data_dir, 'user_data.json'),
+                                   journal_path=os.path.join(data_dir, 'user_data.journal'),
+                                   fsync=fsync, compact_every=compact_every, snapshot_source=self._user_data_snapshot)
+        self._load_or_create_user_data()
+
+        # Histórico das salas em disco. Só a lista de salas é lida agora; o histórico de cada sala é
+        # carregado quando ela é usada pela primeira vez, então o tempo de partida não depende do histórico
+        self.history = HistoryStore(os.path.join(data_dir, 'rooms'))
+
+        # Remoção de salas vazias e inativas: cada sala vazia tem um prazo no heap do agendador
+        self.room_expiry = ExpiryScheduler(self._expire_room, name='room-expiry')
+        for room_name in self.history.list_rooms():
+            room = self.rooms[room_name] = self._new_room()
+            self._schedule_expiry(room_name, room)  # Ninguém está conectado logo após a inicialização
+
+    def _load_or_create_user_data(self):
+        #Carrega os usuários do snapshot e reaplica o journal gravado depois dele.
+        self.users = self.journal.load()
+        # As salas de cada usuário só valem enquanto ele está conectado, e ninguém está logo após a inicialização.
+        # Não são mais gravadas, mas journals antigos ainda podem trazê-las
+        for data in self.users.values():
+            data.pop('rooms', None)
+
+    def _user_data_snapshot(self):
+        #Serializa todos os usuários para a compactação do journal.
+        with self.users_lock:
+            return json.dumps({'users': {username: self._user_copy(username) for username in self.users}})
+
+    def _journal_user(self, username):
+        #Enfileira o estado do usuário no journal. Deve ser chamado com o users_lock adquirido,
+        #para que a ordem dos registros seja a ordem das alterações.
+        data = self._user_copy(username)
+        self._replicate({'op': 'put_user', 'username': username, 'data': data})
+        return self.journal.enqueue({'op': 'put_user', 'username': username, 'data': data})
+
+    def _user_copy(self, username):
+        # Cópia para o journal e o log de replicação, que é serializado depois, fora do users_lock.
+        # As salas do usuário ficam de fora: só valem enquanto ele está conectado e não são gravadas
+        return {key: value for key, value in self.users[username].items() if key != 'rooms'}
 
     def register_user(self, username, password):
         #Registra um novo usuário.
-        if username in self.users:
-            raise Exception(f"Nome de usuário '{username}' já está em uso.")
-        self.users[username] = {'password': password}
-        print(f"Usuário '{username}' registrado com sucesso!")
-        self.save_user_data()  # Salva os dados após o registro
+        with self.users_lock:
+            if username in self.users:
+                raise Exception(f"Nome de usuário '{username}' já está em uso.")
+            self.users[username] = {'password': password}
+            ticket = self._journal_user(username)
+        self.journal.wait(ticket)  # Aguarda o commit fora do lock: várias gravações dividem o mesmo fsync
+        self.log.emit('register', "Usuário '{user}' registrado com sucesso!", user=username)
         return True
 
     def login_user(self, username, password):
         #Realiza o login ou registro do usuário. Se o usuário não existir, ele é registrado.
         if username not in self.users:
             # Se o usuário não existir, realiza o registro
-            print(f"Usuário '{username}' não encontrado. Registrando...")  
+            self.log.emit('register', "Usuário '{user}' não encontrado. Registrando...", user=username)
             return self.register_user(username, password)  # Registra o usuário se não existir
 
         # Verifica a senha caso o usuário exista
         if self.users[username]['password'] != password:
             raise Exception("Senha incorreta.")
         
-        print(f"Usuário '{username}' logado com sucesso!")
+        self.log.emit('login', "Usuário '{user}' logado com sucesso!", user=username)
         return True
 
-    def create_room(self, room_name):
-        #Cria uma nova sala de chat.
-        if room_name in self.rooms:
-            raise Exception(f"Já existe uma sala com o nome '{room_name}'.")
-        with self.lock:
-            self.rooms[room_name] = {
-                'users': [],  # Lista de usuários na sala
-                'messages': [],  # Lista de mensagens na sala
-                'last_active': datetime.now()  # Hora da última atividade
-            }
-        print(f"Sala '{room_name}' criada com sucesso!")
-        self.save_user_data()  # Salva os dados após a criação da sala
+    def create_room(self, room_name, username=None):
+        #Cria uma nova sala de chat. username (opcional) só identifica quem chama, para o limite de chamadas.
+        owner = self._owner(room_name)
+        if owner is not None:
+            raise self._wrong_shard(room_name, owner)
+        room = self._new_room()
+        with self.rooms_lock:
+            self.moved_rooms.pop(room_name, None)
+            if room_name in self.rooms:
+                raise Exception(f"Já existe uma sala com o nome '{room_name}'.")
+            self.rooms[room_name] = room
+            room['lock'].acquire()  # Ninguém usa a sala antes de o histórico ser criado em disco
+        try:
+            self._load_room(room_name, room)
+        except Exception:
+            # Falha no disco: desfaz a sala em memória, senão ela ficaria listada sem histórico
+            room['removed'] = True  # Quem já aguardava o lock recebe "não existe"
+            room['lock'].release()
+            with self.rooms_lock:
+                if self.rooms.get(room_name) is room:
+                    del self.rooms[room_name]
+            raise
+        try:
+            self._replicate({'op': 'create_room', 'room': room_name})
+            self._schedule_expiry(room_name, room)  # A sala nasce vazia
+        finally:
+            room['lock'].release()
+        self.log.emit('room', "Sala '{room}' criada com sucesso!", room=room_name)
         return True
 
-    def join_room(self, username, room_name):
-        #Permite que um usuário entre em uma sala de chat.
-        if room_name not in self.rooms:
-            raise Exception(f"A sala '{room_name}' não existe.")
-        if username not in self.users:
-            raise Exception(f"Usuário '{username}' não registrado.")
-        
-        with self.lock:
-            room = self.rooms[room_name]
+    def _new_room(self):
+        #Estrutura de uma sala em memória. O histórico só é aberto em _load_room, no primeiro uso.
+        room_lock = TimedLock(self.metrics.lock_stats('room'))  # Lock próprio da sala: mensagens e membros
+        return {
+            'users': {},  # Membros da sala: username -> horário de entrada (conjunto na ordem de entrada)
+            # Buffer circular com as mensagens mais recentes; as anteriores ficam só no histórico em disco
+            'messages': collections.deque(maxlen=self.history_limit),
+            # Índices sobre as mesmas mensagens: só as públicas e, por destinatário, só as privadas
+            'broadcasts': collections.deque(maxlen=self.history_limit),
+            'inboxes': {},  # username -> deque com as mensagens privadas recebidas na sala
+            'bytes': 0,  # Memória das mensagens do buffer (gauge bytes_retained), atualizada a cada inserção
+            'next_seq': 1,  # Número de sequência da próxima mensagem da sala
+            'log': None,  # Histórico em disco (RoomLog); None enquanto a sala não foi carregada
+            'search': None,  # Índice de busca (RoomIndex), construído na primeira busca na sala
+            'lock': room_lock,
+            'cond': threading.Condition(room_lock),  # Acorda quem aguarda mensagens novas nesta sala
+            'removed': False,  # Marcada quando a sala é removida, para liberar quem está aguardando
+            'expiry_pending': False,  # Já existe um prazo de expiração desta sala no agendador
+            'migrating': False,  # Sendo transferida para outro servidor (_migrate_room)
+            'last_active': time.time()  # Hora da última atividade (epoch)
+        }
+
+    def _load_room(self, room_name, room):
+        #Abre o histórico da sala e carrega só as últimas mensagens. Deve ser chamado com o lock da sala.
+        log = self.history.open_room(room_name)
+        for msg in log.tail(min(JOIN_HISTORY, self.history_limit)):
+            self._buffer_message(room, msg)
+        room['next_seq'] = log.next_seq
+        room['log'] = log
+
+    def join_room(self, username, room_name, since_seq=None):
+        #Permite que um usuário entre em uma sala de chat. Com since_seq, só devolve as mensagens posteriores.
+        self._check_user(username)
+        with self._room(room_name) as room:
             if username not in room['users']:
-                room['users'].append(username)
+                room['users'][username] = time.time()
+                self._restore_inbox(room, username)
+                self.events.publish(room_name, {'type': 'join', 'room': room_name, 'user': username})
+                self._replicate({'op': 'join', 'room': room_name, 'user': username})
 
-            # Adiciona a sala à lista de salas do usuário, caso não exista
-            if 'rooms' not in self.users[username]:
-                self.users[username]['rooms'] = []
-            
-            self.users[username]['rooms'].append(room_name)  # Adiciona a sala à lista do usuário
-            room['last_active'] = datetime.now()
+            with self.users_lock:
+                # Adiciona a sala à lista de salas do usuário uma única vez (entrar de novo não duplica)
+                rooms = self.users[username].setdefault('rooms', [])
+                if room_name not in rooms:
+                    rooms.append(room_name)
+            room['last_active'] = time.time()
 
-        print(f"Usuário '{username}' entrou na sala '{room_name}'.")
-        return {
-            'users': room['users'],
-            'messages': room['messages'][-50:]  # Exibe as últimas 50 mensagens
+            # Copia dentro do lock: a resposta é serializada depois, com outras threads alterando a sala
+            users = list(room['users'])
+            first_seq = room['next_seq'] - JOIN_HISTORY
+            if since_seq is not None and 0 <= since_seq < room['next_seq']:
+                first_seq = max(first_seq, since_seq + 1)  # O cliente já tem as anteriores (cache local)
+            messages = self._read_range(room, first_seq, room['next_seq'] - 1)
+            cursor = room['next_seq'] - 1  # Cursor para continuar com receive_messages_since
+
+        result = {
+            'users': users,
+            # Exibe as últimas 50 mensagens (as privadas, só para o destinatário)
+            'messages': [msg.to_dict() for msg in messages if msg.visible_to(username)],
+            'cursor': cursor
         }
+        self.log.emit('join', "Usuário '{user}' entrou na sala '{room}'.", user=username, room=room_name)
+        return result
 
     def send_message(self, username, room_name, message, recipient=None):
         #Envia uma mensagem para uma sala (ou privada).
-        if room_name not in self.rooms:
-            raise Exception(f"A sala '{room_name}' não existe.")
-        if username not in self.users:
-            raise Exception(f"Usuário '{username}' não registrado.")
-        
-        timestamp = datetime.now().strftime("%H:%M")  # Formata o timestamp da mensagem
-
-        with self.lock:
-            room = self.rooms[room_name]
-            room['last_active'] = datetime.now()  # Atualiza a última atividade da sala
-            msg = {
-                'type': 'unicast' if recipient else 'broadcast',  # Tipo de mensagem: unicast ou broadcast
-                'from': username,
-                'to': recipient if recipient else None,  # Definindo o destinatário, se houver
-                'message': message,
-                'timestamp': timestamp  # Adiciona o timestamp à mensagem
-            }
-            room['messages'].append(msg)
-
-        # Exibe a mensagem no console
+        now = time.time()  # Um único relógio por envio: horário da mensagem e atividade da sala
+
+        self._check_user(username)
+        with self._room(room_name) as room:
+            self._append_message(room_name, room, now, username, recipient, message)
+        self._log_message(username, room_name, message, recipient)
+
+    def bulk_send_message(self, username, room_name, message, recipient=None):
+        #Verifica o destinatário e envia a mensagem em uma única chamada (antes: is_user_in_room + send_message).
+        now = time.time()
+
+        self._check_user(username)
+        with self._room(room_name) as room:
+            # A verificação e o envio acontecem sob o mesmo lock: o destinatário não sai no meio
+            if recipient and recipient not in room['users']:
+                return False
+            self._append_message(room_name, room, now, username, recipient, message)
+        self._log_message(username, room_name, message, recipient)
+        return True
+
+    def _append_message(self, room_name, room, now, username, recipient, message):
+        #Grava e publica uma mensagem. Deve ser chamado com o lock da sala adquirido.
+        room['last_active'] = now  # Atualiza a última atividade da sala
+        # Mensagem compacta; o texto do horário só é formatado na resposta ao cliente
+        msg = Message(room['next_seq'], int(now), username, recipient, message)
+        self._store_message(room_name, room, msg)
+
+    def _store_message(self, room_name, room, msg):
+        #Grava a mensagem seguinte da sala (envio, transferência ou réplica) e a publica.
+        #Deve ser chamado com o lock da sala adquirido.
+        room['log'].append(msg)  # Grava no histórico em disco antes de publicar
+        self._buffer_message(room, msg)
+        if room['search'] is not None:
+            room['search'].add(msg)
+        room['next_seq'] += 1
+        self._replicate({'op': 'message', 'room': room_name, 'message': msg.to_record()})
+        room['cond'].notify_all()  # Libera os clientes em wait_for_messages
+        # Publicado sob o lock da sala: os assinantes recebem as mensagens na ordem de seq
+        self.events.publish(room_name, {'type': 'message', 'room': room_name, 'message': msg}, msg.recipient)
+
+    def _log_message(self, username, room_name, message, recipient):
+        # Evento 'message': desligado por padrão (--log-sample message=taxa para amostrar)
         if recipient:
-            print(f"Mensagem privada enviada por {username} para {recipient} na sala '{room_name}'")
+            self.log.emit('message', "Mensagem privada enviada por {user} para {to} na sala '{room}'",
+                          user=username, to=recipient, room=room_name)
         else:
-            print(f"Mensagem enviada por {username} na sala '{room_name}': {message} ({'Pública'})")
+            self.log.emit('message', "Mensagem enviada por {user} na sala '{room}': {text} (Pública)",
+                          user=username, room=room_name, text=message)
 
     def receive_messages(self, username, room_name):
         #Recupera mensagens de uma sala para um usuário específico.
-        if room_name not in self.rooms:
+        self._check_user(username)
+        with self._room(room_name) as room:
+            # Apenas as mensagens ainda em memória
+            relevant_messages = self._visible_since(room, username, 0)
+        return [msg.to_dict() for msg in relevant_messages]
+
+    def receive_messages_since(self, username, room_name, last_seq):
+        #Recupera apenas as mensagens com número de sequência maior que last_seq, junto com o novo cursor.
+        self._check_user(username)
+        with self._room(room_name) as room:
+            result = self._collect_since(room, username, last_seq)
+        return self._export(result)
+
+    def wait_for_messages(self, username, room_name, cursor, timeout):
+        #Aguarda (long-polling) até chegarem mensagens depois do cursor ou até o timeout expirar.
+        # Sem vaga para estacionar a requisição (modo pool/single), responde imediatamente
+        parked = self.wait_slots is None or self.wait_slots.acquire(blocking=False)
+        if not parked:
+            timeout = 0
+        try:
+            deadline = time.monotonic() + max(0, min(timeout, self.max_wait))
+            self._check_user(username)
+            with self._room(room_name) as room:
+                while True:
+                    result = self._collect_since(room, username, cursor)
+                    if result['messages'] or room['removed'] or username not in room['users']:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # Mensagens privadas para outros usuários só avançam o cursor; continua aguardando
+                    cursor = result['cursor']
+                    if cursor < room['next_seq'] - 1:
+                        continue  # Lote do disco sem nada para ele: lê o seguinte em vez de esperar
+                    room['cond'].wait(remaining)
+                result['member'] = username in room['users']  # False: saiu ou teve a presença expirada
+            return self._export(result)
+        finally:
+            if parked and self.wait_slots is not None:
+                self.wait_slots.release()
+
+    def _subscribe(self, subscriber, room_name, cursor):
+        #Assina os eventos da sala (protocolo JSON) e devolve as mensagens visíveis após o cursor.
+        # Se o cursor estiver muito atrás, devolve só um lote com subscribed=False: o cliente
+        # repete a chamada com o novo cursor até alcançar o fim e a assinatura ser feita.
+        username = subscriber.username
+        self._check_user(username)
+        with self._room(room_name) as room:
+            if username not in room['users']:
+                raise Exception(f"O usuário '{username}' não está na sala '{room_name}'.")
+            result = self._collect_since(room, username, cursor)
+            # Backlog e assinatura sob o mesmo lock: nenhuma mensagem fica entre os dois
+            result['subscribed'] = result['cursor'] >= room['next_seq'] - 1
+            if result['subscribed']:
+                self.events.subscribe(subscriber, room_name)
+        return self._export(result)
+
+    def _unsubscribe(self, subscriber, room_name):
+        #Cancela a assinatura de uma sala (ou de todas, com room_name None).
+        self.events.unsubscribe(subscriber, room_name)
+        return True
+
+    def _get_room(self, room_name):
+        #Retorna a sala ou lança erro se não existir, segurando o rooms_lock só durante a busca.
+        with self.rooms_lock:
+            room = self.rooms.get(room_name)
+            owner = self.moved_rooms.get(room_name) if room is None else None
+        if room is None:
+            owner = owner or self._owner(room_name)
+            if owner is not None:
+                raise self._wrong_shard(room_name, owner)  # O cliente deve atualizar o mapa de shards
             raise Exception(f"A sala '{room_name}' não existe.")
+        return room
+
+    @contextlib.contextmanager
+    def _room(self, room_name):
+        #Adquire o lock da sala e a entrega, garantindo que ela não foi removida nesse meio-tempo.
+        room = self._get_room(room_name)
+        with room['lock']:
+            if room['removed']:
+                if room.get('moved_to'):
+                    raise self._wrong_shard(room_name, room['moved_to'])
+                raise Exception(f"A sala '{room_name}' não existe.")
+            if room['log'] is None:
+                self._load_room(room_name, room)  # Primeiro uso desde a inicialização
+            yield room
+
+    def _check_user(self, username):
+        #Lança erro se o usuário não estiver registrado.
         if username not in self.users:
             raise Exception(f"Usuário '{username}' não registrado.")
-        
-        room = self.rooms[room_name]
-        relevant_messages = [
-            msg for msg in room['messages'] 
-            if msg.get('to') == username or msg['type'] == 'broadcast'
-        ]
-        return relevant_messages
-
-    def list_rooms(self):
-        #Lista todas as salas disponíveis.
-        return list(self.rooms.keys())
-
-    def list_users(self, room_name):
-        #Lista todos os usuários em uma sala específica.
-        if room_name not in self.rooms:
-            raise Exception(f"A sala '{room_name}' não existe.")
-        return self.rooms[room_name]['users']
+
+    def _collect_since(self, room, username, last_seq):
+        #Filtra as mensagens visíveis ao usuário após last_seq. Deve ser chamado com o lock da sala adquirido.
+        cursor = room['next_seq'] - 1
+        if last_seq < 0 or last_seq > cursor:
+            last_seq = 0  # Cursor inválido (ex.: histórico apagado), reenvia desde o início
+        buffered_first = room['next_seq'] - len(room['messages'])
+        if last_seq + 1 < buffered_first:
+            # Mensagens que já não estão em memória: lê do disco em lotes de até MAX_BATCH
+            cursor = min(buffered_first - 1, last_seq + MAX_BATCH)
+            relevant_messages = [
+                msg for msg in self._read_range(room, last_seq + 1, cursor) if msg.visible_to(username)
+            ]
+        else:
+            relevant_messages = self._visible_since(room, username, last_seq)
+        return {'messages': relevant_messages, 'cursor': cursor}
+
+    @staticmethod
+    def _export(result):
+        #Converte as mensagens para o formato do cliente, já fora do lock da sala.
+        result['messages'] = [msg.to_dict() for msg in result['messages']]
+        return result
+
+    def _buffer_message(self, room, msg):
+        #Coloca a mensagem no buffer da sala e no índice correspondente (públicas ou caixa do destinatário).
+        messages = room['messages']
+        evicted = messages[0] if messages and len(messages) == messages.maxlen else None
+        messages.append(msg)
+        room['bytes'] += self._message_bytes(msg)
+        if msg.recipient is None:
+            room['broadcasts'].append(msg)
+        else:
+            inbox = room['inboxes'].get(msg.recipient)
+            if inbox is None:
+                inbox = room['inboxes'][msg.recipient] = collections.deque(maxlen=self.history_limit)
+            inbox.append(msg)
+        if evicted is not None:
+            room['bytes'] -= self._message_bytes(evicted)
+            # A mensagem que saiu do buffer circular sai também do seu índice (é sempre a mais antiga dele):
+            # os índices nunca devolvem mensagens que o buffer já não tem
+            index = room['broadcasts'] if evicted.recipient is None else room['inboxes'].get(evicted.recipient)
+            if index and index[0] is evicted:
+                index.popleft()
+                if not index and evicted.recipient is not None:
+                    del room['inboxes'][evicted.recipient]
+
+    @staticmethod
+    def _message_bytes(msg):
+        #Memória de uma mensagem em memória: o objeto compacto e o texto (os nomes são internados).
+        return sys.getsizeof(msg) + sys.getsizeof(msg.text)
+
+    def _restore_inbox(self, room, username):
+        #Refaz a caixa de quem entra na sala com as privadas ainda no buffer. Sempre a partir do buffer:
+        #a caixa é descartada na saída, e privadas enviadas enquanto ele estava fora criam uma caixa parcial.
+        inbox = collections.deque((msg for msg in room['messages'] if msg.recipient == username),
+                                  maxlen=self.history_limit)
+        if inbox:
+            room['inboxes'][username] = inbox
+        else:
+            room['inboxes'].pop(username, None)
+
+    def _visible_since(self, room, username, last_seq):
+        #Mensagens em memória visíveis ao usuário após last_seq: só as públicas e a caixa do próprio
+        #usuário são percorridas, nunca as privadas dos outros.
+        broadcasts = self._newer_than(room['broadcasts'], last_seq)
+        inbox = room['inboxes'].get(username)
+        if not inbox:
+            return broadcasts
+        return list(heapq.merge(broadcasts, self._newer_than(inbox, last_seq), key=lambda msg: msg.seq))
+
+    @staticmethod
+    def _newer_than(index, last_seq):
+        #Percorre o índice a partir do fim e para no cursor: custo proporcional às mensagens novas.
+        newer = []
+        for msg in reversed(index):
+            if msg.seq <= last_seq:
+                break
+            newer.append(msg)
+        newer.reverse()
+        return newer
+
+    def _read_range(self, room, first_seq, last_seq):
+        #Mensagens com seq entre first_seq e last_seq: as recentes vêm do buffer em memória e as
+        #antigas do arquivo da sala. Deve ser chamado com o lock da sala adquirido.
+        buffered = room['messages']
+        buffered_first = room['next_seq'] - len(buffered)
+        first_seq = max(first_seq, 1)
+        messages = []
+        if first_seq < buffered_first:
+            messages = room['log'].read_range(first_seq, min(last_seq, buffered_first - 1))
+        if last_seq >= buffered_first:
+            first_seq = max(first_seq, buffered_first)
+            skip = room['next_seq'] - 1 - last_seq
+            # Percorre o buffer a partir do fim: o custo é proporcional às mensagens pedidas, não ao buffer
+            newest = list(itertools.islice(reversed(buffered), skip, skip + last_seq - first_seq + 1))
+            messages.extend(reversed(newest))
+        return messages
+
+    def get_history(self, username, room_name, before_seq, limit):
+        #Página do histórico anterior a before_seq (0 = a partir da mensagem mais recente), do arquivo da sala.
+        self._check_user(username)
+        limit = max(1, min(limit, MAX_BATCH))
+        with self._room(room_name) as room:
+            newest = room['next_seq'] - 1
+            if before_seq <= 0 or before_seq > newest + 1:
+                before_seq = newest + 1
+            first_seq = max(1, before_seq - limit)
+            messages = self._read_range(room, first_seq, before_seq - 1)
+        relevant_messages = [msg.to_dict() for msg in messages if msg.visible_to(username)]
+        # before_seq da próxima página; has_more indica se ainda há mensagens mais antigas
+        return {'messages': relevant_messages, 'before_seq': first_seq, 'has_more': first_seq > 1}
+
+    def search_messages(self, username, room_name, query, limit=20):
+        #Busca mensagens visíveis ao usuário com todos os termos (prefixo com "*"), das mais novas para as mais antigas.
+        self._check_user(username)
+        limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+        while True:
+            self._build_index(room_name)
+            with self._room(room_name) as room:
+                index = room['search']
+                if index is None:
+                    continue  # Descarregado por outra busca entre a construção e a consulta: carrega de novo
+                seqs = index.search(query, username, limit)
+                # Os resultados costumam ser recentes (buffer em memória); os demais são lidos um a um do disco
+                messages = [msg for seq in seqs for msg in self._read_range(room, seq, seq)]
+                indexed_from = index.first_seq
+            break
+        self._track_index(room_name, room)
+        # indexed_from: mensagens anteriores estão fora da janela do índice (--search-window)
+        return {'messages': [msg.to_dict() for msg in messages], 'indexed_from': indexed_from}
+
+    def _build_index(self, room_name):
+        #Constrói o índice de busca da sala, se ainda não existir: lê o índice gravado no diretório da sala
+        #e indexa as mensagens posteriores em lotes, soltando o lock da sala entre um lote e outro.
+        with self._room(room_name) as room:
+            if room['search'] is not None:
+                return
+            path = os.path.join(room['log'].path, SNAPSHOT_NAME)
+            next_seq = room['next_seq']
+        index = RoomIndex.load(path, self.search_window)
+        if index is None or index.last_seq >= next_seq:
+            index = RoomIndex(self.search_window)  # Sem índice gravado, ou de um histórico que foi truncado
+        while True:
+            with self._room(room_name) as room:
+                if room['search'] is not None:
+                    return  # Outra busca terminou a construção antes
+                first_seq = max(index.last_seq + 1, room['next_seq'] - self.search_window)
+                last_seq = min(room['next_seq'] - 1, first_seq + INDEX_BATCH - 1)
+                for msg in room['log'].read_range(first_seq, last_seq):
+                    index.add(msg)
+                if last_seq >= room['next_seq'] - 1:
+                    room['search'] = index  # Em dia: a partir daqui, atualizado a cada envio
+                    return
+
+    def _track_index(self, room_name, room):
+        #Marca o índice da sala como o mais usado e descarrega os menos usados acima de --search-budget.
+        victims = []
+        with self.search_lock:
+            self.search_lru[room_name] = room
+            self.search_lru.move_to_end(room_name)
+            held = 0
+            for name, indexed in reversed(self.search_lru.items()):  # Do mais para o menos usado
+                index = indexed['search']
+                if index is not None:
+                    held += index.last_seq - index.first_seq + 1
+                if name != room_name and (index is None or indexed['removed'] or held > self.search_budget):
+                    victims.append((name, indexed))
+            for name, _ in victims:
+                del self.search_lru[name]
+        for name, indexed in victims:
+            with indexed['lock']:
+                if indexed['search'] is not None and not indexed['removed']:
+                    # Como no encerramento: a próxima busca na sala lê o índice gravado e só indexa as novas
+                    indexed['search'].save(os.path.join(indexed['log'].path, SNAPSHOT_NAME))
+                indexed['search'] = None
+
+    def list_rooms(self, username=None):
+        #Lista todas as salas disponíveis. username (opcional) só identifica quem chama, para o limite de chamadas.
+        with self.rooms_lock:
+            return list(self.rooms.keys())
+
+    def list_users(self, room_name, username=None):
+        #Lista todos os usuários em uma sala específica. username (opcional): como em list_rooms.
+        with self._room(room_name) as room:
+            return list(room['users'])
 
     def leave_room(self, room_name, username):
         #Permite que um usuário saia de uma sala de chat.
-        if room_name not in self.rooms:
-            raise Exception(f"A sala '{room_name}' não existe.")
-        if username not in self.users:
-            raise Exception(f"Usuário '{username}' não registrado.")
-        with self.lock:
-            room = self.rooms[room_name]
-            if username in room['users']:
-                room['users'].remove(username)
-
-            # Remove a sala da lista de salas do usuário
-            if 'rooms' in self.users[username]:
-                if room_name in self.users[username]['rooms']:
-                    self.users[username]['rooms'].remove(room_name)
-
-            if not room['users']:  # Atualiza a inatividade se a sala ficou vazia
-                room['last_active'] = datetime.now()
+        self._check_user(username)
+        with self._room(room_name) as room:
+            self._remove_member(room_name, room, username)
         
-        print(f"Usuário '{username}' saiu da sala '{room_name}'.")
+        self.log.emit('leave', "Usuário '{user}' saiu da sala '{room}'.", user=username, room=room_name)
         return True
 
+    def _remove_member(self, room_name, room, username):
+        #Tira o usuário da sala e a sala da lista dele. Deve ser chamado com o lock da sala adquirido.
+        if room['users'].pop(username, None) is not None:
+            self.events.publish(room_name, {'type': 'leave', 'room': room_name, 'user': username})
+            self._replicate({'op': 'leave', 'room': room_name, 'user': username})
+        room['inboxes'].pop(username, None)  # Volta a ser montada em _restore_inbox se ele entrar de novo
+        self._forget_room(username, room_name)
+        if not room['users']:  # Atualiza a inatividade se a sala ficou vazia
+            room['last_active'] = time.time()
+            self._schedule_expiry(room_name, room)
+        room['cond'].notify_all()  # Libera o long-polling de quem saiu
+
+    def _forget_room(self, username, room_name):
+        # Remove a sala da lista de salas do usuário
+        with self.users_lock:
+            rooms = self.users.get(username, {}).get('rooms')
+            if rooms and room_name in rooms:
+                rooms.remove(room_name)
+
+    def heartbeat(self, username):
+        #Mantém a presença do usuário (o lease é renovado no _dispatch) e devolve as salas em que ele está.
+        self._check_user(username)
+        with self.users_lock:
+            return list(self.users[username].get('rooms', []))
+
+    def _touch(self, username):
+        #Renova o lease de presença do usuário; só o primeiro lease de cada sessão entra no heap do reaper.
+        deadline = time.time() + self.presence_ttl
+        with self.sessions_lock:
+            new = username not in self.sessions
+            self.sessions[username] = deadline
+        if new:
+            self.presence.schedule(username, deadline)
+
+    def _expire_session(self, username):
+        #Chamado pelo agendador quando vence o lease de um usuário: tira-o das salas se não houve renovação.
+        with self.sessions_lock:
+            deadline = self.sessions.get(username)
+            if deadline is None:
+                return
+            if deadline <= time.time():
+                del self.sessions[username]
+        if deadline > time.time():
+            self.presence.schedule(username, deadline)  # Renovado depois do agendamento
+            return
+        with self.users_lock:
+            room_names = list(self.users.get(username, {}).get('rooms', ()))
+        for room_name in room_names:
+            try:
+                with self._room(room_name) as room:
+                    self._remove_member(room_name, room, username)
+            except Exception:
+                self._forget_room(username, room_name)  # Sala removida ou transferida
+            # Streaming que parou de responder aos pings: a assinatura acaba junto com a presença
+            self.events.drop_user(room_name, username)
+            self.log.emit('leave', "Usuário '{user}' removido da sala '{room}' por inatividade.",
+                          user=username, room=room_name)
+
     def is_user_in_room(self, username, room_name):
         #Verifica se um usuário está em uma sala específica.
-        return room_name in self.rooms and username in self.rooms[room_name]['users']
+        with self.rooms_lock:
+            room = self.rooms.get(room_name)
+        if room is None:
+            return False
+        with room['lock']:
+            return not room['removed'] and username in room['users']
 
-    def monitor_inactive_rooms(self):
-        #Monitora e remove salas sem usuários conectados após 5 minuto de inatividade."""
-        while True:
-            time.sleep(60)  # Verifica a cada minuto
-            with self.lock:
-                now = datetime.now()
-                inactive_rooms = [
-                    room_name for room_name, room_data in self.rooms.items()
-                    if not room_data['users'] and now - room_data['last_active'] > timedelta(minutes=5)
-                ]
-                for room_name in inactive_rooms:
-                    del self.rooms[room_name]
-                    print(f"Sala '{room_name}' removida por inatividade.")
-                self.save_user_data()  # Salva os dados após remover salas inativas
+    def _schedule_expiry(self, room_name, room):
+        #Agenda a verificação de inatividade da sala vazia. Deve ser chamado com o lock da sala adquirido.
+        # No máximo um prazo por sala no heap: se houver atividade antes dele, _expire_room reagenda
+        if not room['expiry_pending']:
+            room['expiry_pending'] = True
+            self.room_expiry.schedule((room_name, room), room['last_active'] + self.room_idle_ttl)
+
+    def _expire_room(self, key):
+        #Chamado pelo agendador quando vence o prazo de uma sala: remove-a se continuar vazia e inativa.
+        room_name, room = key
+        with self.rooms_lock, room['lock']:
+            room['expiry_pending'] = False
+            if room['removed'] or room['users'] or self.rooms.get(room_name) is not room:
+                return  # Sala já removida/recriada ou ocupada: será reagendada quando esvaziar
+            if room['migrating']:
+                return  # Sendo transferida: _migrate_room a remove ou, se falhar, reagenda a expiração
+            if self.follower is not None:
+                return  # Réplica: a remoção vem do primário; após a promoção, as salas vazias são reagendadas
+            if room['last_active'] + self.room_idle_ttl > time.time():
+                self._schedule_expiry(room_name, room)  # Teve atividade depois do agendamento
+                return
+            self._remove_room(room_name, room)
+        self.log.emit('room', "Sala '{room}' removida por inatividade.", room=room_name)
+
+    def _remove_room(self, room_name, room):
+        #Remove a sala e o histórico dela. Deve ser chamado com o rooms_lock e o lock da sala adquiridos.
+        room['removed'] = True
+        room['cond'].notify_all()
+        self.events.close_room(room_name, {'type': 'removed', 'room': room_name})
+        del self.rooms[room_name]
+        if room['log'] is not None:
+            room['log'].close()
+        self.history.delete_room(room_name)  # Renomeia já; a remoção dos arquivos é em segundo plano
+        self._replicate({'op': 'remove_room', 'room': room_name})
+
+    def _owner(self, room_name):
+        #Servidor dono da sala segundo o anel, ou None se for esta instância (ou se não houver sharding).
+        ring = self.shard_ring
+        if ring is None or self.shard_id not in ring.owners:
+            return None
+        owner = ring.node_for(room_name)
+        return None if owner == self.shard_id else owner
+
+    @staticmethod
+    def _wrong_shard(room_name, owner):
+        # O prefixo WRONG_SHARD permite ao cliente reconhecer o erro e atualizar o mapa de shards
+        return Exception(f"WRONG_SHARD {owner}: a sala '{room_name}' pertence a outro servidor.")
+
+    def _update_shard_map(self, shard_map, shard_id):
+        #Aplica um novo mapa de shards publicado pelo binder e transfere as salas que mudaram de dono.
+        if shard_map['version'] == self.shard_version and shard_id == self.shard_id:
+            return
+        self.shard_id = shard_id
+        self.shard_ring = HashRing(shard_map['shards'])
+        self.shard_version = shard_map['version']
+        threading.Thread(target=self._rebalance, name='rebalance', daemon=True).start()
+
+    def _rebalance(self):
+        #Envia aos novos donos as salas que este servidor deixou de possuir (só as afetadas pela mudança).
+        with self.rebalance_lock:
+            with self.rooms_lock:
+                room_names = list(self.rooms)
+            for room_name in room_names:
+                owner = self._owner(room_name)
+                if owner is None:
+                    continue
+                try:
+                    self._migrate_room(room_name, owner)
+                except Exception as e:
+                    print(f"Falha ao transferir a sala '{room_name}' para {owner}: {e}")
+
+    def _migrate_room(self, room_name, owner):
+        #Copia o histórico da sala para o novo dono e a remove daqui. Cada lote é lido com o lock da sala e
+        #enviado sem ele; a sala só é removida quando, de volta ao lock, não há mais mensagens a enviar.
+        target = PeerProxy(f'http://{owner}', self.peer_secret)
+        room = self._get_room(room_name)
+        with room['lock']:
+            room['migrating'] = True  # _expire_room não remove a sala no meio da cópia
+        try:
+            seq = 1
+            while True:
+                with room['lock']:
+                    if room['removed']:
+                        raise Exception(f"A sala '{room_name}' não existe.")  # Removida durante a cópia
+                    if room['log'] is None:
+                        self._load_room(room_name, room)
+                    if seq >= room['next_seq']:
+                        room['removed'] = True
+                        room['moved_to'] = owner  # Quem ainda usar esta sala aqui recebe WRONG_SHARD
+                        room['cond'].notify_all()
+                        self.events.close_room(room_name, {'type': 'removed', 'room': room_name, 'moved_to': owner})
+                        room['log'].close()
+                        self._replicate({'op': 'remove_room', 'room': room_name})
+                        break
+                    batch = room['log'].read_range(seq, min(seq + MAX_BATCH - 1, room['next_seq'] - 1))
+                target.import_room(room_name, [msg.to_record() for msg in batch])
+                seq += len(batch)
+        finally:
+            with room['lock']:
+                room['migrating'] = False
+                if not room['removed'] and not room['users']:
+                    self._schedule_expiry(room_name, room)  # Cópia falhou: a expiração adiada volta a valer
+        with self.rooms_lock:
+            if self.rooms.get(room_name) is room:
+                del self.rooms[room_name]
+            self.moved_rooms[room_name] = owner
+        self.history.delete_room(room_name)
+        print(f"Sala '{room_name}' transferida para {owner}.")
+
+    def _import_room(self, room_name, records):
+        #Recebe de outro servidor (em lotes) o histórico de uma sala que passou a pertencer a este.
+        owner = self._owner(room_name)
+        if owner is not None:
+            raise self._wrong_shard(room_name, owner)  # Mapas ainda divergentes: o remetente tenta depois
+        with self.rooms_lock:
+            self.moved_rooms.pop(room_name, None)
+            room = self.rooms.get(room_name)
+            if room is None:
+                room = self.rooms[room_name] = self._new_room()
+                self._replicate({'op': 'create_room', 'room': room_name})
+        # Espera limitada: dois servidores com mapas divergentes não ficam presos trocando a mesma sala
+        if not room['lock'].acquire(timeout=10):
+            raise Exception(f"A sala '{room_name}' está ocupada; tente novamente.")
+        try:
+            if room['removed']:
+                raise Exception(f"A sala '{room_name}' não existe.")
+            if room['log'] is None:
+                self._load_room(room_name, room)
+            for record in records:
+                msg = Message.from_record(record)
+                if msg.seq < room['next_seq']:
+                    continue  # Já importada (lote reenviado após uma falha)
+                if msg.seq != room['next_seq']:
+                    raise Exception(f"Histórico da sala '{room_name}' fora de ordem na transferência.")
+                self._store_message(room_name, room, msg)
+            self._schedule_expiry(room_name, room)
+            return room['next_seq'] - 1
+        finally:
+            room['lock'].release()
+
+    def _replicate(self, record):
+        #Acrescenta uma alteração ao log de replicação (só no primário). Chamado sob o lock que ordena a alteração.
+        if self.changes is not None and self.follower is None:
+            self.changes.append(record)
+
+    def _replication_pull(self, replica_id, epoch, after_seq, limit, timeout):
+        #Long-polling das réplicas: registros do log depois de after_seq; None se a réplica precisa do snapshot.
+        if self.changes is None:
+            raise Exception("Replicação desativada neste servidor.")
+        self.replicas[replica_id] = {'seq': after_seq, 'seen': time.time()}
+        return self.changes.read(epoch, after_seq, max(1, min(limit, PULL_LIMIT)), max(0, min(timeout, self.max_wait)))
+
+    def _replication_snapshot(self):
+        #Estado atual para uma réplica que está começando: usuários, salas (próxima seq e membros) e a posição do log.
+        if self.changes is None:
+            raise Exception("Replicação desativada neste servidor.")
+        with self.changes.cond:
+            epoch, log_seq = self.changes.epoch, self.changes.last_seq  # Anotada antes de ler o estado
+        with self.users_lock:
+            users = {username: self._user_copy(username) for username in self.users}
+        with self.rooms_lock:
+            rooms = list(self.rooms.items())
+        room_info = {}
+        for room_name, room in rooms:
+            with room['lock']:
+                if room['removed']:
+                    continue
+                if room['log'] is None:
+                    self._load_room(room_name, room)  # next_seq só é conhecido com o histórico aberto
+                room_info[room_name] = {'next_seq': room['next_seq'], 'users': list(room['users'])}
+        return {'epoch': epoch, 'log_seq': log_seq, 'users': users, 'rooms': room_info}
+
+    def _replication_messages(self, room_name, first_seq, last_seq):
+        #Mensagens de first_seq a last_seq (no máximo MAX_BATCH) no formato de disco, para uma réplica completar o histórico.
+        with self._room(room_name) as room:
+            messages = self._read_range(room, first_seq, min(last_seq, first_seq + MAX_BATCH - 1))
+        return [msg.to_record() for msg in messages]
+
+    def replication_status(self):
+        #Papel do servidor; no primário, a posição do log e o atraso de cada réplica.
+        follower = self.follower
+        if follower is not None:
+            return {'role': 'replica', 'primary': follower.primary_url, 'applied_seq': follower.last_seq}
+        log_seq = self.changes.last_seq if self.changes is not None else 0
+        now = time.time()
+        replicas = {}
+        for replica_id, info in list(self.replicas.items()):
+            if now - info['seen'] > 600:
+                self.replicas.pop(replica_id, None)  # Réplica que parou de pedir registros
+                continue
+            replicas[replica_id] = {'lag': log_seq - info['seq'], 'seen_seconds_ago': now - info['seen']}
+        return {'role': 'primary', 'log_seq': log_seq, 'replicas': replicas}
+
+    def _promote(self):
+        #Failover: promove esta réplica a primário. Passa a aceitar escritas e assume o lugar do antigo no binder.
+        follower = self.follower
+        if follower is None:
+            return False
+        follower.stop.set()
+        self.follower = None
+        old_primary = urllib.parse.urlsplit(follower.primary_url).netloc
+        # Salas vazias voltam a expirar, e os membros ganham um lease: quem não voltar a chamar é retirado
+        with self.rooms_lock:
+            rooms = list(self.rooms.items())
+        members = set()
+        for room_name, room in rooms:
+            with room['lock']:
+                if room['removed']:
+                    continue
+                members.update(room['users'])
+                if not room['users']:
+                    self._schedule_expiry(room_name, room)
+        for username in members:
+            self._touch(username)
+        threading.Thread(target=self._announce_promotion, args=(old_primary,), name='promotion', daemon=True).start()
+        print(f"Réplica promovida a primário (antes: {old_primary}).")
+        return True
+
+    def _announce_promotion(self, old_primary):
+        # Tira o antigo primário do binder (sem esperar o lease vencer) e faz as outras réplicas dele seguirem esta.
+        # O registro desta instância como chat_server é feito pela thread de heartbeat.
+        if self.binder_url is None:
+            return
+        binder = xmlrpc.client.ServerProxy(self.binder_url, allow_none=True)
+        try:
+            address, _, port = old_primary.rpartition(':')
+            binder.unregister_procedure('chat_server', address, int(port))
+            siblings = binder.lookup_endpoints(replica_procedure(old_primary))
+        except (OSError, xmlrpc.client.Error, ValueError) as e:
+            print(f"Falha ao atualizar o binder após a promoção: {e}")
+            return
+        for endpoint in siblings:
+            sibling = f"{endpoint['address']}:{endpoint['port']}"
+            if sibling == self.server_id:
+                continue
+            try:
+                PeerProxy(f'http://{sibling}', self.peer_secret).follow_primary(f'http://{self.server_id}')
+            except (OSError, xmlrpc.client.Error) as e:
+                print(f"Falha ao redirecionar a réplica {sibling}: {e}")
+
+    def _follow_primary(self, primary_url):
+        #Faz esta réplica seguir outro primário (chamado pela réplica promovida no failover).
+        if self.follower is None:
+            raise Exception("Este servidor não é uma réplica.")
+        self.follower.follow(primary_url)
+        return True
+
+    def _binder_procedure(self):
+        #Nome do registro no binder: primários formam o anel de shards; réplicas ficam sob o nome do seu primário.
+        follower = self.follower
+        if follower is not None:
+            return replica_procedure(urllib.parse.urlsplit(follower.primary_url).netloc)
+        return 'chat_server'
+
+    def _apply_change(self, record, primary):
+        #Aplica na réplica um registro do log do primário. Idempotente: aplicar de novo não muda nada.
+        op = record['op']
+        if op == 'put_user':
+            with self.users_lock:
+                self.users[record['username']] = record['data']
+                self._journal_user(record['username'])
+            return
+        room_name = record['room']
+        if op == 'remove_room':
+            self._drop_room(room_name)
+            return
+        self._ensure_room(room_name)
+        if op == 'create_room':
+            return
+        with self._room(room_name) as room:
+            if op == 'message':
+                msg = Message.from_record(record['message'])
+                if msg.seq > room['next_seq']:
+                    self._copy_history(room_name, room, primary, msg.seq - 1)  # Lacuna (ex.: logo após o snapshot)
+                if msg.seq == room['next_seq']:
+                    room['last_active'] = msg.ts
+                    self._store_message(room_name, room, msg)
+            elif op == 'join':
+                if record['user'] not in room['users']:
+                    room['users'][record['user']] = time.time()
+                    self._restore_inbox(room, record['user'])
+                    self.events.publish(room_name, {'type': 'join', 'room': room_name, 'user': record['user']})
+            elif op == 'leave':
+                if room['users'].pop(record['user'], None) is not None:
+                    self.events.publish(room_name, {'type': 'leave', 'room': room_name, 'user': record['user']})
+                room['inboxes'].pop(record['user'], None)
+                room['cond'].notify_all()
+
+    def _ensure_room(self, room_name):
+        #Cria a sala na réplica, se ainda não existir.
+        with self.rooms_lock:
+            if room_name not in self.rooms:
+                self.rooms[room_name] = self._new_room()
+
+    def _copy_history(self, room_name, room, primary, last_seq):
+        #Copia do primário as mensagens da sala até last_seq. Deve ser chamado com o lock da sala adquirido.
+        while room['next_seq'] <= last_seq:
+            records = primary.replication_messages(room_name, room['next_seq'], last_seq)
+            if not records:
+                raise Exception(f"O primário não tem mais as mensagens da sala '{room_name}' a partir de {room['next_seq']}.")
+            for record in records:
+                msg = Message.from_record(record)
+                if msg.seq == room['next_seq']:
+                    self._store_message(room_name, room, msg)
+
+    def _apply_snapshot(self, snapshot, primary):
+        #Alinha a réplica com o snapshot do primário, copiando só o histórico que falta em cada sala.
+        with self.users_lock:
+            for username, data in snapshot['users'].items():
+                if self.users.get(username) != data:
+                    self.users[username] = data
+                    self._journal_user(username)
+        with self.rooms_lock:
+            local_rooms = list(self.rooms.items())
+            for room_name, room in local_rooms:
+                if room_name not in snapshot['rooms']:
+                    with room['lock']:
+                        self._remove_room(room_name, room)  # Removida no primário
+        for room_name, info in snapshot['rooms'].items():
+            try:
+                self._ensure_room(room_name)
+                if not self._sync_room(room_name, info, primary):
+                    # Sala recriada no primário com o mesmo nome: descarta o histórico local e copia de novo
+                    self._drop_room(room_name)
+                    self._ensure_room(room_name)
+                    self._sync_room(room_name, info, primary)
+            except xmlrpc.client.Fault as e:
+                print(f"Sala '{room_name}' não copiada do primário: {e}")  # Removida no meio: o log corrige
 
-    def setup_logger(self):
-        # Configura o logger para redirecionar logs para um arquivo e o console.
-        log_dir = "logs"
-        os.makedirs(log_dir, exist_ok=True)  # Cria a pasta "logs" se não existir
+    def _sync_room(self, room_name, info, primary):
+        #Completa o histórico e os membros de uma sala da réplica; False se o histórico local divergiu do primário.
+        with self._room(room_name) as room:
+            last_seq = room['next_seq'] - 1
+            if last_seq >= info['next_seq']:
+                return False
+            if last_seq:
+                local = [msg.to_record() for msg in self._read_range(room, last_seq, last_seq)]
+                if local != primary.replication_messages(room_name, last_seq, last_seq):
+                    return False
+            self._copy_history(room_name, room, primary, info['next_seq'] - 1)
+            room['users'] = dict.fromkeys(info['users'], time.time())
+            return True
 
-        # Nome do arquivo de log com timestamp
-        timestamp = datetime.now().strftime("%H-%M_%d-%m-%Y")
-        log_file = os.path.join(log_dir, f"{timestamp}.txt")
+    def _drop_room(self, room_name):
+        #Remove a sala na réplica, se existir.
+        with self.rooms_lock:
+            room = self.rooms.get(room_name)
+            if room is not None:
+                with room['lock']:
+                    self._remove_room(room_name, room)
 
-        # Obtém o logger principal
-        logger = logging.getLogger()
+    def _dispatch(self, method, params, subscriber=None):
+        #Ponto de entrada único das chamadas remotas, usado pelo XML-RPC e pelo protocolo JSON (wire.py).
+        #subscriber: assinante da conexão JSON, só para os métodos de STREAM_METHODS.
+        tracer = self.tracer
+        if tracer is None:
+            return self._call(method, params, subscriber)
+        # Captura (--trace): chegada, duração e resposta de cada chamada, inclusive as recusadas
+        arrived = time.monotonic()
+        started = time.perf_counter()
+        try:
+            result = self._call(method, params, subscriber)
+        except BaseException:
+            tracer.record(arrived, method, params, None, time.perf_counter() - started, False)
+            raise
+        tracer.record(arrived, method, params, result, time.perf_counter() - started, True)
+        return result
 
-        # Verifica se o logger já está configurado
-        if logger.hasHandlers():
-            return  # Evita reconfiguração e múltiplos handlers
+    def _call(self, method, params, subscriber=None):
+        if method == PEER_CALL:
+            func, method, params = self._peer_method(params)  # A partir daqui, tratada pelo nome interno
+        elif method in STREAM_METHODS:
+            if subscriber is None:
+                raise Exception(f'Método "{method}" só está disponível no protocolo JSON.')
+            stream = getattr(self, '_' + method)
+            func = lambda username, *args: stream(subscriber, *args)
+        else:
+            # Mesmas regras do register_instance: só métodos públicos (sem '_') e sem nomes com ponto
+            func = xmlrpc.server.resolve_dotted_attribute(self, method, False)
+            if not callable(func):
+                raise Exception(f'Método "{method}" não suportado.')
+        follower = self.follower
+        if follower is not None and method not in READ_METHODS:
+            primary = urllib.parse.urlsplit(follower.primary_url).netloc
+            raise Exception(f"READ_ONLY {primary}: este servidor é uma réplica somente leitura.")
+        if not self.rate_limiter.allow(method, params):
+            self.metrics.record_rejected(method, 'rate')
+            raise Exception(f"RATE_LIMITED {method}: limite de chamadas excedido, tente novamente em instantes.")
+        counted = method not in PARKED_METHODS
+        if counted:
+            with self.in_flight_lock:
+                shed = self._shed(method, self.in_flight)
+                if not shed:
+                    self.in_flight += 1
+            if shed:
+                self.metrics.record_rejected(method, 'load')
+                raise Exception("SERVER_BUSY: servidor sobrecarregado, tente novamente em instantes.")
+        started = time.perf_counter()
+        try:
+            result = func(*params)
+        except BaseException:
+            self.metrics.record_call(method, time.perf_counter() - started, error=True)
+            raise
+        finally:
+            if counted:
+                with self.in_flight_lock:
+                    self.in_flight -= 1
+        self.metrics.record_call(method, time.perf_counter() - started)
+        if method in PRESENCE_METHODS and follower is None:
+            self._touch(params[0])
+        return result
+
+    def _peer_method(self, params):
+        #Desembrulha peer_call(segredo, método, parâmetros): só operações de PEER_METHODS, só com o segredo do cluster.
+        if len(params) != 3 or not isinstance(params[2], list):
+            raise Exception("peer_call espera (segredo, método, parâmetros).")
+        secret, method, args = params
+        if not check_secret(self.peer_secret, secret):
+            raise Exception("PEER_DENIED: segredo do cluster inválido ou não configurado (--peer-secret).")
+        if method not in PEER_METHODS:
+            raise Exception(f'Método "{method}" não suportado.')
+        return getattr(self, '_' + method), method, args
+
+    def _shed(self, method, in_flight):
+        #Decide se a chamada deve ser recusada pela carga atual (chamadas em andamento).
+        if not self.shed_at or method in SHED_NEVER:
+            return False
+        limit = self.shed_at if method in SHED_LOW else 2 * self.shed_at
+        return in_flight >= limit
+
+    def get_stats(self):
+        #Métricas do servidor: chamadas, erros e latência por RPC, espera nos locks e gauges.
+        return self.metrics.snapshot(self._gauges())
+
+    def metrics_text(self):
+        #As mesmas métricas no formato de texto do Prometheus.
+        return prometheus_text(self.get_stats())
 
-        logger.setLevel(logging.INFO)
+    def _gauges(self):
+        # O(salas): só lê contadores e tamanhos, sem o lock das salas (cada valor é lido de uma vez;
+        # a soma pode misturar salas em momentos ligeiramente diferentes, o que basta para um gauge)
+        with self.rooms_lock:
+            rooms = list(self.rooms.values())
+        gauges = {'rooms': len(rooms), 'rooms_loaded': 0, 'room_members': 0, 'messages_held': 0,
+                  'bytes_retained': 0, 'subscribers': 0, 'in_flight': self.in_flight, 'sessions': len(self.sessions)}
+        for room in rooms:
+            if room['log'] is not None:
+                gauges['rooms_loaded'] += 1
+            gauges['room_members'] += len(room['users'])
+            gauges['messages_held'] += len(room['messages'])
+            gauges['bytes_retained'] += room['bytes']
+        with self.users_lock:
+            gauges['users'] = len(self.users)
+        with self.events.lock:
+            gauges['subscribers'] = len({sub for subs in self.events.rooms.values() for sub in subs})
+        return gauges
 
-        # Configura um FileHandler
-        file_handler = logging.FileHandler(log_file, encoding="utf-8")
-        file_handler.setLevel(logging.INFO)
-        file_format = logging.Formatter("%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-        file_handler.setFormatter(file_format)
-        logger.addHandler(file_handler)
+    def get_transports(self):
+        #Negociação do protocolo: transportes oferecidos por este servidor (nome -> porta).
+        return dict(self.transports)
 
-        # Configura um StreamHandler para o console
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(file_format)
-        logger.addHandler(console_handler)
+    def get_load(self):
+        #Carga do servidor informada ao binder: total de usuários conectados nas salas.
+        with self.rooms_lock:
+            rooms = list(self.rooms.values())
+        return sum(len(room['users']) for room in rooms)
 
-        # Redireciona o print para logging.info
+    def _close(self):
+        #Grava o que estiver pendente e fecha os arquivos; os dados continuam disponíveis no próximo início.
+        # Privado: só o próprio processo encerra o servidor, nunca uma chamada remota
+        self.room_expiry.stop()
+        self.presence.stop()
+        if self.tracer is not None:
+            self.tracer.close()
+        self.journal.close()
+        self.log.close()
+        with self.rooms_lock:
+            rooms = list(self.rooms.values())
+        for room in rooms:
+            with room['lock']:
+                if room['search'] is not None and not room['removed']:
+                    # Grava o índice de busca: no próximo início, só as mensagens novas são indexadas
+                    room['search'].save(os.path.join(room['log'].path, SNAPSHOT_NAME))
+                if room['log'] is not None:
+                    room['log'].close()
+
+    def _setup_logger(self, log_dir="logs", max_bytes=10 * 1024 * 1024, backups=5):
+        # Passa o log para a thread de escrita: arquivo em "logs" (rotacionado) e o console.
+        # As requisições só enfileiram os registros; nenhuma espera por disco ou terminal.
+        self.log.start(log_dir, max_bytes=max_bytes, backups=backups)
+
+        # Redireciona o print (mensagens do servidor fora das requisições) para o mesmo log. Depois do
+        # close() do log os registros voltam para o sink: ele precisa ser o print de antes, não este
         global print
-        print = logger.info
+        self.log.sink = print
+        print = lambda *args: self.log.emit('info', ' '.join(str(arg) for arg in args))
+
+
+class ChatRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
+    # Guarda o endereço do cliente para os limites de chamadas sem usuário (ex.: create_room)
+    def do_POST(self):
+        set_client_address(self.client_address[0])
+        super().do_POST()
+
+    # As linhas de acesso HTTP vão para o log de eventos (tipo 'request'), não direto para o stderr
+    def log_message(self, format, *args):
+        self.server.event_log.emit('request', "{client} - {line}", client=self.client_address[0], line=format % args)
+
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+    # Servidor XML-RPC que atende cada requisição em uma thread, necessário para o long-polling
+    daemon_threads = True
+    request_queue_size = 128  # Backlog do listen(): evita conexões recusadas em rajadas de clientes
+
+
+class PooledXMLRPCServer(xmlrpc.server.SimpleXMLRPCServer):
+    # Servidor XML-RPC com um pool fixo de threads e uma fila limitada de requisições pendentes.
+    # No máximo workers + queue_size requisições ficam em andamento; o excedente é recusado com 503.
+
+    request_queue_size = 128  # Backlog do listen(): o excesso deve chegar à fila e receber 503, não um reset
+
+    def __init__(self, addr, workers=16, queue_size=64, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.pending = queue.Queue(maxsize=queue_size)  # Requisições aceitas aguardando uma thread livre
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.process_pending, name=f"rpc-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        # Chamado pela thread do serve_forever: só enfileira, nunca executa a requisição
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def process_pending(self):
+        # Laço de cada thread do pool: executa as requisições na ordem em que chegaram
+        while True:
+            request, client_address = self.pending.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request, client_address):
+        # Responde 503 sem ler a requisição: a fila está cheia e o cliente deve tentar mais tarde
+        try:
+            request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                            b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+        print(f"Requisição de {client_address[0]} recusada: fila de requisições cheia.")
+
+
+def parse_args(argv=None):
+    # Lê as opções de linha de comando do servidor de chat
+    parser = argparse.ArgumentParser(description="Servidor de chat distribuído (XML-RPC).")
+    parser.add_argument('--host', default='localhost', help="Endereço do servidor, também anunciado ao binder (padrão: localhost)")
+    parser.add_argument('--port', type=int, default=8000, help="Porta do servidor (padrão: 8000)")
+    parser.add_argument('--binder', default='http://localhost:5000', help="URL do binder (padrão: http://localhost:5000)")
+    parser.add_argument('--heartbeat', type=float, default=5,
+                        help="Intervalo em segundos entre os heartbeats enviados ao binder (padrão: 5)")
+    parser.add_argument('--mode', choices=['single', 'threaded', 'pool'], default='threaded',
+                        help="single: uma requisição por vez; threaded: uma thread por requisição; "
+                             "pool: pool fixo de threads com fila limitada (padrão: threaded)")
+    parser.add_argument('--workers', type=int, default=16, help="Threads do pool no modo pool (padrão: 16)")
+    parser.add_argument('--data-dir', default='.',
+                        help="Diretório dos dados persistidos: usuários e histórico das salas (padrão: .)")
+    parser.add_argument('--history-limit', type=int, default=1000,
+                        help="Mensagens mantidas em memória por sala; as mais antigas ficam só em disco (padrão: 1000)")
+    parser.add_argument('--room-ttl', type=int, default=300,
+                        help="Segundos que uma sala vazia pode ficar inativa antes de ser removida (padrão: 300)")
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default='always',
+                        help="always: fsync a cada commit em grupo; interval: no máximo 1 por segundo; "
+                             "never: deixa a cargo do sistema operacional (padrão: always)")
+    parser.add_argument('--compact-every', type=int, default=1000,
+                        help="Registros no journal que disparam a compactação em um novo snapshot (padrão: 1000)")
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help="Requisições pendentes aceitas no modo pool antes de recusar (padrão: 64)")
+    parser.add_argument('--log-sample', action='append', metavar='EVENTO=TAXA',
+                        help="Amostragem de um tipo de evento no log, de 0 a 1 (ex.: message=0.01). "
+                             "Tipos: message, request, join, leave, login, register, room, info. "
+                             "Padrão: message=0 e request=0, demais 1")
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024,
+                        help="Tamanho do arquivo de log que dispara a rotação (padrão: 10 MB)")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Grava periodicamente as métricas neste arquivo, no formato do Prometheus (padrão: desativado)")
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help="Segundos entre as gravações do --metrics-file (padrão: 15)")
+    parser.add_argument('--search-window', type=int, default=None,
+                        help="Mensagens mais recentes de cada sala cobertas pelo índice de busca "
+                             f"(padrão: {SEARCH_WINDOW_FACTOR} x --history-limit)")
+    parser.add_argument('--search-budget', type=int, default=None,
+                        help="Total de mensagens indexadas em memória, somando as salas; acima disso os índices menos "
+                             f"usados são gravados em disco e descarregados (padrão: {SEARCH_BUDGET_FACTOR} x --search-window)")
+    parser.add_argument('--presence-ttl', type=float, default=60,
+                        help="Segundos sem chamadas (polling, envio, heartbeat) até o usuário ser retirado das salas (padrão: 60)")
+    parser.add_argument('--rate-limit', action='append', metavar='METODO=TAXA:RAJADA',
+                        help="Limite de chamadas por usuário (ou endereço) de um método, em chamadas por segundo "
+                             "e rajada máxima (ex.: send_message=2:10; taxa 0 desativa). Pode ser repetido")
+    parser.add_argument('--shed-at', type=int, default=None,
+                        help="Chamadas em andamento a partir das quais as de baixa prioridade são recusadas; "
+                             "com o dobro, quase todas (padrão: --workers no modo pool, 64 nos demais; 0 desativa)")
+    parser.add_argument('--peer-secret', default=os.environ.get('CHAT_PEER_SECRET'), metavar='SEGREDO',
+                        help="Segredo compartilhado pelos servidores para replicação e failover "
+                             "(padrão: variável de ambiente CHAT_PEER_SECRET)")
+    parser.add_argument('--replica-of', default=None, metavar='URL',
+                        help="Inicia como réplica somente leitura do primário nesta URL (ex.: http://localhost:8000)")
+    parser.add_argument('--failover-after', type=float, default=0,
+                        help="Segundos sem resposta do primário até a réplica se promover sozinha (padrão: 0, só com promote)")
+    parser.add_argument('--replication', action='store_true',
+                        help="Mantém o log de alterações para réplicas deste servidor (ativado sozinho com --replica-of, "
+                             "para a réplica poder ser promovida)")
+    parser.add_argument('--replication-log', type=int, default=LOG_LIMIT,
+                        help=f"Alterações mantidas em memória para as réplicas, com a replicação ativada (padrão: {LOG_LIMIT})")
+    parser.add_argument('--trace', default=None, metavar='ARQUIVO',
+                        help="Grava todas as chamadas RPC em um trace binário, para benchmarks/replay_trace.py")
+    parser.add_argument('--trace-full', action='store_true',
+                        help="No trace, grava os textos das mensagens e as senhas (padrão: só o tamanho); nunca o segredo do cluster")
+    parser.add_argument('--wire-port', type=int, default=None,
+                        help="Porta do protocolo JSON sobre TCP persistente (padrão: porta + 1000; -1 desativa)")
+    return parser.parse_args(argv)
+
+
+def create_rpc_server(args, chat_server):
+    # Monta o servidor XML-RPC no modo escolhido e ajusta o long-polling à capacidade de cada modo
+    address = (args.host, args.port)
+    if args.mode == 'single':
+        server = xmlrpc.server.SimpleXMLRPCServer(address, ChatRequestHandler, allow_none=True)
+        chat_server.max_wait = 0  # Uma requisição estacionada travaria todo o servidor
+    elif args.mode == 'pool':
+        server = PooledXMLRPCServer(address, workers=args.workers, queue_size=args.queue_size,
+                                    requestHandler=ChatRequestHandler, allow_none=True)
+        # Metade do pool, no máximo, pode ficar estacionada em long-polling
+        chat_server.wait_slots = threading.BoundedSemaphore(max(1, args.workers // 2))
+    else:
+        server = ThreadedXMLRPCServer(address, ChatRequestHandler, allow_none=True)
+    # Linhas de acesso HTTP só são montadas se o evento 'request' estiver ativo no log
+    server.event_log = chat_server.log
+    server.logRequests = chat_server.log.sampling.get('request', 1.0) > 0
+    server.register_instance(chat_server)
+    # system.multicall: o cliente pode agrupar várias chamadas independentes em uma única requisição
+    server.register_multicall_functions()
+    return server
+
+
+def is_overloaded(chat_server, rpc_server):
+    #Sobrecarga no momento: descartando quase todas as chamadas (2 * shed_at) ou com a fila do pool cheia.
+    if chat_server.shed_at and chat_server.in_flight >= 2 * chat_server.shed_at:
+        return True
+    return isinstance(rpc_server, PooledXMLRPCServer) and rpc_server.pending.full()
+
+
+def register_with_binder(chat_server, binder_url, address, port, interval, stop, rpc_server=None):
+    # Registra o servidor no binder e renova o lease com heartbeats contendo a carga atual.
+    # Se o binder ficar fora do ar (ou reiniciar e esquecer o registro), registra de novo quando voltar.
+    # Réplicas se registram como "chat_server_replica:<primário>"; ao serem promovidas, trocam de registro.
+    # Sobrecarregado por UNHEALTHY_BEATS heartbeats seguidos (ex.: pool travado), envia healthy=False e sai
+    # do binder; registra de novo quando a sobrecarga passar.
+    binder = xmlrpc.client.ServerProxy(binder_url, allow_none=True)
+    registered = None  # Nome com que a instância está registrada (None = não registrada)
+    overloaded = 0  # Heartbeats seguidos em sobrecarga
+    while not stop.is_set():
+        procedure = chat_server._binder_procedure()
+        overloaded = overloaded + 1 if is_overloaded(chat_server, rpc_server) else 0
+        healthy = overloaded < UNHEALTHY_BEATS
+        try:
+            if registered is not None and registered != procedure:
+                binder.unregister_procedure(registered, address, port)  # Promovida ou seguindo outro primário
+                registered = None
+            if registered is None:
+                if healthy:
+                    binder.register_procedure(procedure, address, port, True)
+                    registered = procedure
+                    print(f"Servidor registrado no binder {binder_url} como {address}:{port} ({procedure}).")
+            elif not binder.heartbeat(procedure, address, port, chat_server.get_load(), healthy):
+                registered = None
+                continue  # Binder não conhece mais esta instância: registra de novo imediatamente
+            elif not healthy:
+                registered = None  # O binder já removeu a instância
+                print(f"Servidor sobrecarregado há {overloaded} heartbeats: removido do binder até se recuperar.")
+            if procedure == 'chat_server':
+                # Mapa de shards atual; se mudou, o servidor redistribui as salas afetadas
+                chat_server._update_shard_map(binder.get_shard_map('chat_server'), f"{address}:{port}")
+        except (OSError, xmlrpc.client.Error) as e:
+            if registered is not None:
+                print(f"Falha ao contatar o binder: {e}")
+            registered = None
+        stop.wait(interval)
+    try:
+        binder.unregister_procedure(chat_server._binder_procedure(), address, port)
+    except (OSError, xmlrpc.client.Error):
+        pass
+
+
+def dump_metrics(chat_server, path, interval, stop):
+    # Regrava o arquivo de métricas a cada intervalo (ex.: para o coletor textfile do node_exporter)
+    while not stop.wait(interval):
+        try:
+            write_atomic(path, chat_server.metrics_text())
+        except OSError as e:
+            print(f"Erro ao gravar as métricas: {e}")
 
 
 def main():
-    
+    args = parse_args()
+    if args.replica_of and not args.peer_secret:
+        sys.exit("--replica-of exige o segredo do cluster (--peer-secret ou CHAT_PEER_SECRET).")
+
     # Configura o logger
-    ChatServer().setup_logger()
+    chat_server = ChatServer(data_dir=args.data_dir, fsync=args.fsync, compact_every=args.compact_every,
+                             history_limit=args.history_limit, room_idle_ttl=args.room_ttl,
+                             log_sampling=parse_sampling(args.log_sample), rate_limits=parse_limits(args.rate_limit),
+                             shed_at=args.shed_at if args.shed_at is not None else
+                             (args.workers if args.mode == 'pool' else 64),
+                             presence_ttl=args.presence_ttl, search_window=args.search_window,
+                             search_budget=args.search_budget,
+                             replication_log=args.replication_log if args.replication or args.replica_of else None)
+    chat_server._setup_logger(max_bytes=args.log_max_bytes)
+    if args.trace:
+        chat_server.tracer = TraceWriter(args.trace, full=args.trace_full)
+        print(f"Capturando as chamadas RPC em {args.trace}.")
 
     logging.basicConfig(level=logging.CRITICAL)  # Ignora logs repetitivos de requisição no server.
-    server = xmlrpc.server.SimpleXMLRPCServer(('localhost', 8000), allow_none=True)
-    server.register_instance(ChatServer())
-    print("Servidor de chat em execução na porta 8000...")
+    server = create_rpc_server(args, chat_server)
+    port = server.server_address[1]  # Porta real, inclusive quando --port 0 escolhe uma livre
+    print(f"Servidor de chat em execução na porta {port} (modo {args.mode})...")
+    chat_server.server_id = f"{args.host}:{port}"
+    chat_server.binder_url = args.binder
+    chat_server.peer_secret = args.peer_secret
+    if not args.peer_secret:
+        print("Sem --peer-secret: as salas não são transferidas entre servidores quando o mapa de shards muda.")
+    if args.replica_of:
+        # Réplica: somente leitura até ser promovida (promote ou --failover-after)
+        chat_server.follower = ReplicaFollower(chat_server, args.replica_of, chat_server.server_id,
+                                               failover_after=args.failover_after or None,
+                                               on_failover=chat_server._promote)
+        chat_server.follower.start()
+        print(f"Réplica de {args.replica_of}.")
+
+    if args.wire_port != -1:
+        # Protocolo JSON opcional: os clientes descobrem a porta com get_transports()
+        wire_port = args.wire_port
+        if wire_port is None:
+            wire_port = port + 1000 if args.port else 0  # Com --port 0, também escolhe uma porta livre
+        wire_server = WireServer((args.host, wire_port), chat_server._dispatch, STREAM_METHODS,
+                                 release=lambda subscriber: chat_server._unsubscribe(subscriber, None),
+                                 keepalive=args.presence_ttl)
+        chat_server.transports['json'] = wire_server.server_address[1]
+        threading.Thread(target=wire_server.serve_forever, name='wire', daemon=True).start()
+        print(f"Protocolo JSON na porta {wire_server.server_address[1]}.")
+
+    stop = threading.Event()
+    if args.metrics_file:
+        threading.Thread(target=dump_metrics, name='metrics', daemon=True,
+                         args=(chat_server, args.metrics_file, args.metrics_interval, stop)).start()
+    heartbeat = threading.Thread(target=register_with_binder, daemon=True,
+                                 args=(chat_server, args.binder, args.host, port, args.heartbeat, stop, server))
+    heartbeat.start()
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nServidor encerrado pelo administrador.")
-        # Deleta o arquivo JSON quando o servidor for encerrado
-        if os.path.exists('user_data.json'):
-            os.remove('user_data.json')
+        stop.set()
+        heartbeat.join(timeout=5)  # Sai do binder para os clientes não serem enviados a esta instância
+        chat_server._close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,254 @@
+import itertools
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import xmlrpc.client
+import zlib
+from concurrent.futures import Future
+
+from events import Subscriber, export_event
+from ratelimit import set_client_address
+
+# Protocolo JSON com prefixo de tamanho, alternativo ao XML-RPC, sobre uma conexão TCP persistente.
+# Cada quadro é um inteiro de 4 bytes (big-endian) com o tamanho, seguido do JSON em UTF-8
+# (comprimido com zlib a partir de COMPRESS_THRESHOLD bytes, indicado pelo bit mais alto do tamanho):
+#   requisição: {"id": 1, "method": "send_message", "params": [...]}
+#   resposta:   {"id": 1, "result": ...}  ou  {"id": 1, "error": {"code": 1, "message": "..."}}
+# O cliente pode enviar várias requisições sem esperar as respostas (pipelining); cada resposta
+# leva o id da requisição e pode chegar fora de ordem (um long-polling não segura as demais).
+# Depois de um "subscribe", o servidor também envia quadros sem id com os eventos das salas assinadas:
+#   {"events": [{"type": "message", "room": "...", "message": {...}}, {"type": "join", ...}]}
+# Com keepalive, esses quadros incluem um evento {"type": "ping"} a cada keepalive/3 segundos; o cliente
+# responde com heartbeat (renova a presença), e a conexão que para de confirmar os dados é derrubada pelo TCP.
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 16 * 1024 * 1024  # Quadros maiores indicam um cliente com defeito: a conexão é fechada
+MAX_IN_FLIGHT = 32  # Requisições em execução por conexão; as seguintes esperam (contrapressão)
+COMPRESSED = 0x80000000
+COMPRESS_THRESHOLD = 1400  # Mesmo limite do gzip do servidor XML-RPC: respostas pequenas vão sem compressão
+
+
+def encode_frame(payload):
+    data = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    if len(data) >= COMPRESS_THRESHOLD:
+        data = zlib.compress(data, 1)  # Nível 1: quase toda a redução por uma fração do custo de CPU
+        return HEADER.pack(len(data) | COMPRESSED) + data
+    return HEADER.pack(len(data)) + data
+
+
+def enable_keepalive(sock, timeout):
+    #Derruba a conexão cujo outro lado sumiu sem fechá-la: keepalive do TCP e, no Linux, timeout para dados enviados sem confirmação.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(timeout / 3)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(timeout / 6)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(timeout * 1000))
+
+
+def read_frame(stream):
+    #Lê um quadro do arquivo (socket.makefile). Retorna None quando a conexão é fechada.
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (size,) = HEADER.unpack(header)
+    compressed = size & COMPRESSED
+    size &= ~COMPRESSED
+    if size > MAX_FRAME:
+        raise ValueError(f"Quadro de {size} bytes excede o limite.")
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    if compressed:
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(data, MAX_FRAME)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Quadro descomprimido excede o limite.")
+    return json.loads(data)
+
+
+class WireHandler(socketserver.StreamRequestHandler):
+    # Uma instância por conexão: lê as requisições em sequência e executa cada uma em sua própria thread
+
+    def handle(self):
+        self.write_lock = threading.Lock()  # Respostas de threads diferentes não se misturam no socket
+        self.in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+        self.subscriber = None  # Criado no primeiro subscribe desta conexão
+        self.subscriber_lock = threading.Lock()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.server.keepalive:
+            enable_keepalive(self.request, self.server.keepalive)
+        try:
+            while True:
+                try:
+                    request = read_frame(self.rfile)
+                except (OSError, ValueError):
+                    return
+                if request is None:
+                    return
+                self.in_flight.acquire()
+                threading.Thread(target=self.process, args=(request,), daemon=True).start()
+        finally:
+            if self.subscriber is not None:
+                self.server.release(self.subscriber)
+                self.subscriber.close()
+
+    def call(self, method, params):
+        # Métodos de streaming também passam pelo dispatch comum, que recebe o assinante da conexão
+        if method not in self.server.stream_methods:
+            return self.server.dispatch(method, params)
+        username = params[0]
+        with self.subscriber_lock:
+            if self.subscriber is None:
+                self.subscriber = Subscriber(username)
+                threading.Thread(target=self.push_events, name='wire-push', daemon=True).start()
+            elif self.subscriber.username != username:
+                raise Exception("A conexão já assina eventos de outro usuário.")
+        return self.server.dispatch(method, params, self.subscriber)
+
+    def push_events(self):
+        # Envia os eventos do assinante em lotes: um quadro por rodada, com tudo o que acumulou.
+        # O ping vai junto com os eventos, mesmo com a conexão ocupada: só a resposta do cliente renova a presença
+        subscriber = self.subscriber
+        interval = self.server.keepalive / 3 if self.server.keepalive else None
+        next_ping = time.monotonic() + interval if interval else None
+        try:
+            while True:
+                batch = subscriber.next_batch(max(0, next_ping - time.monotonic()) if interval else None)
+                if batch is None:
+                    break
+                events = [export_event(event) for event in batch]
+                if interval and time.monotonic() >= next_ping:
+                    events.append({'type': 'ping'})
+                    next_ping = time.monotonic() + interval
+                if not events:
+                    continue
+                frame = encode_frame({'events': events})
+                with self.write_lock:
+                    self.wfile.write(frame)
+            if subscriber.dropped:
+                # Consumidor lento: avisa e desconecta; o cliente assina de novo a partir do cursor
+                with self.write_lock:
+                    self.wfile.write(encode_frame({'events': [{'type': 'dropped'}]}))
+                self.request.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            # Conexão encerrada ou sem confirmar os dados enviados (TCP_USER_TIMEOUT): libera também a leitura
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def process(self, request):
+        set_client_address(self.client_address[0])  # Limites por endereço das chamadas sem usuário
+        try:
+            try:
+                result = self.call(request['method'], request.get('params', []))
+                response = {'id': request.get('id'), 'result': result}
+            except Exception as e:
+                # Mesmo texto de erro do XML-RPC, para o cliente tratar os dois transportes igualmente
+                response = {'id': request.get('id'), 'error': {'code': 1, 'message': f"{type(e)}:{e}"}}
+            frame = encode_frame(response)
+            with self.write_lock:
+                self.wfile.write(frame)
+        except OSError:
+            pass  # Cliente desconectou antes da resposta
+        finally:
+            self.in_flight.release()
+
+
+class WireServer(socketserver.ThreadingTCPServer):
+    # Atende o protocolo JSON chamando dispatch(method, params) — o mesmo ponto de entrada do XML-RPC.
+    # Os métodos de streaming são chamados como dispatch(method, params, subscriber), com o assinante da conexão
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, dispatch, stream_methods=(), release=None, keepalive=None):
+        self.dispatch = dispatch
+        self.stream_methods = set(stream_methods)  # Nomes dos métodos que recebem o assinante da conexão
+        # release(subscriber): cancela as assinaturas quando a conexão é encerrada (sem passar pelo dispatch,
+        # para que limites e descarte de carga nunca deixem assinaturas órfãs)
+        self.release = release
+        self.keepalive = keepalive  # Segundos: pings no streaming e limite para detectar conexões mortas
+        super().__init__(address, WireHandler)
+
+
+class WireProxy:
+    # Cliente do protocolo JSON com a mesma interface do xmlrpc.client.ServerProxy (proxy.metodo(...)).
+    # É seguro entre threads: todas compartilham a conexão, e call_async permite pipelining.
+    # on_event(events) recebe cada lote de eventos de streaming, e on_event(None) quando a conexão cai.
+
+    def __init__(self, host, port, timeout=None, on_event=None):
+        self.on_event = on_event
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.ids = itertools.count(1)
+        self.pending = {}  # id -> Future aguardando a resposta
+        self.lock = threading.Lock()  # Protege pending e closed
+        # Envio com lock próprio: um sendall bloqueado não impede a leitura das respostas
+        self.send_lock = threading.Lock()
+        self.closed = False
+        self.reader = threading.Thread(target=self.read_loop, name='wire-reader', daemon=True)
+        self.reader.start()
+
+    def call_async(self, method, *params):
+        #Envia a requisição sem esperar a resposta; retorna um Future com o resultado.
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Conexão com o servidor fechada.")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+        frame = encode_frame({'id': request_id, 'method': method, 'params': list(params)})
+        with self.send_lock:
+            self.sock.sendall(frame)
+        return future
+
+    def call(self, method, *params):
+        return self.call_async(method, *params).result()
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *params: self.call(method, *params)
+
+    def read_loop(self):
+        # Entrega cada resposta ao Future da requisição correspondente
+        try:
+            while True:
+                response = read_frame(self.rfile)
+                if response is None:
+                    break
+                if 'events' in response:
+                    if self.on_event is not None:
+                        self.on_event(response['events'])
+                    continue
+                with self.lock:
+                    future = self.pending.pop(response['id'], None)
+                if future is None:
+                    continue
+                if 'error' in response:
+                    future.set_exception(xmlrpc.client.Fault(response['error']['code'], response['error']['message']))
+                else:
+                    future.set_result(response['result'])
+        except (OSError, ValueError):
+            pass
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Conexão com o servidor fechada."))
+        if self.on_event is not None:
+            self.on_event(None)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()